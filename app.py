@@ -1,15 +1,30 @@
+import importlib
 import os
+import sys
+import time
 from datetime import datetime
+from types import ModuleType
 from typing import Generator, List, Optional
 
 from dotenv import load_dotenv
-from fastapi import Depends, FastAPI, HTTPException, status
+from fastapi import Depends, FastAPI, HTTPException, Request, status
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse, Response
+from starlette.concurrency import run_in_threadpool
 from pydantic import BaseModel, Field
 from sqlalchemy import TIMESTAMP, Column, Integer, String, Text, create_engine
 from sqlalchemy.orm import Session, declarative_base, sessionmaker
 
-from main import answer_question, reset_user_memory
+from metrics import PROMETHEUS_CONTENT_TYPE
+from scheduler import (
+    DEFAULT_MAX_CONCURRENCY,
+    DEFAULT_MAX_QUEUE_PER_USER,
+    DEFAULT_MAX_QUEUED,
+    FairScheduler,
+    SchedulerFull,
+)
+from startup import Warmup
+from tracing import TRACING_ENABLED, inc, observe, render_prometheus, request_trace, stage
 
 load_dotenv()
 
@@ -66,9 +81,16 @@ class ChatRecord(BaseModel):
         orm_mode = True
 
 
+class RetrievalFilter(BaseModel):
+    source: List[str] = Field(default_factory=list)
+    section: List[str] = Field(default_factory=list)
+    entity: List[str] = Field(default_factory=list)
+
+
 class ChatRequest(BaseModel):
     user_id: str
     question: str
+    filter: Optional[RetrievalFilter] = None
 
 
 class ChatResponse(BaseModel):
@@ -100,10 +122,70 @@ app.add_middleware(
 )
 
 
+@app.middleware("http")
+async def medir_requisicao(request: Request, call_next):
+    if not TRACING_ENABLED:
+        return await call_next(request)
+
+    start = time.perf_counter()
+    response = await call_next(request)
+    # Rota do FastAPI (com parâmetros) para não criar uma série por usuário
+    route = getattr(request.scope.get("route"), "path", "desconhecida")
+    observe("http_request_seconds", time.perf_counter() - start,
+            method=request.method, route=route, status=str(response.status_code))
+    return response
+
+
+def _import_pipeline() -> ModuleType:
+    # LangChain, FAISS, modelo de embeddings e SDK do Gemini só entram com o ``main``
+    return importlib.import_module("main")
+
+
+def _warmup_steps() -> list:
+    steps = [
+        ("imports", _import_pipeline),
+        ("embeddings", lambda: _import_pipeline().get_embeddings_model()),
+        ("indice", lambda: _import_pipeline().get_retrieval_index()),
+        ("llm", lambda: _import_pipeline().get_llm()),
+    ]
+
+    poll_interval = float(os.getenv("SOURCE_SYNC_POLL_SECONDS", "0") or 0)
+    if poll_interval > 0:
+        steps.append(("agendador", lambda: _import_pipeline().start_source_scheduler(poll_interval)))
+    return steps
+
+
+CHAT_SCHEDULING = os.getenv("CHAT_SCHEDULING", "1").strip().lower() not in {"0", "false"}
+CHAT_SCHEDULER = FairScheduler(
+    max_concurrency=int(os.getenv("CHAT_MAX_CONCURRENCY", str(DEFAULT_MAX_CONCURRENCY))),
+    max_queue_per_user=int(os.getenv("CHAT_MAX_QUEUE_PER_USER", str(DEFAULT_MAX_QUEUE_PER_USER))),
+    max_queued=int(os.getenv("CHAT_MAX_QUEUED", str(DEFAULT_MAX_QUEUED))),
+)
+
+WARMUP = Warmup(_warmup_steps())
+WARMUP_ENABLED = os.getenv("STARTUP_WARMUP", "1").strip().lower() not in {"0", "false"}
+
+
+def _pipeline() -> ModuleType:
+    """Módulo ``main``; durante o aquecimento espera por ele em vez de construir o índice em paralelo."""
+    WARMUP.wait()
+    return _import_pipeline()
+
+
+def _reset_user_memory(user_id: str) -> None:
+    # Sem o ``main`` carregado ainda não há memória de conversa para limpar; se o aquecimento
+    # estiver no meio do import, ``import_module`` espera o módulo terminar de inicializar
+    if "main" in sys.modules:
+        _import_pipeline().reset_user_memory(user_id)
+
+
 @app.on_event("startup")
 def startup_event() -> None:
     criar_tabelas()
 
+    if WARMUP_ENABLED:
+        WARMUP.start()
+
 
 def _extract_sources(raw_response: dict) -> List[SourceSnippet]:
     sources: List[SourceSnippet] = []
@@ -137,6 +219,26 @@ def health_check() -> dict:
     return {"status": "ok"}
 
 
+@app.get("/api/ready")
+def readiness_check() -> JSONResponse:
+    if not WARMUP_ENABLED:
+        return JSONResponse({"status": "ready", "warmup": "desativado"})
+
+    warmup = WARMUP.status()
+    if warmup["ready"]:
+        return JSONResponse({"status": "ready", **warmup})
+    failed = any(step["status"] == "erro" for step in warmup["steps"])
+    return JSONResponse(
+        {"status": "error" if failed else "warming_up", **warmup},
+        status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+    )
+
+
+@app.get("/api/metrics")
+def metricas() -> Response:
+    return Response(content=render_prometheus(), media_type=PROMETHEUS_CONTENT_TYPE)
+
+
 @app.get("/api/history/{user_id}", response_model=List[ChatRecord])
 def listar_historico(
     user_id: str,
@@ -170,10 +272,45 @@ def listar_historico(
     ]
 
 
+def _responder(session: Session, user_id: str, question: str, filters: Optional[dict]) -> ChatResponse:
+    with request_trace("chat"):
+        raw_response = _pipeline().answer_question(question, user_id=user_id, filters=filters)
+        answer = raw_response.get("answer") if isinstance(raw_response, dict) else str(raw_response)
+
+        if isinstance(raw_response, dict):
+            sources = _extract_sources(raw_response)
+        else:
+            sources = []
+
+        if answer is None:
+            raise HTTPException(
+                status_code=status.HTTP_502_BAD_GATEWAY,
+                detail="Não foi possível obter uma resposta do modelo.",
+            )
+
+        with stage("persist"):
+            registro = _persist_chat(session, user_id, question, answer)
+
+    return ChatResponse(
+        id=registro.id,
+        user_id=registro.user_id,
+        question=registro.pergunta,
+        answer=registro.resposta,
+        created_at=registro.created_at,
+        sources=sources,
+    )
+
+
+def _responder_with_own_session(user_id: str, question: str, filters: Optional[dict]) -> ChatResponse:
+    session = SessionLocal()
+    try:
+        return _responder(session, user_id, question, filters)
+    finally:
+        session.close()
+
+
 @app.post("/api/chat", response_model=ChatResponse, status_code=status.HTTP_201_CREATED)
-def enviar_pergunta(
-    payload: ChatRequest, session: Session = Depends(get_db)
-) -> ChatResponse:
+async def enviar_pergunta(payload: ChatRequest) -> ChatResponse:
     user_id = payload.user_id.strip()
     question = payload.question.strip()
 
@@ -189,31 +326,28 @@ def enviar_pergunta(
             detail="A pergunta não pode estar vazia.",
         )
 
-    raw_response = answer_question(question, user_id=user_id)
-    answer = raw_response.get("answer") if isinstance(raw_response, dict) else str(raw_response)
+    filters = payload.filter.dict() if payload.filter else None
+    # A thread abre a própria sessão: a de uma dependência seria fechada ao
+    # desconectar o cliente, enquanto a thread ainda grava a conversa
+    if not CHAT_SCHEDULING:
+        return await run_in_threadpool(_responder_with_own_session, user_id, question, filters)
 
-    if isinstance(raw_response, dict):
-        sources = _extract_sources(raw_response)
-    else:
-        sources = []
-
-    if answer is None:
+    # Uma pergunta por vez por usuário, vagas globais em rodízio entre os usuários
+    try:
+        # A vaga fica ocupada até a thread terminar, mesmo se o cliente desconectar antes
+        queue_seconds, response = await CHAT_SCHEDULER.run(
+            user_id, lambda: run_in_threadpool(_responder_with_own_session, user_id, question, filters)
+        )
+        observe("chat_queue_seconds", queue_seconds)
+        return response
+    except SchedulerFull as e:
+        inc("chat_rejected_total", reason=e.reason)
         raise HTTPException(
-            status_code=status.HTTP_502_BAD_GATEWAY,
-            detail="Não foi possível obter uma resposta do modelo.",
+            status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+            detail=str(e),
+            headers={"Retry-After": str(e.retry_after)},
         )
 
-    registro = _persist_chat(session, user_id, question, answer)
-
-    return ChatResponse(
-        id=registro.id,
-        user_id=registro.user_id,
-        question=registro.pergunta,
-        answer=registro.resposta,
-        created_at=registro.created_at,
-        sources=sources,
-    )
-
 
 @app.post("/api/reset/{user_id}", status_code=status.HTTP_204_NO_CONTENT)
 def resetar_conversa(user_id: str) -> None:
@@ -224,7 +358,7 @@ def resetar_conversa(user_id: str) -> None:
             detail="Informe um identificador de usuário válido.",
         )
 
-    reset_user_memory(clean_user_id)
+    _reset_user_memory(clean_user_id)
 
 
 @app.delete("/api/history/{user_id}", status_code=status.HTTP_204_NO_CONTENT)
@@ -238,4 +372,4 @@ def apagar_historico(user_id: str, session: Session = Depends(get_db)) -> None:
 
     session.query(ChatHistory).filter_by(user_id=clean_user_id).delete()
     session.commit()
-    reset_user_memory(clean_user_id)
+    _reset_user_memory(clean_user_id)
@@ -3,13 +3,13 @@ Sistema de Batch Processing para processamento em larga escala de documentos
 Implementa processamento em lotes otimizado para milhares de documentos
 """
 
-import asyncio
+import itertools
+import random
 import time
 import logging
-from typing import List, Dict, Any, Optional, Callable
+from typing import List, Dict, Any, Optional, Callable, Iterable, Iterator, Tuple
 from pathlib import Path
-from concurrent.futures import ThreadPoolExecutor, as_completed
-from dataclasses import dataclass
+from dataclasses import dataclass, field
 from datetime import datetime
 import json
 import os
@@ -17,23 +17,67 @@ from threading import Lock
 import queue
 import threading
 
-from main import processar_pergunta, get_llm, retriever
-from langchain_core.messages import HumanMessage
+from main import answer_question, reset_user_memory
+from rate_control import (
+    OUTCOME_SUCCESS,
+    OUTCOME_THROTTLED,
+    RETRYABLE_OUTCOMES,
+    RateController,
+    RetryPolicy,
+    classify_error,
+)
+from chunking import iter_text_chunks
+from metrics import LatencyHistogram, ShardedMetrics, format_counter, format_histogram, render_lines, start_metrics_server
+from job_manifest import (
+    DEFAULT_JOBS_DIR,
+    STATUS_DONE,
+    STATUS_FAILED,
+    STATUS_PENDING,
+    JobManifest,
+    hash_file,
+    hash_text,
+)
+from result_writer import load_completed_ids, open_result_writer
+from result_cache import CacheBackend, LRUCache, SQLiteCache, TieredCache, make_cache_key
 
 # Configuração de logging específica para batch processing
 batch_logger = logging.getLogger("batch_processor")
 batch_logger.setLevel(logging.INFO)
 
+# Marcador de fim de fila (produtor -> workers e workers -> consumidor)
+_SENTINEL = object()
+_QUEUE_POLL_INTERVAL = 0.1
+
+# Contadores mantidos em ``BatchProcessor.metrics``
+_COUNTER_NAMES = ('total_processed', 'successful', 'failed', 'cache_hits', 'retries', 'throttled', 'llm_calls')
+
 @dataclass
 class BatchItem:
     """Item individual para processamento em lote"""
     id: str
     content: str
-    metadata: Dict[str, Any]
+    metadata: Dict[str, Any] = field(default_factory=dict)
     priority: int = 1
     retry_count: int = 0
     max_retries: int = 3
 
+@dataclass
+class BatchProgress:
+    """Andamento de uma execução em lote"""
+    processed: int
+    total: Optional[int]
+    successful: int
+    failed: int
+    elapsed: float
+    items_per_second: float
+    eta_seconds: Optional[float]
+    p50: Optional[float]
+    p95: Optional[float]
+    p99: Optional[float]
+    queue_depth: int
+    concurrency_limit: int
+    running: bool
+
 @dataclass
 class BatchResult:
     """Resultado do processamento de um item"""
@@ -44,6 +88,57 @@ class BatchResult:
     processing_time: float = 0.0
     timestamp: str = ""
 
+
+def _result_to_dict(result: BatchResult) -> Dict[str, Any]:
+    """Converte um ``BatchResult`` em dicionário serializável"""
+    return {
+        'item_id': result.item_id,
+        'success': result.success,
+        'result': result.result,
+        'error': result.error,
+        'processing_time': result.processing_time,
+        'timestamp': result.timestamp
+    }
+
+
+def _serialize_sources(raw_response: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """Converte os documentos de origem da cadeia RAG em dicionários serializáveis"""
+    sources = []
+    for document in raw_response.get("source_documents") or []:
+        metadata = getattr(document, "metadata", {}) or {}
+        snippet = getattr(document, "page_content", "") or ""
+        sources.append({
+            'source': metadata.get("source") or metadata.get("file_path") or metadata.get("file"),
+            'page': metadata.get("page") or metadata.get("page_number"),
+            'snippet': snippet[:400].strip() or None,
+        })
+    return sources
+
+
+def answer_batch_item(item: BatchItem) -> Dict[str, Any]:
+    """
+    Função de processamento padrão: responde ao conteúdo do item com o pipeline RAG
+
+    Cada item usa um usuário próprio (``metadata['user_id']`` ou ``batch-<id>``)
+    para que o histórico de conversa de um item não contamine os demais; a
+    memória é descartada ao final para não acumular cadeias em ``main``.
+    """
+    user_id = item.metadata.get('user_id') or f"batch-{item.id}"
+    try:
+        raw_response = answer_question(item.content, user_id=user_id)
+    finally:
+        reset_user_memory(user_id)
+
+    if not isinstance(raw_response, dict):
+        return {'question': item.content, 'answer': str(raw_response), 'sources': []}
+
+    return {
+        'question': item.content,
+        'answer': raw_response.get("answer"),
+        'sources': _serialize_sources(raw_response),
+    }
+
+
 class BatchProcessor:
     """Processador em lotes otimizado para grande volume de documentos"""
     
@@ -51,89 +146,159 @@ class BatchProcessor:
                  batch_size: int = 50,
                  max_workers: int = 4,
                  rate_limit: float = 1.0,  # Requisições por segundo
-                 enable_caching: bool = True):
+                 enable_caching: bool = True,
+                 burst: Optional[float] = None,
+                 adaptive_concurrency: bool = True,
+                 latency_target: Optional[float] = None,
+                 retry_policy: Optional[RetryPolicy] = None,
+                 cache_backend: Optional[CacheBackend] = None,
+                 cache_path: Optional[str] = None,
+                 cache_max_bytes: int = 64 * 1024 * 1024,
+                 cache_version: Optional[str] = None):
         """
         Inicializa o processador em lotes
         
         Args:
-            batch_size: Tamanho do lote para processamento
+            batch_size: Capacidade da fila de processamento; o produtor bloqueia
+                quando há ``batch_size`` itens pendentes (backpressure)
             max_workers: Número máximo de threads
-            rate_limit: Limite de requisições por segundo
+            rate_limit: Limite médio de requisições por segundo (0 desativa)
             enable_caching: Habilitar cache de resultados
+            burst: Rajada máxima de requisições acima da taxa média (padrão: ``rate_limit``)
+            adaptive_concurrency: Ajustar a concorrência (AIMD) conforme latência e 429/5xx
+            latency_target: Latência (s) acima da qual a concorrência é reduzida
+            retry_policy: Política de backoff para erros de throttling/servidor
+            cache_backend: Backend de cache já configurado (tem precedência sobre os demais)
+            cache_path: Arquivo SQLite para persistir o cache entre execuções e processos
+            cache_max_bytes: Orçamento de memória do cache LRU
+            cache_version: Versão extra incluída na chave de cache de funções customizadas
         """
-        self.batch_size = batch_size
-        self.max_workers = max_workers
+        self.batch_size = max(1, batch_size)
+        self.max_workers = max(1, max_workers)
         self.rate_limit = rate_limit
         self.enable_caching = enable_caching
         
         # Cache e controle de estado
-        self.cache = {} if enable_caching else None
-        self.cache_lock = Lock()
-        
-        # Controle de rate limiting
-        self.last_request_time = 0
-        self.rate_lock = Lock()
-        
-        # Estatísticas
-        self.stats = {
-            'total_processed': 0,
-            'successful': 0,
-            'failed': 0,
-            'cache_hits': 0,
-            'total_time': 0.0,
-            'start_time': None
-        }
+        self.cache_version = cache_version
+        self._cache_versions: Dict[str, Optional[str]] = {}
+        if not enable_caching:
+            self.cache = None
+        elif cache_backend is not None:
+            self.cache = cache_backend
+        elif cache_path:
+            self.cache = TieredCache(LRUCache(cache_max_bytes), SQLiteCache(cache_path))
+        else:
+            self.cache = LRUCache(cache_max_bytes)
+        
+        # Controle de taxa: token bucket + concorrência adaptativa + retry
+        self.rate_controller = RateController(
+            rate_limit=rate_limit,
+            burst=burst,
+            max_concurrency=self.max_workers,
+            adaptive=adaptive_concurrency,
+            latency_target=latency_target,
+            retry_policy=retry_policy,
+        )
+        
+        # Estatísticas: contadores e histogramas por worker, agregados na leitura
+        self.metrics = ShardedMetrics()
+        self._run_started: Optional[float] = None
+        self._run_finished: Optional[float] = None
+        self._run_total: Optional[int] = None
+        self._run_base: Dict[str, float] = {}
+        self._run_latency_base = LatencyHistogram()
         
-        # Fila de processamento
-        self.processing_queue = queue.Queue()
-        self.results_queue = queue.Queue()
+        # Filas de processamento: a de entrada é limitada (backpressure) e a de
+        # saída transmite os resultados ao consumidor conforme ficam prontos
+        self.processing_queue = queue.Queue(maxsize=self.batch_size)
+        self.results_queue = queue.Queue(maxsize=self.batch_size)
         
         batch_logger.info(f"BatchProcessor inicializado: batch_size={batch_size}, workers={max_workers}")
 
-    def _apply_rate_limit(self):
-        """Aplica rate limiting para evitar sobrecarga da API"""
-        if self.rate_limit <= 0:
-            return
-            
-        with self.rate_lock:
-            current_time = time.time()
-            time_since_last = current_time - self.last_request_time
-            min_interval = 1.0 / self.rate_limit
-            
-            if time_since_last < min_interval:
-                sleep_time = min_interval - time_since_last
-                time.sleep(sleep_time)
+    def _call_with_rate_control(self, 
+                                item: BatchItem, 
+                                processing_function: Callable[[BatchItem], Any]) -> Any:
+        """
+        Executa a função de processamento respeitando o controle de taxa
+        
+        Erros de throttling (429) e de servidor (5xx) são repetidos com backoff
+        exponencial e jitter até ``item.max_retries``; a espera do backoff
+        acontece fora da vaga de concorrência para não bloquear outros workers.
+        """
+        while True:
+            self.rate_controller.acquire()
+            self.metrics.inc('llm_calls')
+            start_time = time.monotonic()
+            try:
+                result = processing_function(item)
+            except Exception as e:
+                outcome = classify_error(e)
+                self.rate_controller.release(outcome, time.monotonic() - start_time)
+                
+                if outcome == OUTCOME_THROTTLED:
+                    self.metrics.inc('throttled')
+                if outcome not in RETRYABLE_OUTCOMES or item.retry_count >= item.max_retries:
+                    raise
+                
+                item.retry_count += 1
+                self.metrics.inc('retries')
+                delay = self.rate_controller.retry_policy.delay(item.retry_count, e)
+                batch_logger.warning(f"Item {item.id}: {outcome} ({str(e)}); tentativa "
+                                     f"{item.retry_count}/{item.max_retries} em {delay:.2f}s")
+                time.sleep(delay)
+                continue
             
-            self.last_request_time = time.time()
+            latency = time.monotonic() - start_time
+            self.rate_controller.release(OUTCOME_SUCCESS, latency)
+            self.metrics.observe('llm_call_seconds', latency)
+            return result
+
+    def _resolve_cache_versions(self, processing_function: Callable[[BatchItem], Any]) -> Dict[str, Optional[str]]:
+        """Versões que compõem a chave de cache: prompt/modelo/corpus para o RAG, nome da função caso contrário"""
+        if processing_function is answer_batch_item or getattr(processing_function, 'rag_pipeline', False):
+            import main
+            return {
+                'prompt_version': main.PROMPT_VERSION,
+                'model_version': main.LLM_MODEL_NAME,
+                'corpus_version': main.get_corpus_version(),
+            }
+        
+        function_name = getattr(processing_function, '__qualname__', type(processing_function).__qualname__)
+        module_name = getattr(processing_function, '__module__', None) or type(processing_function).__module__
+        return {
+            'function': f"{module_name}.{function_name}",
+            'cache_version': self.cache_version,
+        }
 
     def _get_cache_key(self, content: str) -> str:
-        """Gera chave única para cache baseada no conteúdo"""
-        import hashlib
-        return hashlib.md5(content.encode()).hexdigest()
+        """Gera chave única para cache baseada no conteúdo e nas versões de prompt/modelo/corpus"""
+        return make_cache_key(content, **self._cache_versions)
 
     def _check_cache(self, content: str) -> Optional[Any]:
         """Verifica se resultado está em cache"""
-        if not self.enable_caching:
+        if self.cache is None:
             return None
             
         cache_key = self._get_cache_key(content)
-        with self.cache_lock:
-            if cache_key in self.cache:
-                self.stats['cache_hits'] += 1
-                batch_logger.debug(f"Cache hit para item: {cache_key[:8]}...")
-                return self.cache[cache_key]
-        return None
+        cached = self.cache.get(cache_key)
+        if cached is not None:
+            self.metrics.inc('cache_hits')
+            batch_logger.debug(f"Cache hit para item: {cache_key[:8]}...")
+        return cached
 
     def _store_cache(self, content: str, result: Any):
         """Armazena resultado no cache"""
-        if not self.enable_caching:
+        if self.cache is None or result is None:
             return
             
-        cache_key = self._get_cache_key(content)
-        with self.cache_lock:
-            self.cache[cache_key] = result
+        try:
+            self.cache.set(self._get_cache_key(content), result)
+        except (TypeError, ValueError) as e:
+            batch_logger.debug(f"Resultado não serializável, ignorado pelo cache: {str(e)}")
 
-    def _process_single_item(self, item: BatchItem) -> BatchResult:
+    def _process_single_item(self, 
+                             item: BatchItem, 
+                             processing_function: Callable[[BatchItem], Any]) -> BatchResult:
         """Processa um único item"""
         start_time = time.time()
         
@@ -149,11 +314,7 @@ class BatchProcessor:
                     timestamp=datetime.now().isoformat()
                 )
             
-            # Aplicar rate limiting
-            self._apply_rate_limit()
-            
-            # Processar item usando o sistema principal
-            result = processar_pergunta(item.content)
+            result = self._call_with_rate_control(item, processing_function)
             
             # Armazenar no cache
             self._store_cache(item.content, result)
@@ -177,140 +338,451 @@ class BatchProcessor:
                 timestamp=datetime.now().isoformat()
             )
 
-    def _process_batch_worker(self, batch: List[BatchItem]) -> List[BatchResult]:
-        """Worker que processa um lote de itens"""
-        results = []
+    def _record_result(self, result: BatchResult):
+        """Atualiza as estatísticas com o resultado de um item (shard da thread corrente, sem lock)"""
+        self.metrics.inc('total_processed')
+        self.metrics.inc('successful' if result.success else 'failed')
+        self.metrics.observe('item_seconds', result.processing_time)
+
+    @staticmethod
+    def _put(target: queue.Queue, value: Any, stop_event: threading.Event) -> bool:
+        """Insere na fila bloqueando enquanto estiver cheia; desiste se a execução for interrompida"""
+        while not stop_event.is_set():
+            try:
+                target.put(value, timeout=_QUEUE_POLL_INTERVAL)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    @staticmethod
+    def _get(source: queue.Queue, stop_event: threading.Event) -> Any:
+        """Retira da fila bloqueando enquanto estiver vazia; devolve o marcador de fim se interrompido"""
+        while not stop_event.is_set():
+            try:
+                return source.get(timeout=_QUEUE_POLL_INTERVAL)
+            except queue.Empty:
+                continue
+        return _SENTINEL
+
+    def _producer(self, items: Iterable[BatchItem], stop_event: threading.Event, errors: List[BaseException]):
+        """Alimenta a fila de processamento item a item, respeitando a capacidade da fila"""
+        try:
+            for item in items:
+                if not self._put(self.processing_queue, item, stop_event):
+                    return
+        except BaseException as e:  # erro ao gerar itens (ex.: leitura de arquivo)
+            batch_logger.error(f"Erro ao gerar itens para processamento: {str(e)}")
+            errors.append(e)
+        finally:
+            for _ in range(self.max_workers):
+                self._put(self.processing_queue, _SENTINEL, stop_event)
+
+    def _worker(self, processing_function: Callable[[BatchItem], Any], stop_event: threading.Event):
+        """Worker que retira itens da fila um a um até receber o marcador de fim"""
+        try:
+            while True:
+                item = self._get(self.processing_queue, stop_event)
+                if item is _SENTINEL:
+                    break
+                
+                result = self._process_single_item(item, processing_function)
+                self._record_result(result)
+                batch_logger.debug(f"Processado item {item.id}: {'✓' if result.success else '✗'}")
+                
+                if not self._put(self.results_queue, result, stop_event):
+                    break
+        finally:
+            self._put(self.results_queue, _SENTINEL, stop_event)
+
+    def iter_results(self, 
+                     items: Iterable[BatchItem], 
+                     processing_function: Optional[Callable[[BatchItem], Any]] = None,
+                     progress_callback: Optional[Callable[["BatchProgress"], None]] = None,
+                     progress_interval: float = 1.0,
+                     total_hint: Optional[int] = None) -> Iterator[BatchResult]:
+        """
+        Processa itens e devolve os resultados conforme ficam prontos
         
-        for item in batch:
-            result = self._process_single_item(item)
-            results.append(result)
-            
-            # Atualizar estatísticas
-            self.stats['total_processed'] += 1
-            if result.success:
-                self.stats['successful'] += 1
-            else:
-                self.stats['failed'] += 1
+        Um produtor insere os itens na ``processing_queue`` (limitada a
+        ``batch_size``) e ``max_workers`` threads retiram um item por vez, de modo
+        que nenhum worker fica ocioso enquanto houver trabalho pendente. Os
+        resultados saem pela ``results_queue`` na ordem de conclusão.
+        
+        Args:
+            items: Itens para processar (lista ou gerador)
+            processing_function: Função aplicada a cada item (padrão: ``answer_batch_item``)
+            progress_callback: Recebe um ``BatchProgress`` a cada ``progress_interval``
+                segundos e ao final da execução
+            progress_interval: Intervalo mínimo (s) entre chamadas do callback
+            total_hint: Estimativa do total de itens quando ``items`` é um gerador (para o ETA)
+        """
+        processing_function = processing_function or answer_batch_item
+        if self.cache is not None:
+            self._cache_versions = self._resolve_cache_versions(processing_function)
+        
+        self._run_total = len(items) if hasattr(items, '__len__') else total_hint
+        self._run_base = self.metrics.counters()
+        self._run_latency_base = self.metrics.histogram('item_seconds')
+        self._run_started = time.monotonic()
+        self._run_finished = None
+        self.processing_queue = queue.Queue(maxsize=self.batch_size)
+        self.results_queue = queue.Queue(maxsize=self.batch_size)
+        
+        stop_event = threading.Event()
+        producer_errors: List[BaseException] = []
+        
+        producer = threading.Thread(
+            target=self._producer,
+            args=(items, stop_event, producer_errors),
+            name="batch-producer",
+            daemon=True,
+        )
+        workers = [
+            threading.Thread(
+                target=self._worker,
+                args=(processing_function, stop_event),
+                name=f"batch-worker-{i + 1}",
+                daemon=True,
+            )
+            for i in range(self.max_workers)
+        ]
+        
+        producer.start()
+        for worker in workers:
+            worker.start()
+        
+        finished_workers = 0
+        last_report = time.monotonic()
+        try:
+            while finished_workers < self.max_workers:
+                result = self.results_queue.get()
+                if result is _SENTINEL:
+                    finished_workers += 1
+                    continue
                 
-            batch_logger.debug(f"Processado item {item.id}: {'✓' if result.success else '✗'}")
+                if progress_callback is not None and time.monotonic() - last_report >= progress_interval:
+                    last_report = time.monotonic()
+                    progress_callback(self.get_progress())
+                yield result
+        finally:
+            stop_event.set()
+            producer.join()
+            for worker in workers:
+                worker.join()
+            # os workers desta execução não escrevem mais: seus shards viram o agregado aposentado
+            self.metrics.retire_dead_shards()
+            self._run_finished = time.monotonic()
         
-        return results
+        if progress_callback is not None:
+            progress_callback(self.get_progress())
+        
+        if producer_errors:
+            raise producer_errors[0]
 
     def process_large_document(self, 
                              document_path: str, 
                              chunk_size: int = 1000,
-                             processing_function: Optional[Callable] = None) -> Dict[str, Any]:
+                             processing_function: Optional[Callable] = None,
+                             output_path: Optional[str] = None,
+                             chunk_overlap: int = 0,
+                             resume: bool = False) -> Dict[str, Any]:
         """
         Processa um documento grande dividindo em chunks
         
+        O arquivo é lido em blocos e cada chunk (cortado em limite de parágrafo,
+        frase ou palavra) entra na fila assim que é produzido, então a memória
+        não cresce com o tamanho do documento e os primeiros resultados saem
+        antes da leitura terminar.
+        
         Args:
             document_path: Caminho para o documento
-            chunk_size: Tamanho de cada chunk em caracteres
+            chunk_size: Tamanho máximo de cada chunk em caracteres
             processing_function: Função customizada de processamento
+            output_path: Arquivo ``.jsonl`` (ou diretório ``.parquet``) onde cada resultado
+                é gravado ao ficar pronto; quando informado, os resultados não são
+                mantidos em memória
+            chunk_overlap: Caracteres repetidos entre chunks consecutivos
+            resume: Pular chunks já concluídos em ``output_path`` e acrescentar ao arquivo
         """
         
         batch_logger.info(f"Iniciando processamento de documento grande: {document_path}")
         
-        # Ler documento
         document_path = Path(document_path)
         if not document_path.exists():
             raise FileNotFoundError(f"Documento não encontrado: {document_path}")
         
-        with open(document_path, 'r', encoding='utf-8') as f:
-            content = f.read()
+        reading = {'chunks': 0, 'characters': 0}
         
-        # Dividir em chunks
-        chunks = []
-        total_chars = len(content)
+        def generate_items() -> Iterator[BatchItem]:
+            for chunk in iter_text_chunks(document_path, chunk_size=chunk_size, overlap=chunk_overlap):
+                reading['chunks'] = chunk.number
+                reading['characters'] = chunk.end
+                yield BatchItem(
+                    id=f"chunk_{chunk.number}",
+                    content=chunk.text,
+                    metadata={
+                        'source_file': str(document_path),
+                        'chunk_start': chunk.start,
+                        'chunk_end': chunk.end,
+                        'chunk_number': chunk.number,
+                    }
+                )
+        
+        items = generate_items()
+        if resume and output_path:
+            items = self._skip_completed(items, load_completed_ids(output_path))
+        
+        # estimativa (em bytes) usada apenas para o ETA
+        estimated_chunks = max(1, document_path.stat().st_size // max(chunk_size - chunk_overlap, 1))
+        results = self._consume(
+            self.iter_results(items, processing_function, total_hint=estimated_chunks),
+            output_path,
+            append=resume,
+        )
+        
+        batch_logger.info(f"Documento dividido em {reading['chunks']} chunks de até {chunk_size} caracteres")
         
-        for i in range(0, total_chars, chunk_size):
-            chunk_text = content[i:i + chunk_size]
-            chunk_id = f"chunk_{i//chunk_size + 1}"
-            
-            chunks.append(BatchItem(
-                id=chunk_id,
-                content=chunk_text,
-                metadata={
-                    'source_file': str(document_path),
-                    'chunk_start': i,
-                    'chunk_end': min(i + chunk_size, total_chars),
-                    'chunk_number': i//chunk_size + 1,
-                    'total_chunks': (total_chars + chunk_size - 1) // chunk_size
-                }
-            ))
-        
-        batch_logger.info(f"Documento dividido em {len(chunks)} chunks de ~{chunk_size} caracteres")
-        
-        # Processar chunks em lotes
-        results = self.process_batch(chunks, processing_function)
-        
-        # Compilar resultado final
         return {
             'document_path': str(document_path),
-            'total_chunks': len(chunks),
-            'total_characters': total_chars,
+            'total_chunks': reading['chunks'],
+            'total_characters': reading['characters'],
             'chunk_size': chunk_size,
+            'output_path': output_path,
             'results': results,
             'summary': self.get_processing_summary()
         }
 
-    def process_batch(self, 
-                     items: List[BatchItem], 
-                     processing_function: Optional[Callable] = None) -> List[BatchResult]:
+    def _consume(self, 
+                 results: Iterator[BatchResult], 
+                 output_path: Optional[str], 
+                 append: bool = False) -> List[BatchResult]:
+        """Coleta os resultados em memória ou os grava um a um no arquivo de saída"""
+        if output_path is None:
+            return list(results)
+        
+        written = self.write_results(results, output_path, append=append)
+        batch_logger.info(f"{written} resultados gravados incrementalmente em: {output_path}")
+        return []
+
+    @staticmethod
+    def _skip_completed(items: Iterable[BatchItem], completed: set) -> Iterator[BatchItem]:
+        """Filtra itens cujo id já consta como concluído na saída anterior"""
+        skipped = 0
+        for item in items:
+            if item.id in completed:
+                skipped += 1
+                continue
+            yield item
+        if skipped:
+            batch_logger.info(f"Retomada: {skipped} itens já concluídos foram ignorados")
+
+    def process_to_file(self, 
+                        items: Iterable[BatchItem], 
+                        output_path: str,
+                        processing_function: Optional[Callable[[BatchItem], Any]] = None,
+                        resume: bool = True,
+                        progress_callback: Optional[Callable[[BatchProgress], None]] = None) -> Dict[str, Any]:
         """
-        Processa uma lista de itens em lotes
+        Processa itens gravando cada resultado na saída assim que fica pronto
+        
+        Com ``resume=True`` os ids que já constam com sucesso em ``output_path``
+        são pulados e os novos resultados são acrescentados ao arquivo, então
+        uma execução interrompida continua de onde parou.
         
         Args:
-            items: Lista de itens para processar
+            items: Itens para processar (lista ou gerador)
+            output_path: Arquivo ``.jsonl`` ou diretório ``.parquet``
             processing_function: Função customizada de processamento
+            resume: Pular itens já concluídos e acrescentar à saída existente
+            progress_callback: Callback de andamento (ver ``iter_results``)
         """
+        completed = load_completed_ids(output_path) if resume else set()
+        if completed:
+            items = self._skip_completed(items, completed)
         
-        self.stats['start_time'] = datetime.now()
-        batch_logger.info(f"Iniciando processamento em lotes: {len(items)} itens")
+        self._consume(
+            self.iter_results(items, processing_function, progress_callback),
+            output_path,
+            append=resume,
+        )
+        return {
+            'output_path': output_path,
+            'skipped': len(completed),
+            'summary': self.get_processing_summary()
+        }
+
+    def write_results(self, 
+                      results: Iterable[BatchResult], 
+                      output_path: str, 
+                      append: bool = False) -> int:
+        """Grava resultados (lista ou iterador de ``iter_results``) um a um; retorna quantos foram gravados"""
+        with open_result_writer(output_path, append=append) as writer:
+            for result in results:
+                writer.write(result)
+            return writer.written
+
+    def process_batch(self, 
+                     items: Iterable[BatchItem], 
+                     processing_function: Optional[Callable[[BatchItem], Any]] = None,
+                     progress_callback: Optional[Callable[[BatchProgress], None]] = None,
+                     progress_interval: float = 1.0) -> List[BatchResult]:
+        """
+        Processa uma coleção de itens e retorna todos os resultados
         
-        # Dividir em lotes
-        batches = [items[i:i + self.batch_size] for i in range(0, len(items), self.batch_size)]
-        batch_logger.info(f"Criados {len(batches)} lotes de até {self.batch_size} itens")
+        Args:
+            items: Itens para processar
+            processing_function: Função customizada de processamento
+            progress_callback: Callback de andamento (ver ``iter_results``)
+            progress_interval: Intervalo mínimo (s) entre chamadas do callback
+        """
         
-        all_results = []
+        total = len(items) if hasattr(items, '__len__') else None
+        batch_logger.info(f"Iniciando processamento em lotes: {total if total is not None else '?'} itens, "
+                          f"{self.max_workers} workers, fila de até {self.batch_size} itens")
         
-        # Processar lotes em paralelo
-        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
-            # Submeter todos os lotes
-            future_to_batch = {
-                executor.submit(self._process_batch_worker, batch): i 
-                for i, batch in enumerate(batches)
-            }
-            
-            # Coletar resultados conforme completam
-            for future in as_completed(future_to_batch):
-                batch_num = future_to_batch[future]
-                try:
-                    batch_results = future.result()
-                    all_results.extend(batch_results)
-                    
-                    batch_logger.info(f"Lote {batch_num + 1}/{len(batches)} concluído "
-                                    f"({len(batch_results)} itens)")
-                    
-                except Exception as e:
-                    batch_logger.error(f"Erro no lote {batch_num}: {str(e)}")
+        all_results = list(self.iter_results(items, processing_function, progress_callback, progress_interval))
         
-        self.stats['total_time'] = (datetime.now() - self.stats['start_time']).total_seconds()
         batch_logger.info(f"Processamento concluído: {len(all_results)} resultados")
         
         return all_results
 
+    def process_batch_grouped(self, 
+                              items: Iterable[BatchItem],
+                              group_llm_calls: bool = True,
+                              overlap_threshold: float = 0.5,
+                              max_group_size: int = 5,
+                              retrieval_batch_size: int = 256,
+                              cpu_workers: int = 0,
+                              progress_callback: Optional[Callable[[BatchProgress], None]] = None) -> List[BatchResult]:
+        """
+        Modo em lote nativo: recuperação vetorizada e uma chamada ao LLM por grupo
+        
+        A cada bloco de ``retrieval_batch_size`` perguntas, os embeddings são
+        gerados em uma chamada, a busca FAISS é feita em lote e perguntas com
+        contexto recuperado semelhante (Jaccard ≥ ``overlap_threshold``) são
+        agrupadas; cada grupo é respondido em uma única chamada estruturada e a
+        resposta é separada por item. Sem ``group_llm_calls`` cada pergunta tem
+        sua própria chamada, mas a recuperação continua em lote.
+        
+        As perguntas são independentes (sem histórico de conversa), como em
+        ``answer_batch_item``. Rate limiting, retries e cache se aplicam a cada
+        grupo, e as estatísticas do processador contam grupos.
+        
+        Com ``cpu_workers`` > 0 a recuperação (embeddings e BM25) roda em um
+        pool de processos (``hybrid_executor.HybridExecutor``), enquanto as
+        chamadas ao LLM continuam nas threads dos workers.
+        
+        Args:
+            items: Perguntas para processar
+            group_llm_calls: Responder grupos em uma única chamada ao LLM
+            overlap_threshold: Sobreposição mínima de chunks para agrupar perguntas
+            max_group_size: Máximo de perguntas por chamada ao LLM
+            retrieval_batch_size: Perguntas por chamada de embedding/busca
+            cpu_workers: Processos para as etapas de CPU da recuperação (0 = thread atual)
+            progress_callback: Callback de andamento (ver ``iter_results``)
+        """
+        from batch_retrieval import QuestionGroup, answer_group, group_by_overlap, retrieve_questions
+        
+        executor = None
+        if cpu_workers > 0:
+            import main
+            from hybrid_executor import HybridExecutor
+            
+            index = main.get_retrieval_index()
+            executor = HybridExecutor(
+                cpu_workers=cpu_workers,
+                io_workers=2,
+                embedding_model_name=main.EMBEDDING_MODEL_NAME,
+                bm25_corpus=[chunk.page_content for chunk in index.chunks],
+            )
+        
+        groups_by_unit: Dict[str, Any] = {}
+        unit_numbers = itertools.count(1)
+        
+        def generate_units() -> Iterator[BatchItem]:
+            source = iter(items)
+            while True:
+                block = list(itertools.islice(source, retrieval_batch_size))
+                if not block:
+                    break
+                
+                retrieved = retrieve_questions(block, executor=executor)
+                if group_llm_calls:
+                    groups = group_by_overlap(retrieved, overlap_threshold, max_group_size)
+                else:
+                    groups = [QuestionGroup(members=[question]) for question in retrieved]
+                batch_logger.info(f"{len(block)} perguntas recuperadas em lote, {len(groups)} grupos")
+                
+                for group in groups:
+                    unit_id = f"grupo_{next(unit_numbers)}"
+                    groups_by_unit[unit_id] = group
+                    yield BatchItem(
+                        id=unit_id,
+                        content="\n".join(member.question for member in group.members),
+                        metadata={'members': [member.item_id for member in group.members]},
+                        max_retries=max(item.max_retries for item in block),
+                    )
+        
+        def answer_unit(unit: BatchItem) -> List[Dict[str, Any]]:
+            group = groups_by_unit[unit.id]
+            answers = answer_group(group)
+            # lista na ordem dos membros: o cache fica independente dos ids dos itens
+            return [answers[member.item_id] for member in group.members]
+        answer_unit.rag_pipeline = True
+        
+        results: List[BatchResult] = []
+        try:
+            for unit_result in self.iter_results(generate_units(), answer_unit, progress_callback):
+                group = groups_by_unit.pop(unit_result.item_id)
+                answers = unit_result.result or [None] * len(group.members)
+                share = unit_result.processing_time / len(group.members)
+                for member, answer in zip(group.members, answers):
+                    if answer is not None:
+                        answer = {**answer, 'group_id': unit_result.item_id, 'group_size': len(group.members)}
+                    results.append(BatchResult(
+                        item_id=member.item_id,
+                        success=unit_result.success,
+                        result=answer,
+                        error=unit_result.error,
+                        processing_time=share,
+                        timestamp=unit_result.timestamp,
+                    ))
+        finally:
+            if executor is not None:
+                executor.shutdown()
+        return results
+
     def process_directory(self, 
                          directory_path: str, 
                          file_pattern: str = "*.txt",
-                         max_files: Optional[int] = None) -> Dict[str, Any]:
+                         max_files: Optional[int] = None,
+                         output_path: Optional[str] = None,
+                         processing_function: Optional[Callable] = None,
+                         resume: bool = False,
+                         job_id: Optional[str] = None,
+                         jobs_dir: str = DEFAULT_JOBS_DIR) -> Dict[str, Any]:
         """
         Processa todos os arquivos de um diretório
         
+        Cada arquivo só é lido quando um worker está prestes a precisar dele
+        (a fila limitada segura o produtor), em vez de carregar todos antes.
+        
+        Com ``job_id``, o andamento fica registrado em um manifesto: arquivos
+        já concluídos cujo hash não mudou são pulados, e arquivos novos ou
+        alterados são processados. Reexecutar com o mesmo ``job_id`` (ou chamar
+        ``resume``) processa apenas o delta.
+        
         Args:
             directory_path: Caminho do diretório
             file_pattern: Padrão de arquivos para processar
             max_files: Número máximo de arquivos (None = todos)
+            output_path: Arquivo ``.jsonl`` (ou diretório ``.parquet``) para gravar os
+                resultados incrementalmente (padrão do job: ``<jobs_dir>/<job_id>/results.jsonl``)
+            processing_function: Função customizada de processamento
+            resume: Pular arquivos já concluídos em ``output_path`` e acrescentar ao arquivo
+            job_id: Identificador do job com checkpoint (manifesto persistente)
+            jobs_dir: Diretório dos manifestos de jobs
         """
         
         directory = Path(directory_path)
@@ -318,21 +790,58 @@ class BatchProcessor:
             raise FileNotFoundError(f"Diretório não encontrado: {directory}")
         
         # Encontrar arquivos
-        files = list(directory.glob(file_pattern))
+        files = sorted(directory.glob(file_pattern))
         if max_files:
             files = files[:max_files]
         
         batch_logger.info(f"Encontrados {len(files)} arquivos para processar")
         
-        # Criar itens de lote
-        items = []
-        for i, file_path in enumerate(files):
-            try:
-                with open(file_path, 'r', encoding='utf-8') as f:
-                    content = f.read()
+        manifest = JobManifest(job_id, jobs_dir) if job_id else None
+        if manifest is not None:
+            output_path = output_path or manifest.get_info().get('output_path') or str(manifest.results_path)
+            manifest.set_info(
+                kind='directory',
+                directory_path=str(directory),
+                file_pattern=file_pattern,
+                max_files=max_files,
+                output_path=output_path,
+            )
+        
+        reading = {'files_processed': 0, 'files_unchanged': 0}
+        
+        def needs_processing(item_id: str, file_path: Path) -> bool:
+            """Consulta o manifesto; o hash só é recalculado se tamanho/mtime mudaram"""
+            stat = file_path.stat()
+            record = manifest.get(item_id)
+            if (record and record['status'] == STATUS_DONE
+                    and record['size'] == stat.st_size and record['mtime'] == stat.st_mtime):
+                return False
+            return manifest.register(
+                item_id,
+                hash_file(file_path),
+                source=str(file_path),
+                size=stat.st_size,
+                mtime=stat.st_mtime,
+            )
+        
+        def generate_items() -> Iterator[BatchItem]:
+            for i, file_path in enumerate(files):
+                # id estável (caminho relativo) para que checkpoints e retomadas
+                # continuem válidos quando arquivos são adicionados ao diretório
+                item_id = f"file_{file_path.relative_to(directory).as_posix()}"
+                try:
+                    if manifest is not None and not needs_processing(item_id, file_path):
+                        reading['files_unchanged'] += 1
+                        continue
+                    with open(file_path, 'r', encoding='utf-8') as f:
+                        content = f.read()
+                except Exception as e:
+                    batch_logger.error(f"Erro ao ler arquivo {file_path}: {str(e)}")
+                    continue
                 
-                items.append(BatchItem(
-                    id=f"file_{i+1}_{file_path.name}",
+                reading['files_processed'] += 1
+                yield BatchItem(
+                    id=item_id,
                     content=content,
                     metadata={
                         'source_file': str(file_path),
@@ -340,52 +849,259 @@ class BatchProcessor:
                         'file_number': i + 1,
                         'total_files': len(files)
                     }
-                ))
-            except Exception as e:
-                batch_logger.error(f"Erro ao ler arquivo {file_path}: {str(e)}")
+                )
         
-        # Processar arquivos
-        results = self.process_batch(items)
+        items = generate_items()
+        if manifest is not None:
+            job = self._run_with_manifest(manifest, items, processing_function, total_hint=len(files))
+            results = []
+        else:
+            if resume and output_path:
+                items = self._skip_completed(items, load_completed_ids(output_path))
+            results = self._consume(
+                self.iter_results(items, processing_function, total_hint=len(files)),
+                output_path,
+                append=resume,
+            )
+            job = None
+        
+        if reading['files_unchanged']:
+            batch_logger.info(f"{reading['files_unchanged']} arquivos inalterados desde o último checkpoint")
         
         return {
             'directory_path': str(directory),
             'file_pattern': file_pattern,
             'files_found': len(files),
-            'files_processed': len(items),
+            'files_processed': reading['files_processed'],
+            'files_unchanged': reading['files_unchanged'],
+            'output_path': output_path,
+            'job': job,
             'results': results,
             'summary': self.get_processing_summary()
         }
 
+    def _run_with_manifest(self, 
+                           manifest: JobManifest, 
+                           items: Iterable[BatchItem],
+                           processing_function: Optional[Callable[[BatchItem], Any]] = None,
+                           progress_callback: Optional[Callable[[BatchProgress], None]] = None,
+                           total_hint: Optional[int] = None) -> Dict[str, Any]:
+        """Processa itens gravando resultados no arquivo do job e status no manifesto"""
+        output_path = manifest.get_info().get('output_path') or str(manifest.results_path)
+        try:
+            with open_result_writer(output_path, append=True) as writer:
+                for result in self.iter_results(items, processing_function, progress_callback,
+                                                total_hint=total_hint):
+                    writer.write(result)
+                    manifest.mark(result.item_id, result.success, result.error)
+        finally:
+            manifest.checkpoint()
+            counts = manifest.counts()
+            manifest.close()
+        
+        batch_logger.info(f"Job {manifest.job_id}: {counts}")
+        return {'job_id': manifest.job_id, 'output_path': output_path, 'items': counts}
+
+    def run_job(self, 
+                items: Iterable[BatchItem], 
+                job_id: Optional[str] = None,
+                processing_function: Optional[Callable[[BatchItem], Any]] = None,
+                jobs_dir: str = DEFAULT_JOBS_DIR,
+                progress_callback: Optional[Callable[[BatchProgress], None]] = None) -> Dict[str, Any]:
+        """
+        Processa itens como um job com checkpoint, retomável com ``resume(job_id)``
+        
+        Itens já concluídos no job com o mesmo conteúdo são pulados; o conteúdo
+        dos itens é guardado no manifesto para que a retomada não dependa da
+        fonte original.
+        
+        Args:
+            items: Itens para processar (lista ou gerador)
+            job_id: Identificador do job (padrão: gerado a partir da data/hora)
+            processing_function: Função customizada de processamento
+            jobs_dir: Diretório dos manifestos de jobs
+            progress_callback: Callback de andamento (ver ``iter_results``)
+        """
+        job_id = job_id or datetime.now().strftime("job_%Y%m%d_%H%M%S")
+        manifest = JobManifest(job_id, jobs_dir)
+        if not manifest.get_info():
+            manifest.set_info(kind='items', output_path=str(manifest.results_path))
+        
+        def register(source: Iterable[BatchItem]) -> Iterator[BatchItem]:
+            for item in source:
+                if manifest.register(item.id, hash_text(item.content), content=item.content,
+                                     metadata=item.metadata):
+                    yield item
+        
+        total = len(items) if hasattr(items, '__len__') else None
+        job = self._run_with_manifest(manifest, register(items), processing_function,
+                                      progress_callback, total_hint=total)
+        job['summary'] = self.get_processing_summary()
+        return job
+
+    def resume(self, 
+               job_id: str, 
+               processing_function: Optional[Callable[[BatchItem], Any]] = None,
+               jobs_dir: str = DEFAULT_JOBS_DIR,
+               progress_callback: Optional[Callable[[BatchProgress], None]] = None) -> Dict[str, Any]:
+        """
+        Retoma um job, reenfileirando apenas itens pendentes ou com falha
+        
+        Jobs de diretório reexaminam o diretório de origem, então arquivos
+        alterados desde o último checkpoint também são reprocessados.
+        """
+        if not JobManifest.exists(job_id, jobs_dir):
+            raise FileNotFoundError(f"Job não encontrado: {job_id} (em {jobs_dir})")
+        
+        manifest = JobManifest(job_id, jobs_dir)
+        info = manifest.get_info()
+        if info.get('kind') == 'directory' and Path(info['directory_path']).exists():
+            manifest.close()
+            result = self.process_directory(
+                info['directory_path'],
+                file_pattern=info.get('file_pattern', "*.txt"),
+                max_files=info.get('max_files'),
+                processing_function=processing_function,
+                job_id=job_id,
+                jobs_dir=jobs_dir,
+            )
+            return result['job']
+        
+        def reload() -> Iterator[BatchItem]:
+            for record in manifest.iter_unfinished():
+                content = record['content']
+                if content is None:
+                    try:
+                        with open(record['source'], 'r', encoding='utf-8') as f:
+                            content = f.read()
+                    except OSError as e:
+                        batch_logger.error(f"Erro ao reler {record['source']}: {str(e)}")
+                        continue
+                yield BatchItem(id=record['item_id'], content=content, metadata=record['metadata'])
+        
+        unfinished = manifest.counts()
+        batch_logger.info(f"Retomando job {job_id}: "
+                          f"{unfinished[STATUS_PENDING] + unfinished[STATUS_FAILED]} itens a processar")
+        job = self._run_with_manifest(manifest, reload(), processing_function, progress_callback,
+                                      total_hint=unfinished[STATUS_PENDING] + unfinished[STATUS_FAILED])
+        job['summary'] = self.get_processing_summary()
+        return job
+
+    def _elapsed(self) -> float:
+        """Tempo da execução atual (ou da última, se já terminou)"""
+        if self._run_started is None:
+            return 0.0
+        end = self._run_finished if self._run_finished is not None else time.monotonic()
+        return end - self._run_started
+
+    @property
+    def stats(self) -> Dict[str, Any]:
+        """Contadores agregados de todos os workers"""
+        counters = self.metrics.counters()
+        stats = {name: int(counters.get(name, 0)) for name in _COUNTER_NAMES}
+        stats['total_time'] = self._elapsed()
+        return stats
+
+    def get_progress(self) -> "BatchProgress":
+        """Retrata o andamento da execução; pode ser chamado de qualquer thread durante o processamento"""
+        # contadores são cumulativos entre execuções; o andamento considera só a atual
+        counters = self.metrics.counters()
+        counters = {name: counters.get(name, 0) - self._run_base.get(name, 0) for name in _COUNTER_NAMES}
+        processed = int(counters['total_processed'])
+        elapsed = self._elapsed()
+        throughput = processed / elapsed if elapsed > 0 else 0.0
+        
+        eta = None
+        if self._run_total is not None and throughput > 0:
+            eta = max(self._run_total - processed, 0) / throughput
+        
+        latency = self.metrics.histogram('item_seconds').since(self._run_latency_base)
+        return BatchProgress(
+            processed=processed,
+            total=self._run_total,
+            successful=int(counters['successful']),
+            failed=int(counters['failed']),
+            elapsed=elapsed,
+            items_per_second=throughput,
+            eta_seconds=eta,
+            p50=latency.quantile(0.50),
+            p95=latency.quantile(0.95),
+            p99=latency.quantile(0.99),
+            queue_depth=self.processing_queue.qsize(),
+            concurrency_limit=self.rate_controller.concurrency.limit,
+            running=self._run_started is not None and self._run_finished is None,
+        )
+
     def get_processing_summary(self) -> Dict[str, Any]:
-        """Retorna resumo das estatísticas de processamento"""
+        """Retorna resumo das estatísticas de processamento (também durante a execução)"""
+        stats = self.stats
+        total_time = stats['total_time']
         return {
-            'total_processed': self.stats['total_processed'],
-            'successful': self.stats['successful'],
-            'failed': self.stats['failed'],
-            'success_rate': (self.stats['successful'] / max(self.stats['total_processed'], 1)) * 100,
-            'cache_hits': self.stats['cache_hits'],
-            'cache_hit_rate': (self.stats['cache_hits'] / max(self.stats['total_processed'], 1)) * 100,
-            'total_time': self.stats['total_time'],
-            'avg_time_per_item': self.stats['total_time'] / max(self.stats['total_processed'], 1),
-            'items_per_second': self.stats['total_processed'] / max(self.stats['total_time'], 0.001)
+            'total_processed': stats['total_processed'],
+            'successful': stats['successful'],
+            'failed': stats['failed'],
+            'success_rate': (stats['successful'] / max(stats['total_processed'], 1)) * 100,
+            'cache_hits': stats['cache_hits'],
+            'cache_hit_rate': (stats['cache_hits'] / max(stats['total_processed'], 1)) * 100,
+            'cache': self.cache.stats() if self.cache is not None else None,
+            'retries': stats['retries'],
+            'throttled': stats['throttled'],
+            'llm_calls': stats['llm_calls'],
+            'concurrency_limit': self.rate_controller.concurrency.limit,
+            'total_time': total_time,
+            'avg_time_per_item': total_time / max(stats['total_processed'], 1),
+            'items_per_second': stats['total_processed'] / max(total_time, 0.001),
+            'latency': self.metrics.histogram('item_seconds').summary(),
+            'llm_latency': self.metrics.histogram('llm_call_seconds').summary(),
         }
 
-    def save_results(self, results: List[BatchResult], output_path: str):
-        """Salva resultados em arquivo JSON"""
+    def render_prometheus(self, prefix: str = "mosaic_batch") -> str:
+        """Exporta contadores, gauges e histogramas no formato de texto do Prometheus"""
+        counters = self.metrics.counters()
+        lines: List[str] = []
+        for name in _COUNTER_NAMES:
+            # ``total_processed`` → ``mosaic_batch_processed_total`` (o sufixo ``_total`` já indica contador)
+            metric = name[len("total_"):] if name.startswith("total_") else name
+            lines += format_counter(f"{prefix}_{metric}_total", counters.get(name, 0))
+        
+        progress = self.get_progress()
+        lines += format_counter(f"{prefix}_queue_depth", progress.queue_depth, metric_type="gauge")
+        lines += format_counter(f"{prefix}_concurrency_limit", progress.concurrency_limit, metric_type="gauge")
+        lines += format_counter(f"{prefix}_items_per_second", progress.items_per_second, metric_type="gauge")
+        if progress.eta_seconds is not None:
+            lines += format_counter(f"{prefix}_eta_seconds", progress.eta_seconds, metric_type="gauge")
+        
+        for name in self.metrics.histogram_names():
+            lines += format_histogram(f"{prefix}_{name}", self.metrics.histogram(name))
+        if self.cache is not None:
+            cache_stats = self.cache.stats()
+            lines += format_counter(f"{prefix}_cache_bytes", cache_stats['bytes'], metric_type="gauge")
+            lines += format_counter(f"{prefix}_cache_entries", cache_stats['entries'], metric_type="gauge")
+        return render_lines(lines)
+
+    def start_metrics_server(self, port: int = 9100, host: str = "0.0.0.0"):
+        """Expõe ``render_prometheus`` em ``http://host:port/metrics`` durante a execução"""
+        server = start_metrics_server(self.render_prometheus, port=port, host=host)
+        batch_logger.info(f"Métricas do batch disponíveis em http://{host}:{port}/metrics")
+        return server
+
+    def save_results(self, results: Iterable[BatchResult], output_path: str):
+        """
+        Salva resultados em arquivo
+        
+        Caminhos ``.jsonl``/``.parquet`` são gravados resultado a resultado (aceita
+        o iterador de ``iter_results``); demais caminhos mantêm o formato JSON
+        único com resumo, montado em memória.
+        """
+        if str(output_path).endswith((".jsonl", ".parquet")):
+            written = self.write_results(results, output_path)
+            batch_logger.info(f"{written} resultados salvos em: {output_path}")
+            return
+        
         output_data = {
             'timestamp': datetime.now().isoformat(),
             'summary': self.get_processing_summary(),
-            'results': [
-                {
-                    'item_id': r.item_id,
-                    'success': r.success,
-                    'result': r.result,
-                    'error': r.error,
-                    'processing_time': r.processing_time,
-                    'timestamp': r.timestamp
-                }
-                for r in results
-            ]
+            'results': [_result_to_dict(r) for r in results]
         }
         
         with open(output_path, 'w', encoding='utf-8') as f:
@@ -395,6 +1111,20 @@ class BatchProcessor:
 
 
 # Exemplo de uso e demonstração
+PERGUNTAS_EXEMPLO = [
+    "O que é a procedure SP_AT_INT_APLICINSUMOAGRIC?",
+    "Como funciona a normalização de dados?",
+    "Qual é a origem dos dados no sistema?",
+    "Explique o processo de ETL",
+    "O que são regras de negócio?",
+    "Como consultar a tabela INT_APLICINSUMOAGRIC?",
+    "Qual é a função da procedure de normalização?",
+    "Explique o fluxo de dados agrícolas",
+    "Como funciona a integração de sistemas?",
+    "O que é consolidação de dados?"
+]
+
+
 def demonstrar_batch_processing():
     """Demonstra o uso do sistema de batch processing"""
     
@@ -403,22 +1133,12 @@ def demonstrar_batch_processing():
         batch_size=10,
         max_workers=3,
         rate_limit=2.0,  # 2 requisições por segundo
-        enable_caching=True
+        enable_caching=True,
+        cache_path="batch_cache.sqlite"  # reexecuções sobre as mesmas perguntas saem do cache
     )
     
     # Exemplo 1: Processar lista de perguntas
-    perguntas_exemplo = [
-        "O que é a procedure SP_AT_INT_APLICINSUMOAGRIC?",
-        "Como funciona a normalização de dados?",
-        "Qual é a origem dos dados no sistema?",
-        "Explique o processo de ETL",
-        "O que são regras de negócio?",
-        "Como consultar a tabela INT_APLICINSUMOAGRIC?",
-        "Qual é a função da procedure de normalização?",
-        "Explique o fluxo de dados agrícolas",
-        "Como funciona a integração de sistemas?",
-        "O que é consolidação de dados?"
-    ]
+    perguntas_exemplo = PERGUNTAS_EXEMPLO
     
     # Criar itens de lote
     items = [
@@ -433,8 +1153,13 @@ def demonstrar_batch_processing():
     print("🔄 Iniciando demonstração de Batch Processing...")
     print(f"📊 Processando {len(items)} itens em lotes de {processor.batch_size}")
     
+    def mostrar_progresso(progress: BatchProgress):
+        eta = f"{progress.eta_seconds:.1f}s" if progress.eta_seconds is not None else "?"
+        print(f"  ⏳ {progress.processed}/{progress.total} itens | "
+              f"{progress.items_per_second:.2f} itens/s | ETA {eta}")
+    
     # Processar
-    results = processor.process_batch(items)
+    results = processor.process_batch(items, progress_callback=mostrar_progresso)
     
     # Mostrar resultados
     print("\n📈 Resumo do Processamento:")
@@ -451,6 +1176,126 @@ def demonstrar_batch_processing():
     return results
 
 
+def comparar_modos_batch(perguntas: Optional[List[str]] = None) -> Dict[str, Any]:
+    """Compara vazão e número de chamadas ao LLM entre o modo por item e o modo agrupado"""
+    
+    perguntas = perguntas or PERGUNTAS_EXEMPLO
+    comparacao = {}
+    
+    for modo in ('por_item', 'agrupado'):
+        processor = BatchProcessor(batch_size=10, max_workers=3, rate_limit=2.0, enable_caching=False)
+        items = [
+            BatchItem(id=f"pergunta_{i+1}", content=pergunta, metadata={'indice': i})
+            for i, pergunta in enumerate(perguntas)
+        ]
+        
+        if modo == 'por_item':
+            processor.process_batch(items)
+        else:
+            processor.process_batch_grouped(items)
+        
+        summary = processor.get_processing_summary()
+        comparacao[modo] = {
+            'itens': len(items),
+            'chamadas_llm': summary['llm_calls'],
+            'tempo_total': summary['total_time'],
+            'itens_por_segundo': len(items) / max(summary['total_time'], 0.001),
+        }
+    
+    print("\n⚖️ Comparação de modos:")
+    for modo, dados in comparacao.items():
+        print(f"  {modo}: {dados['chamadas_llm']} chamadas ao LLM, "
+              f"{dados['itens_por_segundo']:.2f} itens/s ({dados['tempo_total']:.1f}s)")
+    
+    return comparacao
+
+
+class FakeProviderError(Exception):
+    """Erro HTTP simulado pelo ``FakeThrottlingLLM``"""
+
+    def __init__(self, status_code: int, message: str):
+        super().__init__(f"{status_code} {message}")
+        self.status_code = status_code
+
+
+class FakeThrottlingLLM:
+    """
+    LLM falso para exercitar o controle de taxa sem chamar o Gemini
+    
+    Simula uma quota de ``quota_per_second`` chamadas por janela de 1 s
+    (excedentes recebem 429), falhas 5xx aleatórias e latência fixa.
+    """
+
+    def __init__(self, 
+                 quota_per_second: int = 5, 
+                 server_error_rate: float = 0.05, 
+                 latency: float = 0.05,
+                 seed: int = 42):
+        self.quota_per_second = quota_per_second
+        self.server_error_rate = server_error_rate
+        self.latency = latency
+        self.calls = 0
+        self.throttled = 0
+        self._window = []
+        self._lock = Lock()
+        self._random = random.Random(seed)
+
+    def __call__(self, item: BatchItem) -> Dict[str, Any]:
+        with self._lock:
+            self.calls += 1
+            now = time.monotonic()
+            self._window = [t for t in self._window if now - t < 1.0]
+            if len(self._window) >= self.quota_per_second:
+                self.throttled += 1
+                raise FakeProviderError(429, "Resource has been exhausted (e.g. check quota).")
+            self._window.append(now)
+            server_error = self._random.random() < self.server_error_rate
+        
+        time.sleep(self.latency)
+        if server_error:
+            raise FakeProviderError(503, "Service Unavailable")
+        return {'question': item.content, 'answer': f"resposta simulada para {item.id}", 'sources': []}
+
+
+def simular_controle_de_taxa(num_itens: int = 30) -> Tuple[List[BatchItem], List[BatchResult], FakeThrottlingLLM, Dict[str, Any]]:
+    """
+    Processa ``num_itens`` contra um ``FakeThrottlingLLM`` com quota abaixo do rate limit
+
+    Retorna ``(itens, resultados, llm_falso, resumo)``; usado pela demonstração
+    e pela verificação ``check_rate_control.py``.
+    """
+    fake_llm = FakeThrottlingLLM(quota_per_second=5, server_error_rate=0.05)
+    processor = BatchProcessor(
+        batch_size=10,
+        max_workers=8,
+        rate_limit=10.0,  # acima da quota simulada, para provocar 429
+        burst=10,
+        enable_caching=False,
+    )
+    processor.rate_controller.retry_policy = RetryPolicy(base_delay=0.2, max_delay=2.0)
+    
+    items = [
+        BatchItem(id=f"simulado_{i+1}", content=f"Pergunta simulada {i+1}", max_retries=8)
+        for i in range(num_itens)
+    ]
+    results = processor.process_batch(items, processing_function=fake_llm)
+    return items, results, fake_llm, processor.get_processing_summary()
+
+
+def demonstrar_controle_de_taxa():
+    """Demonstra token bucket, AIMD e retry contra um LLM falso que injeta 429/5xx"""
+    
+    print("🔄 Processando itens contra LLM simulado com throttling...")
+    _, _, fake_llm, summary = simular_controle_de_taxa()
+    
+    print(f"  Chamadas ao LLM simulado: {fake_llm.calls} ({fake_llm.throttled} com 429)")
+    for key in ('successful', 'failed', 'retries', 'throttled', 'concurrency_limit', 'items_per_second'):
+        print(f"  {key}: {summary[key]}")
+    print("ℹ️ Verificação automática (sai com erro em regressões): python check_rate_control.py")
+    
+    return summary
+
+
 # Função para processar documento grande (exemplo com 1000 iterações)
 def processar_documento_grande_exemplo():
     """Exemplo de processamento de documento grande com iterações"""
@@ -475,6 +1320,14 @@ def processar_documento_grande_exemplo():
     
     print(f"✅ Documento criado: {documento_exemplo}")
     
+    # Quanto do documento é repetido (chunks que a deduplicação removeria antes de indexar)
+    from dedup import find_duplicate_clusters
+    
+    textos = [chunk.text for chunk in iter_text_chunks(documento_exemplo, chunk_size=500)]
+    _, relatorio_dedup = find_duplicate_clusters(textos)
+    print(f"🧹 Chunks quase duplicados: {relatorio_dedup.removed} de {relatorio_dedup.total} "
+          f"({relatorio_dedup.ratio:.1%}) em {relatorio_dedup.clusters} grupos")
+    
     # Criar processador otimizado para documento grande
     processor = BatchProcessor(
         batch_size=20,  # Lotes maiores para eficiência
@@ -514,8 +1367,14 @@ if __name__ == "__main__":
     print("🚀 Sistema de Batch Processing para Documentos")
     print("=" * 50)
     
+    # Controle de taxa com LLM simulado (não consome quota do Gemini)
+    demonstrar_controle_de_taxa()
+    
+    print("\n" + "=" * 50)
+    
     # Demonstrar funcionalidades
     demonstrar_batch_processing()
+    comparar_modos_batch()
     
     print("\n" + "=" * 50)
     print("📄 Teste com Documento Grande (1000 iterações)")
@@ -0,0 +1,251 @@
+"""
+Recuperação em lote e respostas agrupadas para o batch processing
+Embeddings de todas as perguntas em uma chamada, busca FAISS em lote,
+agrupamento por contexto compartilhado e uma chamada ao LLM por grupo
+"""
+
+import json
+import logging
+import re
+from collections import defaultdict
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional, Sequence
+
+import numpy as np
+from langchain.chains.conversational_retrieval.prompts import QA_PROMPT
+from langchain_core.documents import Document
+
+import main
+
+retrieval_logger = logging.getLogger("batch_processor.retrieval")
+
+# Constante de suavização do Reciprocal Rank Fusion (mesma do EnsembleRetriever)
+RRF_C = 60
+
+GROUP_PROMPT = """Use os trechos de contexto abaixo para responder a cada uma das perguntas. \
+Se o contexto não trouxer a resposta de uma pergunta, diga que não sabe; não invente.
+
+Contexto:
+{context}
+
+Perguntas:
+{questions}
+
+Responda somente com um objeto JSON no formato \
+{{"respostas": [{{"id": "<id da pergunta>", "resposta": "<texto>"}}]}}, \
+com exatamente uma entrada para cada id listado."""
+
+
+@dataclass
+class RetrievedQuestion:
+    """Pergunta com os chunks recuperados (índices em ``RetrievalIndex.chunks``) e scores RRF"""
+    item_id: str
+    question: str
+    chunk_ids: List[int]
+    scores: List[float]
+
+
+@dataclass
+class QuestionGroup:
+    """Perguntas que compartilham boa parte do contexto recuperado"""
+    members: List[RetrievedQuestion] = field(default_factory=list)
+
+    def context_chunk_ids(self, max_chunks: int) -> List[int]:
+        """União dos chunks do grupo, priorizando os de maior score somado"""
+        totals: Dict[int, float] = defaultdict(float)
+        for member in self.members:
+            for chunk_id, score in zip(member.chunk_ids, member.scores):
+                totals[chunk_id] += score
+        return sorted(totals, key=totals.get, reverse=True)[:max_chunks]
+
+
+def retrieve_batch(questions: Sequence[str],
+                   k: int = main.RETRIEVER_K,
+                   index: Optional[main.RetrievalIndex] = None,
+                   executor: Any = None) -> List[List[tuple]]:
+    """
+    Recupera chunks para várias perguntas de uma vez
+
+    Os embeddings são calculados em uma única chamada (matriz ``n x d``) e a
+    busca FAISS é feita em lote; o BM25 pontua cada pergunta contra o corpus.
+    As duas listas são combinadas por RRF ponderado, como no
+    ``EnsembleRetriever``. Retorna, por pergunta, ``[(chunk_id, score), ...]``.
+
+    Com um ``hybrid_executor.HybridExecutor`` (criado com ``bm25_corpus`` igual
+    aos textos de ``index.chunks``), embeddings e pontuação BM25 rodam no pool
+    de processos em vez da thread atual.
+    """
+    if not questions:
+        return []
+    index = index or main.get_retrieval_index()
+    bm25_weight, dense_weight = main.ENSEMBLE_WEIGHTS
+
+    if executor is not None:
+        lexical_future = executor.submit_io(executor.bm25_top_k, list(questions), k)
+        matrix = executor.embed_texts(questions)
+        lexical = [[row for row, _ in ranked] for ranked in lexical_future.result()]
+    else:
+        matrix = np.asarray(index.embeddings.embed_documents(list(questions)), dtype="float32")
+        lexical = None
+    _, dense_rows = index.vectorstore.index.search(matrix, k)
+
+    fused: List[List[tuple]] = []
+    for position, question in enumerate(questions):
+        if lexical is not None:
+            lexical_rows = lexical[position]
+        else:
+            scores = index.bm25.vectorizer.get_scores(index.bm25.preprocess_func(question))
+            lexical_rows = np.argsort(scores)[::-1][:k]
+
+        rrf: Dict[int, float] = defaultdict(float)
+        for weight, rows in ((bm25_weight, lexical_rows), (dense_weight, dense_rows[position])):
+            for rank, row in enumerate(rows, start=1):
+                if row >= 0:  # FAISS devolve -1 quando há menos de k vetores
+                    rrf[int(row)] += weight / (rank + RRF_C)
+        fused.append(sorted(rrf.items(), key=lambda pair: pair[1], reverse=True))
+    return fused
+
+
+def retrieve_questions(items: Sequence[Any], k: int = main.RETRIEVER_K,
+                       index: Optional[main.RetrievalIndex] = None,
+                       executor: Any = None) -> List[RetrievedQuestion]:
+    """Aplica ``retrieve_batch`` a itens com ``id`` e ``content`` (ex.: ``BatchItem``)"""
+    results = retrieve_batch([item.content for item in items], k=k, index=index, executor=executor)
+    return [
+        RetrievedQuestion(
+            item_id=item.id,
+            question=item.content,
+            chunk_ids=[chunk_id for chunk_id, _ in ranked],
+            scores=[score for _, score in ranked],
+        )
+        for item, ranked in zip(items, results)
+    ]
+
+
+def group_by_overlap(retrieved: Sequence[RetrievedQuestion],
+                     threshold: float = 0.5,
+                     max_group_size: int = 5) -> List[QuestionGroup]:
+    """
+    Agrupa perguntas cujos chunks recuperados se sobrepõem (Jaccard ≥ ``threshold``)
+
+    Só são comparados pares que compartilham ao menos um chunk (índice
+    invertido chunk → perguntas), então o custo acompanha a sobreposição real
+    em vez de ``n²``. Cada pergunta entra no primeiro grupo compatível que
+    ainda tenha espaço.
+    """
+    by_chunk: Dict[int, List[int]] = defaultdict(list)
+    for position, question in enumerate(retrieved):
+        for chunk_id in question.chunk_ids:
+            by_chunk[chunk_id].append(position)
+
+    group_of: Dict[int, int] = {}
+    groups: List[QuestionGroup] = []
+    for position, question in enumerate(retrieved):
+        own = set(question.chunk_ids)
+        best_group, best_similarity = None, threshold
+        for chunk_id in question.chunk_ids:
+            for other in by_chunk[chunk_id]:
+                if other >= position or other not in group_of:
+                    continue
+                group_index = group_of[other]
+                if len(groups[group_index].members) >= max_group_size:
+                    continue
+                other_chunks = set(retrieved[other].chunk_ids)
+                similarity = len(own & other_chunks) / max(len(own | other_chunks), 1)
+                if similarity >= best_similarity:
+                    best_group, best_similarity = group_index, similarity
+
+        if best_group is None:
+            groups.append(QuestionGroup())
+            best_group = len(groups) - 1
+        groups[best_group].members.append(question)
+        group_of[position] = best_group
+    return groups
+
+
+def _format_context(documents: Sequence[Document]) -> str:
+    return "\n\n".join(document.page_content for document in documents)
+
+
+def serialize_documents(documents: Sequence[Document]) -> List[Dict[str, Any]]:
+    """Fontes no mesmo formato de ``batch_processor.answer_batch_item``"""
+    return [
+        {
+            'source': document.metadata.get("source") or document.metadata.get("file_path"),
+            'page': document.metadata.get("page") or document.metadata.get("page_number"),
+            'snippet': document.page_content[:400].strip() or None,
+        }
+        for document in documents
+    ]
+
+
+def answer_single(question: RetrievedQuestion, index: Optional[main.RetrievalIndex] = None,
+                  llm: Any = None) -> Dict[str, Any]:
+    """Responde uma pergunta com o prompt padrão de QA usando os chunks já recuperados"""
+    index = index or main.get_retrieval_index()
+    llm = llm or main.get_llm()
+    documents = [index.chunks[chunk_id] for chunk_id in question.chunk_ids]
+    prompt = QA_PROMPT.format(context=_format_context(documents), question=question.question)
+    answer = llm.invoke(prompt)
+    return {
+        'question': question.question,
+        'answer': getattr(answer, "content", str(answer)),
+        'sources': serialize_documents(documents),
+    }
+
+
+def _parse_group_answers(text: str) -> Dict[str, str]:
+    """Extrai ``{id: resposta}`` do JSON devolvido pelo modelo (tolerando cercas de código)"""
+    match = re.search(r"\{.*\}", text, flags=re.DOTALL)
+    if not match:
+        return {}
+    try:
+        payload = json.loads(match.group(0))
+    except json.JSONDecodeError:
+        return {}
+    answers = payload.get("respostas") if isinstance(payload, dict) else None
+    if not isinstance(answers, list):
+        return {}
+    return {
+        str(entry.get("id")): str(entry.get("resposta"))
+        for entry in answers
+        if isinstance(entry, dict) and entry.get("id") is not None and entry.get("resposta") is not None
+    }
+
+
+def answer_group(group: QuestionGroup,
+                 index: Optional[main.RetrievalIndex] = None,
+                 llm: Any = None,
+                 max_context_chunks: int = 8) -> Dict[str, Dict[str, Any]]:
+    """
+    Responde todas as perguntas de um grupo em uma única chamada estruturada
+
+    Perguntas sem resposta no JSON devolvido (ou todas, se o JSON for
+    inválido) são respondidas individualmente com ``answer_single``.
+    Retorna ``{item_id: resultado}``.
+    """
+    index = index or main.get_retrieval_index()
+    llm = llm or main.get_llm()
+
+    if len(group.members) == 1:
+        member = group.members[0]
+        return {member.item_id: answer_single(member, index=index, llm=llm)}
+
+    documents = [index.chunks[chunk_id] for chunk_id in group.context_chunk_ids(max_context_chunks)]
+    questions = "\n".join(f"[{member.item_id}] {member.question}" for member in group.members)
+    response = llm.invoke(GROUP_PROMPT.format(context=_format_context(documents), questions=questions))
+    parsed = _parse_group_answers(getattr(response, "content", str(response)))
+
+    results: Dict[str, Dict[str, Any]] = {}
+    for member in group.members:
+        if member.item_id in parsed:
+            member_documents = [index.chunks[chunk_id] for chunk_id in member.chunk_ids]
+            results[member.item_id] = {
+                'question': member.question,
+                'answer': parsed[member.item_id],
+                'sources': serialize_documents(member_documents),
+            }
+        else:
+            retrieval_logger.warning(f"Resposta ausente para {member.item_id} no lote; respondendo individualmente")
+            results[member.item_id] = answer_single(member, index=index, llm=llm)
+    return results
@@ -0,0 +1,45 @@
+#!/usr/bin/env python3
+"""
+Verificação de regressão do controle de taxa do batch
+Processa itens contra o LLM falso com quota (429) e falhas 5xx e sai com código 1
+se algum item falhar ou se os contadores de retry/throttling não baterem
+"""
+
+import sys
+
+from batch_processor import simular_controle_de_taxa
+
+
+def run_checks():
+    """Lista de ``(descrição, passou, detalhe)``"""
+    items, results, fake_llm, summary = simular_controle_de_taxa()
+    failed = [result.item_id for result in results if not result.success]
+    item_retries = sum(item.retry_count for item in items)
+    return [
+        ("todos os itens concluídos com retry", not failed and len(results) == len(items),
+         f"{len(results)} resultados, falhas: {failed}"),
+        ("quota do LLM falso excedida (429 exercitados)", fake_llm.throttled > 0,
+         f"{fake_llm.throttled} respostas 429"),
+        ("retries do resumo = retries dos itens", summary['retries'] == item_retries,
+         f"{summary['retries']} != {item_retries}"),
+        ("throttled do resumo = 429 do LLM falso", summary['throttled'] == fake_llm.throttled,
+         f"{summary['throttled']} != {fake_llm.throttled}"),
+    ]
+
+
+def main():
+    """Função principal"""
+    print("🔍 Verificando controle de taxa contra LLM simulado...")
+    checks = run_checks()
+    for description, passed, detail in checks:
+        print(f"   {'✅' if passed else '❌'} {description}" + ("" if passed else f" ({detail})"))
+
+    if all(passed for _, passed, _ in checks):
+        print("✅ Controle de taxa OK")
+        return 0
+    print("❌ Regressão no controle de taxa")
+    return 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
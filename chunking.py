@@ -0,0 +1,561 @@
+"""
+Divisão de textos em chunks
+Leitura incremental de arquivos grandes com cortes em limites de parágrafo/frase/palavra
+e divisão por estrutura de Markdown/SQL (títulos, blocos de código e tabelas)
+"""
+
+import io
+from dataclasses import dataclass
+from pathlib import Path
+from typing import TYPE_CHECKING, Any, Dict, Iterable, Iterator, List, Optional, Sequence, TextIO, Tuple, Union
+
+if TYPE_CHECKING:
+    from langchain_core.documents import Document
+
+# Separadores em ordem de preferência para o ponto de corte
+BOUNDARY_SEPARATORS: Sequence[str] = ("\n\n", ". ", "! ", "? ", ".\n", "\n", "; ", ", ", " ")
+
+_READ_BLOCK_SIZE = 64 * 1024
+
+
+@dataclass
+class TextChunk:
+    """Trecho de um arquivo com a posição (em caracteres) no texto original"""
+    text: str
+    start: int
+    end: int
+    number: int
+
+
+def find_boundary(text: str, limit: int, min_size: int,
+                  separators: Sequence[str] = BOUNDARY_SEPARATORS) -> int:
+    """
+    Retorna a posição de corte em ``text[:limit]`` no melhor limite natural
+
+    Procura, da direita para a esquerda, o primeiro separador da lista que
+    apareça depois de ``min_size``; o corte fica logo após o separador. Sem
+    nenhum separador utilizável, corta em ``limit``.
+    """
+    if len(text) <= limit:
+        return len(text)
+    for separator in separators:
+        position = text.rfind(separator, min_size, limit)
+        if position != -1:
+            return position + len(separator)
+    return limit
+
+
+def _overlap_start(buffer: str, cut: int, overlap: int) -> int:
+    """
+    Início do chunk seguinte: ``overlap`` caracteres antes de ``cut``,
+    avançado até o próximo espaço para não começar no meio de uma palavra
+
+    Sem espaço no trecho de sobreposição o chunk seguinte começa em ``cut``
+    (sem sobreposição); o resultado é sempre maior que zero.
+    """
+    if overlap <= 0 or cut <= overlap:
+        return cut
+    start = cut - overlap
+    if buffer[start - 1].isspace():
+        return start
+    for position in range(start, cut):
+        if buffer[position].isspace():
+            while position < cut and buffer[position].isspace():
+                position += 1
+            return position
+    return cut
+
+
+def iter_text_chunks(source: Union[str, Path, TextIO],
+                     chunk_size: int = 1000,
+                     overlap: int = 0,
+                     encoding: str = "utf-8",
+                     min_chunk_ratio: float = 0.5,
+                     block_size: int = _READ_BLOCK_SIZE) -> Iterator[TextChunk]:
+    """
+    Gera chunks de um arquivo lendo-o em blocos, sem carregá-lo inteiro
+
+    A memória usada fica limitada a ``chunk_size + block_size`` caracteres,
+    independentemente do tamanho do arquivo, e o primeiro chunk é produzido
+    assim que o primeiro bloco é lido.
+
+    Args:
+        source: Caminho do arquivo ou arquivo texto já aberto
+        chunk_size: Tamanho máximo de cada chunk em caracteres
+        overlap: Máximo de caracteres repetidos no início do chunk seguinte (a partir de um início de palavra)
+        encoding: Codificação usada ao abrir ``source`` por caminho
+        min_chunk_ratio: Fração mínima de ``chunk_size`` antes de aceitar um corte natural
+        block_size: Tamanho dos blocos lidos do disco
+    """
+    if chunk_size <= 0:
+        raise ValueError("chunk_size deve ser positivo")
+    overlap = max(0, min(overlap, chunk_size // 2))
+    min_size = max(1, int(chunk_size * min_chunk_ratio))
+    block_size = max(block_size, chunk_size)
+
+    handle: Optional[TextIO] = None
+    if isinstance(source, (str, Path)):
+        handle = open(source, "r", encoding=encoding, errors="replace", newline="")
+        stream = handle
+    else:
+        stream = source
+
+    try:
+        buffer = ""
+        buffer_start = 0  # posição de buffer[0] no texto completo
+        number = 0
+        eof = False
+
+        while True:
+            while not eof and len(buffer) < chunk_size + 1:
+                block = stream.read(block_size)
+                if not block:
+                    eof = True
+                else:
+                    buffer += block
+
+            if not buffer:
+                break
+
+            cut = len(buffer) if eof and len(buffer) <= chunk_size else find_boundary(buffer, chunk_size, min_size)
+            text = buffer[:cut]
+            if text.strip():
+                number += 1
+                yield TextChunk(text=text, start=buffer_start, end=buffer_start + cut, number=number)
+
+            if cut >= len(buffer) and eof:
+                break
+
+            advance = _overlap_start(buffer, cut, overlap)
+            buffer = buffer[advance:]
+            buffer_start += advance
+    finally:
+        if handle is not None:
+            handle.close()
+
+
+# ---------------------------------------------------------------------------
+# Divisão por estrutura (Markdown / SQL)
+# ---------------------------------------------------------------------------
+
+_FENCES = ("```", "~~~")
+_HORIZONTAL_RULES = ("---", "***", "___")
+HEADING_PATH_SEPARATOR = " > "
+
+
+@dataclass
+class MarkdownBlock:
+    """
+    Bloco indivisível de um Markdown: título, bloco de código, tabela ou texto
+
+    ``headings`` é o caminho de títulos em vigor (inclui o próprio título nos
+    blocos ``heading``) e ``level`` o nível do título mais interno (0 se não houver).
+    """
+    kind: str
+    text: str
+    headings: Tuple[str, ...]
+    level: int
+
+
+def heading_level(line: str) -> int:
+    """Nível de um título ATX (``# ...`` a ``###### ...``), 0 se a linha não for título"""
+    stripped = line.lstrip(" ")
+    if len(line) - len(stripped) > 3:
+        return 0
+    level = 0
+    while level < len(stripped) and stripped[level] == "#":
+        level += 1
+    if 1 <= level <= 6 and (len(stripped) == level or stripped[level] in " \t"):
+        return level
+    return 0
+
+
+def _fence_marker(line: str) -> Optional[str]:
+    stripped = line.lstrip()
+    for fence in _FENCES:
+        if stripped.startswith(fence):
+            return fence
+    return None
+
+
+def iter_markdown_blocks(text: str) -> Iterator[MarkdownBlock]:
+    """
+    Percorre o Markdown uma única vez, linha a linha, produzindo blocos
+
+    Blocos de código cercados (```` ``` ````/``~~~``) e tabelas (linhas
+    iniciadas por ``|``) saem inteiros; parágrafos e listas terminam em linha
+    em branco. Linhas horizontais (``---``) apenas separam blocos. Não usa
+    expressões regulares.
+    """
+    headings: List[Tuple[int, str]] = []
+    buffer: List[str] = []
+    kind: Optional[str] = None
+    fence: Optional[str] = None
+
+    def current_path() -> Tuple[str, ...]:
+        return tuple(title for _, title in headings)
+
+    def current_level() -> int:
+        return headings[-1][0] if headings else 0
+
+    for line in text.splitlines():
+        if fence is not None:
+            buffer.append(line)
+            if line.strip().startswith(fence) and len(buffer) > 1:
+                yield MarkdownBlock("code", "\n".join(buffer), current_path(), current_level())
+                buffer, kind, fence = [], None, None
+            continue
+
+        stripped = line.strip()
+        opening = _fence_marker(line)
+        level = 0 if opening else heading_level(line)
+        if opening:
+            new_kind = "code"
+        elif level:
+            new_kind = "heading"
+        elif not stripped or stripped in _HORIZONTAL_RULES:
+            new_kind = None
+        elif stripped.startswith("|"):
+            new_kind = "table"
+        else:
+            new_kind = "text"
+
+        if buffer and new_kind != kind or new_kind in ("code", "heading", None):
+            if buffer:
+                yield MarkdownBlock(kind, "\n".join(buffer), current_path(), current_level())
+            buffer, kind = [], None
+
+        if new_kind is None:
+            continue
+        if level:
+            while headings and headings[-1][0] >= level:
+                headings.pop()
+            headings.append((level, stripped.lstrip("#").strip()))
+            yield MarkdownBlock("heading", stripped, current_path(), level)
+            continue
+
+        buffer.append(line)
+        kind = new_kind
+        if opening:
+            fence = opening
+
+    if buffer:
+        yield MarkdownBlock(kind, "\n".join(buffer), current_path(), current_level())
+
+
+def _is_sql_boundary(line: str) -> bool:
+    stripped = line.strip()
+    return not stripped or stripped.endswith(";") or stripped.upper() == "GO"
+
+
+def _group_statements(lines: Sequence[str]) -> List[str]:
+    """Agrupa linhas SQL em comandos (terminados por ``;``, ``GO`` ou linha em branco)"""
+    statements, current = [], []
+    for line in lines:
+        current.append(line)
+        if _is_sql_boundary(line):
+            if any(part.strip() for part in current):
+                statements.append("\n".join(current))
+            current = []
+    if any(part.strip() for part in current):
+        statements.append("\n".join(current))
+    return statements
+
+
+def _pack(units: Sequence[str], budget: int, separator: str = "\n") -> List[str]:
+    """Junta unidades consecutivas em pedaços de até ``budget`` caracteres"""
+    budget = max(1, budget)
+    pieces, current, size = [], [], 0
+    for unit in units:
+        while len(unit) > budget:
+            # unidade maior que o orçamento (linha muito longa): corte em limite natural
+            cut = find_boundary(unit, budget, max(1, budget // 2))
+            if current:
+                pieces.append(separator.join(current))
+                current, size = [], 0
+            pieces.append(unit[:cut])
+            unit = unit[cut:]
+        added = len(unit) + (len(separator) if current else 0)
+        if current and size + added > budget:
+            pieces.append(separator.join(current))
+            current, size = [], 0
+            added = len(unit)
+        current.append(unit)
+        size += added
+    if current:
+        pieces.append(separator.join(current))
+    return pieces
+
+
+def _split_oversized(block: MarkdownBlock, chunk_size: int, chunk_overlap: int) -> List[str]:
+    """Divide um bloco maior que ``chunk_size`` sem perder sua forma"""
+    lines = block.text.split("\n")
+    if block.kind == "code":
+        opener = lines[0]
+        closed = len(lines) > 1 and lines[-1].strip().startswith(opener.strip()[:3])
+        closer = lines[-1] if closed else opener.strip()[:3]
+        body = lines[1:-1] if closed else lines[1:]
+        budget = chunk_size - len(opener) - len(closer) - 2
+        return [f"{opener}\n{piece}\n{closer}" for piece in _pack(_group_statements(body), budget)]
+    if block.kind == "table":
+        header = "\n".join(lines[:2])
+        budget = chunk_size - len(header) - 1
+        return [f"{header}\n{piece}" for piece in _pack(lines[2:], budget)]
+    return [chunk.text for chunk in iter_text_chunks(io.StringIO(block.text), chunk_size, chunk_overlap)]
+
+
+def split_markdown(text: str, chunk_size: int = 1200, chunk_overlap: int = 150,
+                   split_level: int = 2, min_fill: float = 0.5) -> List[Tuple[str, Tuple[str, ...]]]:
+    """
+    Divide Markdown pela hierarquia de títulos, mantendo blocos inteiros
+
+    Títulos até o nível ``split_level`` sempre iniciam um chunk novo; abaixo
+    disso, subseções são agrupadas com a seção que abriu o chunk enquanto
+    couberem em ``chunk_size``, e um título de mesmo nível da seção que abriu
+    o chunk também inicia um chunk. Uma subseção que chega com o chunk já
+    acima de ``min_fill`` do tamanho começa um chunk novo. Títulos nunca ficam sozinhos no fim de um
+    chunk: seguem junto com o primeiro bloco de conteúdo. Código, SQL e
+    tabelas só são divididos quando sozinhos excedem ``chunk_size`` (SQL por
+    comando, tabelas por linha com o cabeçalho repetido). Cada chunk começa
+    com o caminho dos títulos acima dele (ex.: o título do documento).
+    ``chunk_overlap`` vale apenas para parágrafos longos.
+
+    Retorna ``[(texto, caminho_de_titulos), ...]``.
+    """
+    chunks: List[Tuple[str, Tuple[str, ...]]] = []
+    parts: List[str] = []
+    size = 0
+    chunk_path: Tuple[str, ...] = ()
+    chunk_level = 0
+    pending: List[MarkdownBlock] = []
+
+    def flush():
+        nonlocal parts, size
+        if parts:
+            chunks.append(("\n\n".join(parts), chunk_path))
+        parts, size = [], 0
+
+    for block in iter_markdown_blocks(text):
+        if block.kind == "heading":
+            if parts and not pending:
+                if block.level <= split_level or block.level <= chunk_level:
+                    flush()
+                    chunk_level = 0
+                elif size >= chunk_size * min_fill:
+                    # chunk já bem cheio: a subseção começa um chunk novo em vez de ser cortada
+                    flush()
+            pending.append(block)
+            continue
+
+        # Orçamento do bloco descontando o que um chunk novo leva antes dele (caminho de títulos e títulos pendentes)
+        context = pending[0].headings[:-1] if pending else block.headings
+        overhead = sum(len(heading.text) + 2 for heading in pending)
+        if context:
+            overhead += len(HEADING_PATH_SEPARATOR.join(context)) + 2
+        budget = max(1, chunk_size - overhead)
+        pieces = [block.text] if len(block.text) <= budget else _split_oversized(block, budget, chunk_overlap)
+        for piece in pieces:
+            unit = "\n\n".join([heading.text for heading in pending] + [piece])
+            if parts and size + len(unit) + 2 > chunk_size:
+                flush()
+            if not parts:
+                if pending:
+                    chunk_path = pending[0].headings
+                    chunk_level = chunk_level or pending[0].level
+                    context = chunk_path[:-1]
+                else:
+                    chunk_path = block.headings
+                    chunk_level = chunk_level or block.level
+                    context = chunk_path
+                if context:
+                    breadcrumb = HEADING_PATH_SEPARATOR.join(context)
+                    parts.append(breadcrumb)
+                    size = len(breadcrumb) + 2
+            parts.append(unit)
+            size += len(unit) + 2
+            pending = []
+
+    if pending:
+        # títulos sem conteúdo no fim do documento
+        if not parts:
+            chunk_path = pending[0].headings
+        parts.extend(heading.text for heading in pending)
+    flush()
+    return chunks
+
+
+def split_sql(text: str, chunk_size: int = 1200) -> List[str]:
+    """Divide um script SQL agrupando comandos inteiros em chunks de até ``chunk_size``"""
+    return [piece for piece in _pack(_group_statements(text.splitlines()), chunk_size) if piece.strip()]
+
+
+def split_documents_by_structure(documents: Iterable["Document"],
+                                 chunk_size: int = 1200,
+                                 chunk_overlap: int = 150) -> List["Document"]:
+    """
+    Divide documentos LangChain com ``split_markdown`` (ou ``split_sql`` para ``.sql``)
+
+    Os metadados originais são preservados e cada chunk recebe
+    ``heading_path`` (títulos separados por ``" > "``) e ``section`` (título
+    mais interno) quando houver títulos.
+    """
+    from langchain_core.documents import Document
+
+    chunks: List[Document] = []
+    for document in documents:
+        source = str(document.metadata.get("source", ""))
+        if source.lower().endswith(".sql"):
+            pieces = [(piece, ()) for piece in split_sql(document.page_content, chunk_size)]
+        else:
+            pieces = split_markdown(document.page_content, chunk_size, chunk_overlap)
+
+        for text, path in pieces:
+            metadata = dict(document.metadata)
+            if path:
+                metadata["heading_path"] = HEADING_PATH_SEPARATOR.join(path)
+                metadata["section"] = path[-1]
+            chunks.append(Document(page_content=text, metadata=metadata))
+    return chunks
+
+
+def heading_offsets(text: str) -> List[Tuple[int, Tuple[str, ...]]]:
+    """
+    Posição (em caracteres) de cada título ATX fora de blocos de código e o
+    caminho de títulos em vigor a partir dela, em ordem
+    """
+    offsets: List[Tuple[int, Tuple[str, ...]]] = []
+    headings: List[Tuple[int, str]] = []
+    fence: Optional[str] = None
+    position = 0
+    for line in text.splitlines(keepends=True):
+        start, position = position, position + len(line)
+        if fence is not None:
+            if line.strip().startswith(fence):
+                fence = None
+            continue
+        fence = _fence_marker(line)
+        level = 0 if fence else heading_level(line)
+        if not level:
+            continue
+        while headings and headings[-1][0] >= level:
+            headings.pop()
+        headings.append((level, line.strip().lstrip("#").strip()))
+        offsets.append((start, tuple(title for _, title in headings)))
+    return offsets
+
+
+def attach_heading_paths(text: str, chunks: List["Document"]) -> List["Document"]:
+    """
+    Preenche ``heading_path``/``section`` em chunks de ``text`` feitos por outro
+    divisor (o recursivo), a partir de ``start_index`` (``add_start_index=True``)
+
+    ``heading_path`` é o caminho em vigor no início do chunk (ou o do primeiro
+    título dele, se o chunk começar antes de qualquer título) e ``headings``
+    lista todos os títulos em vigor em algum ponto do chunk, para o filtro por
+    seção achar também os títulos abertos no meio dele.
+    """
+    offsets = heading_offsets(text)
+    for chunk in chunks:
+        start = chunk.metadata.pop("start_index", -1)
+        if not offsets or start < 0:
+            continue
+        end = start + len(chunk.page_content)
+        paths = [path for offset, path in offsets if offset <= start][-1:]
+        paths += [path for offset, path in offsets if start < offset < end]
+        if not paths:
+            continue
+        chunk.metadata["heading_path"] = HEADING_PATH_SEPARATOR.join(paths[0])
+        chunk.metadata["section"] = paths[0][-1]
+        chunk.metadata["headings"] = sorted({title for path in paths for title in path})
+    return chunks
+
+
+# Perguntas de referência sobre docs/SP_AT_INT_APLICINSUMOAGRIC_Documentacao_Tecnica.md:
+# a recuperação acerta quando algum chunk do top-k contém todos os trechos esperados
+PERGUNTAS_REFERENCIA: List[Tuple[str, Tuple[str, ...]]] = [
+    ("Quais insumos recebem os sufixos RES.90 e RES.60?", ("3502950", "RES.90", "RES.60")),
+    ("Como é implementado o CASE que define RES.90 e RES.60?", ("MONTH(DATAAPLICFINAL) IN (9,10)", "ELSE DESCRICAOINSUMO")),
+    ("Como a procedure recria a tabela INT_APLICINSUMOAGRIC?", ("DROP TABLE IF EXISTS", "SELECT * INTO")),
+    ("Como é formado o campo SE_USINA?", ("SE_USINA", "COALESCE")),
+    ("Como são tratados zeros em quantidade e dosagem?", ("QUANTIDADE = CASE", "DOSAGEM = CASE")),
+    ("Qual a unidade usada para a operação de Vinhaça?", ("Vinhaça", "VINHACA")),
+    ("Qual é a chave primária e o relacionamento com talhões?", ("SE_APLICINSUMOAGRIC", "SE_TALHAO")),
+    ("O que significa ETL no glossário?", ("Extract, Transform, Load",)),
+    ("Como consultar aplicações por período?", ("DATAFINAL BETWEEN",)),
+]
+
+
+def comparar_chunkers(documents: Optional[Sequence["Document"]] = None,
+                      perguntas: Sequence[Tuple[str, Tuple[str, ...]]] = PERGUNTAS_REFERENCIA,
+                      k: int = 3,
+                      embeddings: Any = None) -> Dict[str, Dict[str, float]]:
+    """
+    Compara o divisor por estrutura com o ``RecursiveCharacterTextSplitter`` (1200/150)
+
+    Para cada estratégia mede o número de chunks, o tempo de indexação
+    (divisão + BM25 e, se ``embeddings`` for informado, FAISS), a taxa de
+    acerto no top-``k``, o MRR e quantos caracteres de contexto são
+    recuperados até o primeiro chunk que contém a resposta inteira (quanto
+    menos, menos contexto o LLM precisa receber). Sem ``embeddings`` a
+    recuperação é só BM25, que roda sem baixar modelos.
+    """
+    import time
+
+    from langchain_community.document_loaders import DirectoryLoader, TextLoader
+    from langchain_community.retrievers import BM25Retriever
+    from langchain_text_splitters import RecursiveCharacterTextSplitter
+
+    if documents is None:
+        documents = DirectoryLoader(
+            "docs/", glob="*.md", loader_cls=TextLoader, loader_kwargs={"encoding": "utf-8"}
+        ).load()
+
+    recursive = RecursiveCharacterTextSplitter(
+        chunk_size=1200, chunk_overlap=150, separators=["\n\n", "\n", " ", ".", ",", ""]
+    )
+    estrategias = {
+        'recursivo': recursive.split_documents,
+        'estrutura': lambda docs: split_documents_by_structure(docs, 1200, 150),
+    }
+
+    BM25Retriever.from_documents(documents)  # aquecimento: imports preguiçosos fora da medição
+
+    relatorio: Dict[str, Dict[str, float]] = {}
+    for nome, dividir in estrategias.items():
+        start = time.perf_counter()
+        chunks = dividir(documents)
+        # ranking completo para medir a posição da resposta além do top-k
+        retriever = BM25Retriever.from_documents(chunks, k=len(chunks))
+        if embeddings is not None:
+            from langchain_community.vectorstores import FAISS
+
+            retriever = FAISS.from_documents(chunks, embeddings).as_retriever(search_kwargs={"k": len(chunks)})
+        index_seconds = time.perf_counter() - start
+
+        acertos, reciprocos, caracteres = 0, 0.0, []
+        for pergunta, esperados in perguntas:
+            ranking = retriever.invoke(pergunta)
+            posicao = next(
+                (i for i, doc in enumerate(ranking, start=1) if all(t in doc.page_content for t in esperados)),
+                None,
+            )
+            if posicao is None:
+                continue
+            acertos += posicao <= k
+            reciprocos += 1 / posicao
+            caracteres.append(sum(len(doc.page_content) for doc in ranking[:posicao]))
+
+        total = max(len(perguntas), 1)
+        relatorio[nome] = {
+            'chunks': len(chunks),
+            'tamanho_medio': sum(len(c.page_content) for c in chunks) / max(len(chunks), 1),
+            'taxa_acerto': acertos / total,
+            'mrr': reciprocos / total,
+            'contexto_ate_resposta': sum(caracteres) / max(len(caracteres), 1),
+            'tempo_indexacao': index_seconds,
+        }
+        print(f"📊 {nome}: {len(chunks)} chunks, acerto@{k} {relatorio[nome]['taxa_acerto']:.0%}, "
+              f"MRR {relatorio[nome]['mrr']:.2f}, "
+              f"{relatorio[nome]['contexto_ate_resposta']:.0f} caracteres até a resposta, "
+              f"indexação {index_seconds * 1000:.1f} ms")
+    return relatorio
@@ -0,0 +1,202 @@
+"""
+Coalescência de perguntas iguais em andamento
+Quando vários usuários mandam a mesma pergunta ao mesmo tempo, só uma recuperação + chamada ao
+Gemini é executada; as demais requisições esperam por ela e recebem o mesmo resultado (cada uma
+continua com a sua memória de conversa e o seu registro no histórico)
+"""
+
+import logging
+import os
+import re
+import threading
+import time
+import unicodedata
+from typing import Any, Callable, Dict, Optional, Tuple
+
+from langchain.chains import ConversationalRetrievalChain
+from langchain.chains.conversational_retrieval.base import _get_chat_history
+from langchain_core.callbacks import CallbackManagerForChainRun
+
+from llm_gateway import track_degraded
+from result_cache import make_cache_key
+from tracing import inc, record_stage, set_trace_labels, stage
+
+coalescing_logger = logging.getLogger("coalescing")
+
+COALESCE_ENABLED = os.getenv("COALESCE_REQUESTS", "1").strip().lower() not in {"0", "false"}
+
+_PUNCTUATION = re.compile(r"[^\w\s]")
+_WHITESPACE = re.compile(r"\s+")
+
+
+def normalize_question(question: str) -> str:
+    """``  Qual é a ORIGEM dos dados?`` → ``qual e a origem dos dados`` (sem acentos, pontuação e espaços extras)"""
+    decomposed = unicodedata.normalize("NFKD", question.casefold())
+    text = "".join(char for char in decomposed if not unicodedata.combining(char))
+    return _WHITESPACE.sub(" ", _PUNCTUATION.sub(" ", text)).strip()
+
+
+class _Flight:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result: Any = None
+        self.error: Optional[BaseException] = None
+        self.followers = 0
+
+
+class SingleFlight:
+    """
+    Uma execução por chave entre chamadas simultâneas
+
+    A primeira chamada com uma chave executa ``function``; as que chegam
+    enquanto ela está em andamento esperam e recebem o mesmo resultado (ou a
+    mesma exceção). Nada fica guardado depois que a execução termina.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._flights: Dict[str, _Flight] = {}
+        self.leaders = 0
+        self.followers = 0
+
+    def do(self, key: str, function: Callable[[], Any]) -> Tuple[Any, bool]:
+        """Retorna ``(resultado, compartilhado)``; ``compartilhado`` indica que outra chamada executou"""
+        with self._lock:
+            flight = self._flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._flights[key] = _Flight()
+                self.leaders += 1
+            else:
+                flight.followers += 1
+                self.followers += 1
+
+        if not leader:
+            flight.done.wait()
+            if flight.error is not None:
+                raise flight.error
+            return flight.result, True
+
+        try:
+            flight.result = function()
+        except BaseException as e:
+            flight.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._flights[key]
+            flight.done.set()
+            if flight.followers:
+                coalescing_logger.info(f"{flight.followers} requisição(ões) aproveitaram a execução de {key[:8]}")
+        return flight.result, False
+
+    def in_flight(self) -> int:
+        with self._lock:
+            return len(self._flights)
+
+    def stats(self) -> Dict[str, Any]:
+        total = self.leaders + self.followers
+        return {
+            'executions': self.leaders,
+            'coalesced': self.followers,
+            'coalesced_rate': (self.followers / total * 100) if total else 0.0,
+            'in_flight': self.in_flight(),
+        }
+
+
+ANSWER_FLIGHTS = SingleFlight()
+
+
+class CoalescingRetrievalChain(ConversationalRetrievalChain):
+    """
+    ``ConversationalRetrievalChain`` que coalesce recuperação e resposta
+
+    A pergunta reformulada (standalone) continua sendo gerada com o histórico
+    de cada usuário; a chave junta essa pergunta normalizada com
+    ``coalesce_scope`` (versão do corpus e filtro de metadados). A memória é
+    atualizada pelo ``invoke`` de cada chamada, como na cadeia original.
+    Respostas degradadas (stub do ``llm_gateway``) nunca são compartilhadas.
+
+    Com ``extractive`` (um ``extractive.ExtractiveAnswerer``) a resposta pode
+    sair direto do primeiro chunk recuperado, sem chamar o LLM; a saída traz
+    ``answer_mode`` (``extractive``, ``generative`` ou ``no_documents``).
+    """
+
+    coalesce_scope: str = ""
+    extractive: Optional[Any] = None
+
+    def _call(self, inputs: Dict[str, Any],
+              run_manager: Optional[CallbackManagerForChainRun] = None) -> Dict[str, Any]:
+        _run_manager = run_manager or CallbackManagerForChainRun.get_noop_manager()
+        question = inputs["question"]
+        get_chat_history = self.get_chat_history or _get_chat_history
+        chat_history_str = get_chat_history(inputs["chat_history"])
+
+        if chat_history_str:
+            generated = self.question_generator.invoke(
+                {"question": question, "chat_history": chat_history_str},
+                config={"callbacks": _run_manager.get_child()},
+            )
+            new_question = generated[self.question_generator.output_keys[0]]
+        else:
+            new_question = question
+
+        def answer() -> Dict[str, Any]:
+            with track_degraded() as degraded:
+                output = self._retrieve_and_answer(inputs, new_question, chat_history_str, _run_manager)
+            if degraded:
+                output["degraded"] = True
+            return output
+
+        if COALESCE_ENABLED:
+            # Sem reformulação a resposta usa a pergunta original, que então entra na chave
+            content = normalize_question(new_question if self.rephrase_question else f"{new_question}\x1f{question}")
+            start = time.perf_counter()
+            output, shared = ANSWER_FLIGHTS.do(make_cache_key(content, scope=self.coalesce_scope), answer)
+            if shared and output.get("degraded"):
+                # Resposta do stub (provedores fora do ar): não é compartilhada, cada requisição gera a sua
+                output = answer()
+            elif shared:
+                record_stage("coalesced_wait", start, time.perf_counter())
+                inc("rag_coalesced_total")
+        else:
+            output = answer()
+
+        output = dict(output)
+        answer_mode = output.setdefault("answer_mode", "generative")
+        set_trace_labels(answer_mode=answer_mode)
+        inc("rag_answers_total", mode=answer_mode)
+        if self.return_generated_question:
+            output["generated_question"] = new_question
+        return output
+
+    def _retrieve_and_answer(self, inputs: Dict[str, Any], new_question: str, chat_history_str: str,
+                             run_manager: CallbackManagerForChainRun) -> Dict[str, Any]:
+        docs = self._get_docs(new_question, inputs, run_manager=run_manager)
+        output: Dict[str, Any] = {}
+        extracted = None
+        if self.extractive is not None and docs:
+            with stage("extractive"):
+                extracted = self.extractive.answer(new_question, docs)
+
+        if extracted is not None:
+            output[self.output_key] = extracted.text
+            output["answer_mode"] = "extractive"
+            # A citação aponta para o chunk de onde saiu o trecho
+            docs = [extracted.document]
+        elif self.response_if_no_docs_found is not None and len(docs) == 0:
+            output[self.output_key] = self.response_if_no_docs_found
+            output["answer_mode"] = "no_documents"
+        else:
+            new_inputs = inputs.copy()
+            if self.rephrase_question:
+                new_inputs["question"] = new_question
+            new_inputs["chat_history"] = chat_history_str
+            answer = self.combine_docs_chain.invoke(
+                {"input_documents": docs, **new_inputs}, config={"callbacks": run_manager.get_child()}
+            )
+            output[self.output_key] = answer[self.combine_docs_chain.output_keys[0]]
+            output["answer_mode"] = "generative"
+        if self.return_source_documents:
+            output["source_documents"] = docs
+        return output
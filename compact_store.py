@@ -0,0 +1,406 @@
+"""
+Armazenamento compacto do índice vetorial
+Vetores quantizados (SQ8 ou fp16) em memória com rescoring a partir de uma cópia float16
+lida por mmap, e texto dos chunks em um blob append-only com tabela de offsets (também por
+mmap): os ``Document`` só são criados para os resultados finais, em vez de um
+``InMemoryDocstore`` serializado com pickle contendo todos os objetos
+
+Uso:
+    python compact_store.py [numero_de_chunks] [sq8|fp16]
+"""
+
+import json
+import logging
+import mmap
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from collections.abc import Mapping, Sequence
+from pathlib import Path
+from typing import TYPE_CHECKING, Any, Dict, Iterable, Iterator, Optional, Tuple, Union
+
+import numpy as np
+from langchain_community.docstore.base import Docstore
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+
+if TYPE_CHECKING:
+    from langchain_community.vectorstores import FAISS
+
+store_logger = logging.getLogger("compact_store")
+
+CODECS = ("sq8", "fp16")
+DEFAULT_CODEC = "sq8"
+# Candidatos do SQ8 por resultado final que são reordenados com a distância em float16
+RESCORE_FACTOR = 4
+
+MANIFEST_FILE = "manifest.json"
+CODES_FILE = "vectors.sq"
+RESCORE_FILE = "vectors.f16.npy"
+BLOB_FILE = "chunks.bin"
+OFFSETS_FILE = "offsets.npy"
+
+STORAGE_BENCHMARK_PATH = "storage_benchmark.json"
+
+
+class ChunkBlob(Sequence):
+    """
+    Chunks gravados em sequência em ``chunks.bin`` (um JSON por chunk) e lidos por mmap
+
+    ``offsets[i]:offsets[i + 1]`` delimita o chunk ``i``; ``blob[i]`` decodifica
+    só aquele chunk. As páginas do arquivo ficam no cache do sistema e são
+    compartilhadas entre os workers.
+    """
+
+    def __init__(self, directory: Union[str, Path]):
+        directory = Path(directory)
+        self._offsets = np.load(directory / OFFSETS_FILE, mmap_mode="r")
+        self._file = open(directory / BLOB_FILE, "rb")
+        size = os.fstat(self._file.fileno()).st_size
+        self._data = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ) if size else b""
+
+    @staticmethod
+    def write(directory: Union[str, Path], documents: Iterable[Document]) -> int:
+        """Acrescenta ``documents`` ao blob de ``directory`` e regrava a tabela de offsets"""
+        directory = Path(directory)
+        offsets_path = directory / OFFSETS_FILE
+        offsets = list(np.load(offsets_path)) if offsets_path.exists() else [0]
+        with open(directory / BLOB_FILE, "ab") as blob:
+            for document in documents:
+                record = json.dumps({'t': document.page_content, 'm': document.metadata},
+                                    ensure_ascii=False, default=str).encode("utf-8")
+                blob.write(record)
+                offsets.append(offsets[-1] + len(record))
+        np.save(offsets_path, np.asarray(offsets, dtype=np.int64))
+        return len(offsets) - 1
+
+    def __len__(self) -> int:
+        return len(self._offsets) - 1
+
+    def __getitem__(self, item):
+        if isinstance(item, slice):
+            return [self[i] for i in range(*item.indices(len(self)))]
+        position = int(item)
+        if position < 0:
+            position += len(self)
+        if not 0 <= position < len(self):
+            raise IndexError(f"chunk {item} fora do intervalo (0..{len(self) - 1})")
+        record = json.loads(self._data[int(self._offsets[position]):int(self._offsets[position + 1])])
+        return Document(page_content=record['t'], metadata=record['m'])
+
+    def __iter__(self) -> Iterator[Document]:
+        for position in range(len(self)):
+            yield self[position]
+
+    def close(self):
+        if isinstance(self._data, mmap.mmap):
+            self._data.close()
+        self._file.close()
+
+
+class LazyDocstore(Docstore):
+    """Docstore do LangChain sobre o ``ChunkBlob`` (o id é a posição do chunk)"""
+
+    def __init__(self, blob: ChunkBlob):
+        self.blob = blob
+
+    def search(self, search: str) -> Union[str, Document]:
+        try:
+            return self.blob[int(search)]
+        except (ValueError, IndexError):
+            return f"ID {search} not found."
+
+
+class RowIds(Mapping):
+    """``index_to_docstore_id`` sem um dicionário com uma string por linha"""
+
+    def __init__(self, size: int):
+        self.size = size
+
+    def __getitem__(self, row) -> str:
+        row = int(row)
+        if not 0 <= row < self.size:
+            raise KeyError(row)
+        return str(row)
+
+    def __len__(self) -> int:
+        return self.size
+
+    def __iter__(self) -> Iterator[int]:
+        return iter(range(self.size))
+
+
+class QuantizedVectors:
+    """
+    Busca com a interface do ``faiss.Index`` (``search``, ``reconstruct``, ``ntotal``, ``d``)
+
+    Com SQ8 a busca aproximada seleciona ``k * rescore_factor`` candidatos e a
+    distância L2 é recalculada com os vetores float16 do mmap (só as linhas
+    dos candidatos são lidas do disco). Com fp16 os próprios códigos já têm
+    precisão suficiente e não há rescoring. Aceita ``params`` (ex.: o
+    ``IDSelector`` do filtro de metadados).
+    """
+
+    def __init__(self, codes: Any, rescore: Optional[np.ndarray] = None, rescore_factor: int = RESCORE_FACTOR):
+        self.codes = codes
+        self.rescore = rescore
+        self.rescore_factor = rescore_factor
+
+    @property
+    def ntotal(self) -> int:
+        return self.codes.ntotal
+
+    @property
+    def d(self) -> int:
+        return self.codes.d
+
+    def search(self, x: np.ndarray, k: int, params: Any = None) -> Tuple[np.ndarray, np.ndarray]:
+        x = np.ascontiguousarray(x, dtype=np.float32)
+        if self.rescore is None or k <= 0:
+            return self.codes.search(x, k, params=params)
+
+        candidates = min(k * self.rescore_factor, self.ntotal)
+        _, rows = self.codes.search(x, candidates, params=params)
+        distances = np.full((len(x), k), np.finfo(np.float32).max, dtype=np.float32)
+        labels = np.full((len(x), k), -1, dtype=np.int64)
+        for query, query_rows in enumerate(rows):
+            valid = np.sort(query_rows[query_rows >= 0])
+            if len(valid) == 0:
+                continue
+            vectors = np.asarray(self.rescore[valid], dtype=np.float32)
+            exact = ((vectors - x[query]) ** 2).sum(axis=1)
+            order = np.argsort(exact)[:k]
+            distances[query, :len(order)] = exact[order]
+            labels[query, :len(order)] = valid[order]
+        return distances, labels
+
+    def reconstruct(self, row: int) -> np.ndarray:
+        if self.rescore is not None:
+            return np.asarray(self.rescore[int(row)], dtype=np.float32)
+        return self.codes.reconstruct(int(row))
+
+
+def compact_index_path(root: Union[str, Path], corpus_version: str, codec: str = DEFAULT_CODEC) -> Path:
+    return Path(root) / f"{corpus_version}_{codec}"
+
+
+def write_compact_index(directory: Union[str, Path],
+                        chunks: Sequence,
+                        vectors: np.ndarray,
+                        codec: str = DEFAULT_CODEC,
+                        extra: Optional[Dict[str, Any]] = None) -> Path:
+    """
+    Grava os vetores quantizados e o blob de chunks em ``directory``
+
+    A gravação acontece em um diretório temporário renomeado no final: um
+    processo que esteja lendo nunca vê um índice pela metade.
+    """
+    import faiss
+
+    if codec not in CODECS:
+        raise ValueError(f"Codec desconhecido: {codec} (use {', '.join(CODECS)})")
+    directory = Path(directory)
+    vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+    if len(vectors) != len(chunks):
+        raise ValueError(f"{len(vectors)} vetores para {len(chunks)} chunks")
+
+    directory.parent.mkdir(parents=True, exist_ok=True)
+    staging = Path(tempfile.mkdtemp(prefix=f".{directory.name}.", dir=directory.parent))
+    try:
+        dimension = vectors.shape[1] if vectors.ndim == 2 else 0
+        quantizer = faiss.ScalarQuantizer.QT_8bit if codec == "sq8" else faiss.ScalarQuantizer.QT_fp16
+        codes = faiss.IndexScalarQuantizer(dimension, quantizer, faiss.METRIC_L2)
+        if len(vectors):
+            codes.train(vectors)
+            codes.add(vectors)
+        faiss.write_index(codes, str(staging / CODES_FILE))
+        if codec == "sq8":
+            np.save(staging / RESCORE_FILE, vectors.astype(np.float16))
+
+        ChunkBlob.write(staging, chunks)
+        manifest = {'codec': codec, 'dimension': int(dimension), 'count': len(chunks), **(extra or {})}
+        (staging / MANIFEST_FILE).write_text(json.dumps(manifest, ensure_ascii=False, indent=2), encoding="utf-8")
+
+        if directory.exists():
+            shutil.rmtree(directory)
+        staging.rename(directory)
+    except BaseException:
+        shutil.rmtree(staging, ignore_errors=True)
+        raise
+    return directory
+
+
+def read_manifest(directory: Union[str, Path]) -> Dict[str, Any]:
+    """Manifesto do índice (codec, dimensão, quantidade e os ``extra`` da gravação)"""
+    return json.loads((Path(directory) / MANIFEST_FILE).read_text(encoding="utf-8"))
+
+
+def load_compact_index(directory: Union[str, Path], embeddings: Embeddings,
+                       rescore_factor: int = RESCORE_FACTOR) -> Tuple["FAISS", ChunkBlob]:
+    """``FAISS`` do LangChain sobre o índice compacto, e o blob (sequência preguiçosa de ``Document``)"""
+    import faiss
+    from langchain_community.vectorstores import FAISS
+
+    directory = Path(directory)
+    manifest = read_manifest(directory)
+    codes = faiss.read_index(str(directory / CODES_FILE))
+    rescore = np.load(directory / RESCORE_FILE, mmap_mode="r") if manifest['codec'] == "sq8" else None
+
+    blob = ChunkBlob(directory)
+    vectorstore = FAISS(
+        embedding_function=embeddings,
+        index=QuantizedVectors(codes, rescore, rescore_factor),
+        docstore=LazyDocstore(blob),
+        index_to_docstore_id=RowIds(len(blob)),
+    )
+    return vectorstore, blob
+
+
+def prune_compact_indexes(root: Union[str, Path], keep: Union[str, Path]):
+    """Remove os índices de versões anteriores do corpus (workers com mmap aberto continuam lendo)"""
+    root, keep = Path(root), Path(keep)
+    for entry in root.iterdir() if root.exists() else []:
+        if entry.is_dir() and entry != keep and not entry.name.startswith("."):
+            shutil.rmtree(entry, ignore_errors=True)
+
+
+def _directory_size(directory: Path) -> int:
+    return sum(path.stat().st_size for path in directory.rglob("*") if path.is_file())
+
+
+def _rss_bytes() -> int:
+    for line in Path("/proc/self/status").read_text().splitlines():
+        if line.startswith("VmRSS:"):
+            return int(line.split()[1]) * 1024
+    return 0
+
+
+def _measure_load(storage_format: str, directory: str, queries_path: str, k: int):
+    """Executado em um processo novo: tempo e RSS da carga, latência e resultados das buscas"""
+    from langchain_community.embeddings import FakeEmbeddings
+
+    queries = np.load(queries_path)
+    embeddings = FakeEmbeddings(size=queries.shape[1])
+    import faiss
+    from langchain_community.vectorstores import FAISS
+
+    # bibliotecas carregadas antes da medição: o RSS conta só o índice
+    store_logger.debug(f"faiss {faiss.__version__}")
+
+    rss_before, start = _rss_bytes(), time.perf_counter()
+    if storage_format == "atual":
+        vectorstore = FAISS.load_local(directory, embeddings, allow_dangerous_deserialization=True)
+    else:
+        vectorstore, _ = load_compact_index(directory, embeddings)
+    load_seconds = time.perf_counter() - start
+    rss_loaded = _rss_bytes()
+
+    start = time.perf_counter()
+    rows = []
+    for query in queries:
+        _, labels = vectorstore.index.search(query[None, :], k)
+        rows.append([int(row) for row in labels[0]])
+        # materializa os documentos do top-k, como no retriever
+        for row in labels[0]:
+            vectorstore.docstore.search(vectorstore.index_to_docstore_id[row])
+    search_ms = (time.perf_counter() - start) * 1000 / max(len(queries), 1)
+
+    print(json.dumps({
+        'load_seconds': load_seconds,
+        'rss_mb': (rss_loaded - rss_before) / 2 ** 20,
+        'rss_after_search_mb': (_rss_bytes() - rss_before) / 2 ** 20,
+        'search_ms': search_ms,
+        'rows': rows,
+    }))
+
+
+def benchmark_storage(num_chunks: int = 50_000,
+                      codec: str = DEFAULT_CODEC,
+                      dimension: int = 384,
+                      chunk_chars: int = 1200,
+                      queries: int = 200,
+                      k: int = 5,
+                      seed: int = 0) -> Dict[str, Any]:
+    """
+    Compara o formato atual (``FAISS.save_local``: float32 + docstore em pickle) com o compacto
+
+    Corpus sintético com vetores normalizados (como os do MiniLM). Cada carga
+    roda em um processo novo para o RSS não acumular; o recall@k do formato
+    compacto é medido contra a busca exata em float32 do formato atual.
+    """
+    import faiss
+    from langchain_community.docstore.in_memory import InMemoryDocstore
+    from langchain_community.embeddings import FakeEmbeddings
+    from langchain_community.vectorstores import FAISS
+
+    rng = np.random.default_rng(seed)
+    vectors = rng.standard_normal((num_chunks, dimension)).astype(np.float32)
+    vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+    words = np.array(["procedure", "tabela", "coluna", "insumo", "safra", "usina", "origem", "dados"])
+    text = " ".join(words[rng.integers(0, len(words), chunk_chars // 7)])
+    chunks = [Document(page_content=f"{i} {text}", metadata={'source': f"docs/doc_{i % 500}.md", 'chunk': i})
+              for i in range(num_chunks)]
+    query_vectors = vectors[rng.integers(0, num_chunks, queries)] + \
+        rng.standard_normal((queries, dimension)).astype(np.float32) * 0.05
+
+    report: Dict[str, Any] = {'chunks': num_chunks, 'dimension': dimension, 'codec': codec, 'k': k}
+    with tempfile.TemporaryDirectory(prefix="armazenamento_") as workdir:
+        workdir = Path(workdir)
+        queries_path = workdir / "queries.npy"
+        np.save(queries_path, query_vectors)
+
+        # Formato atual: o que ``FAISS.save_local`` grava em faiss_index/
+        index = faiss.IndexFlatL2(dimension)
+        index.add(vectors)
+        ids = {row: str(row) for row in range(num_chunks)}
+        current = FAISS(embedding_function=FakeEmbeddings(size=dimension), index=index,
+                        docstore=InMemoryDocstore({str(row): chunk for row, chunk in enumerate(chunks)}),
+                        index_to_docstore_id=ids)
+        current.save_local(str(workdir / "atual"))
+        write_compact_index(workdir / "compacto", chunks, vectors, codec)
+        del current, index
+
+        results = {}
+        for storage_format in ("atual", "compacto"):
+            completed = subprocess.run(
+                [sys.executable, os.path.abspath(__file__), "_carregar", storage_format,
+                 str(workdir / storage_format), str(queries_path), str(k)],
+                capture_output=True, text=True, check=True,
+            )
+            results[storage_format] = json.loads(completed.stdout.strip().splitlines()[-1])
+            results[storage_format]['disk_mb'] = _directory_size(workdir / storage_format) / 2 ** 20
+
+    exact = results['atual'].pop('rows')
+    approximate = results['compacto'].pop('rows')
+    report['recall_at_k'] = float(np.mean([len(set(a) & set(e)) / len(e) for a, e in zip(approximate, exact)]))
+    report.update(results)
+
+    print("🗜️ ARMAZENAMENTO DO ÍNDICE: atual x compacto")
+    print("=" * 40)
+    print(f"{num_chunks} chunks, {dimension} dimensões, codec {codec}")
+    for storage_format in ("atual", "compacto"):
+        result = report[storage_format]
+        print(f"   {storage_format:9} disco {result['disk_mb']:7.1f} MB | carga {result['load_seconds'] * 1000:7.0f} ms | "
+              f"RSS {result['rss_mb']:7.1f} MB | busca {result['search_ms']:.2f} ms")
+    print(f"   recall@{k} do compacto: {report['recall_at_k']:.3f}")
+    return report
+
+
+def main():
+    """Função principal"""
+    if len(sys.argv) > 1 and sys.argv[1] == "_carregar":
+        _measure_load(sys.argv[2], sys.argv[3], sys.argv[4], int(sys.argv[5]))
+        return
+
+    num_chunks = int(sys.argv[1]) if len(sys.argv) > 1 else 50_000
+    codec = sys.argv[2] if len(sys.argv) > 2 else DEFAULT_CODEC
+    report = benchmark_storage(num_chunks, codec)
+    Path(STORAGE_BENCHMARK_PATH).write_text(json.dumps(report, ensure_ascii=False, indent=2), encoding="utf-8")
+    print(f"💾 Resultados salvos em {STORAGE_BENCHMARK_PATH}")
+
+
+if __name__ == "__main__":
+    main()
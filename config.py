@@ -1,11 +1,30 @@
 # Configurações da IA - INTEGRADOR DE DADOS CONCISO
 # ========================================================
 
-# Configurações do modelo
+# Configurações do modelo (lidas pelo gateway em llm_gateway.py)
 MODEL_CONFIG = {
-    "triagem_model": "models/gemma-3-27b-it",
+    "primary_model": "gemini-2.5-flash",
+    # Tentados em ordem quando o principal falha, estoura o prazo ou está com o circuito aberto;
+    # "stub" responde com trechos do contexto, sem chamar nenhum provedor
+    "fallback_models": ["models/gemma-3-27b-it", "stub"],
     "temperature": 0.1,
-    "max_tokens": 1024  # Reduzido para forçar concisão
+    "max_tokens": 1024,  # Reduzido para forçar concisão
+
+    # Prazos e novas tentativas
+    "call_timeout_seconds": 20,   # por tentativa
+    "deadline_seconds": 45,       # por resposta, somando tentativas e fallbacks
+    "max_retries": 2,
+    "retry_base_delay_seconds": 0.5,
+    "max_concurrent_calls": 32,   # por modelo; sem vaga livre a chamada vai direto para o fallback
+
+    # Hedge: segunda requisição igual quando a primeira passa do p95 recente
+    "hedge_quantile": 0.95,       # None desativa
+    "hedge_min_delay_seconds": 1.0,
+    "hedge_budget": 0.1,          # no máximo 10% das chamadas com hedge
+
+    # Circuit breaker por modelo
+    "breaker_failures": 5,
+    "breaker_reset_seconds": 30,
 }
 
 # Estratégia: MÁXIMA CONCISÃO
@@ -18,6 +37,15 @@ STRATEGY_CONFIG = {
     "direct_answers_only": True
 }
 
+# Respostas extrativas: trechos do chunk mais bem ranqueado, sem chamar o LLM (extractive.py)
+EXTRACTIVE_CONFIG = {
+    "min_score": 0.6,           # similaridade (cosseno) mínima entre a pergunta e o primeiro chunk
+    "min_sentence_score": 0.5,  # similaridade mínima da melhor frase
+    "sentence_margin": 0.1,     # frases extras até esta distância da melhor
+    "max_sentences": 3,
+    "max_words": STRATEGY_CONFIG["max_response_words"],
+}
+
 # Thresholds de concisão (mais rigorosos)
 CONCISENESS_THRESHOLDS = {
     "ideal": 50,      # ≤50 palavras = ideal
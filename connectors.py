@@ -0,0 +1,397 @@
+"""
+Conectores de fontes de documentos para o indexador
+Diretórios locais, PDFs e wiki como fontes plugáveis, cada uma com seu cursor
+de alterações (mtime/tamanho, hash, ETag) e seu próprio intervalo de sincronização
+"""
+
+import json
+import logging
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple, Union
+from urllib.parse import urldefrag
+
+import requests
+from langchain_core.documents import Document
+
+from job_manifest import hash_file, hash_text
+
+connector_logger = logging.getLogger("connectors")
+
+DEFAULT_STATE_PATH = "index_state/sources.sqlite"
+
+
+@dataclass
+class SourceItem:
+    """Item novo ou alterado de uma fonte, com o cursor que o identifica e seus documentos"""
+    key: str
+    cursor: Dict[str, Any]
+    documents: List[Document]
+
+
+@dataclass
+class SyncResult:
+    """
+    Resultado da sincronização de uma fonte
+
+    ``changed`` substitui os documentos do item; ``touched`` só atualiza o
+    cursor (ex.: mtime mudou mas o conteúdo não); ``removed`` apaga itens
+    que deixaram de existir. Itens ausentes das três listas ficam como estão.
+    """
+    source: str
+    changed: List[SourceItem] = field(default_factory=list)
+    touched: Dict[str, Dict[str, Any]] = field(default_factory=dict)
+    removed: List[str] = field(default_factory=list)
+    unchanged: int = 0
+    elapsed: float = 0.0
+    error: Optional[str] = None
+
+    @property
+    def has_changes(self) -> bool:
+        return bool(self.changed or self.removed)
+
+
+class SourceConnector:
+    """
+    Interface das fontes: ``sync`` recebe os cursores atuais e devolve só o que mudou
+
+    ``interval`` é o intervalo mínimo, em segundos, entre sincronizações da
+    fonte (cada fonte tem o seu).
+    """
+
+    def __init__(self, name: str, interval: float):
+        self.name = name
+        self.interval = interval
+
+    def sync(self, cursors: Dict[str, Dict[str, Any]]) -> SyncResult:
+        raise NotImplementedError
+
+
+def _stat_cursor(path: Path) -> Dict[str, Any]:
+    stat = path.stat()
+    return {'mtime_ns': stat.st_mtime_ns, 'size': stat.st_size}
+
+
+def _scan_files(connector: "LocalDirectoryConnector", cursors: Dict[str, Dict[str, Any]],
+                load: Callable[[Path], List[Document]]) -> SyncResult:
+    """Varredura comum a diretórios e PDFs: size/mtime como atalho, hash como confirmação"""
+    result = SyncResult(source=connector.name)
+    seen = set()
+    for path in connector.files():
+        key = path.as_posix()
+        seen.add(key)
+        cursor = _stat_cursor(path)
+        previous = cursors.get(key)
+        if previous and (previous.get('mtime_ns'), previous.get('size')) == (cursor['mtime_ns'], cursor['size']):
+            result.unchanged += 1
+            continue
+
+        cursor['hash'] = hash_file(path)
+        if previous and previous.get('hash') == cursor['hash']:
+            result.touched[key] = cursor
+            continue
+        result.changed.append(SourceItem(key=key, cursor=cursor, documents=load(path)))
+
+    result.removed = [key for key in cursors if key not in seen]
+    return result
+
+
+class LocalDirectoryConnector(SourceConnector):
+    """Arquivos de texto/Markdown de um diretório; cursor por arquivo (mtime, tamanho, hash)"""
+
+    def __init__(self,
+                 directory: Union[str, Path],
+                 pattern: str = "*.md",
+                 name: Optional[str] = None,
+                 interval: float = 60.0,
+                 recursive: bool = False,
+                 exclude_suffixes: Sequence[str] = ()):
+        super().__init__(name or f"dir:{Path(directory).as_posix()}", interval)
+        self.directory = Path(directory)
+        self.pattern = pattern
+        self.recursive = recursive
+        self.exclude_suffixes = tuple(exclude_suffixes)
+
+    def files(self) -> List[Path]:
+        if not self.directory.is_dir():
+            return []
+        paths = self.directory.rglob(self.pattern) if self.recursive else self.directory.glob(self.pattern)
+        return sorted(path for path in paths if path.is_file() and not path.name.endswith(self.exclude_suffixes))
+
+    def _load(self, path: Path) -> List[Document]:
+        text = path.read_text(encoding="utf-8", errors="replace")
+        return [Document(page_content=text, metadata={"source": path.as_posix()})]
+
+    def sync(self, cursors: Dict[str, Dict[str, Any]]) -> SyncResult:
+        return _scan_files(self, cursors, self._load)
+
+
+class PdfFolderConnector(LocalDirectoryConnector):
+    """
+    PDFs de um diretório, convertidos com ``converter_pdf_markdown`` (cache por hash)
+
+    Cada página vira um documento com ``source`` apontando para o PDF e
+    ``page`` com o número da página.
+    """
+
+    def __init__(self,
+                 directory: Union[str, Path],
+                 output_dir: Optional[Union[str, Path]] = None,
+                 name: Optional[str] = None,
+                 interval: float = 300.0,
+                 recursive: bool = False,
+                 workers: Optional[int] = None):
+        super().__init__(directory, "*.pdf", name or f"pdf:{Path(directory).as_posix()}", interval, recursive)
+        self.output_dir = Path(output_dir) if output_dir else self.directory
+        self.workers = workers
+
+    def sync(self, cursors: Dict[str, Dict[str, Any]]) -> SyncResult:
+        from converter_pdf_markdown import OUTPUT_SUFFIX, converter_diretorio, iter_paginas
+
+        if not self.files():
+            return SyncResult(source=self.name, removed=list(cursors))
+        report = converter_diretorio(self.directory, self.output_dir, workers=self.workers, recursive=self.recursive)
+
+        def load(path: Path) -> List[Document]:
+            info = report.get(path.relative_to(self.directory).as_posix(), {})
+            if info.get("status") == "erro":
+                raise RuntimeError(info.get("erro"))
+            markdown = (self.output_dir / f"{path.stem}{OUTPUT_SUFFIX}").read_text(encoding="utf-8")
+            documents = []
+            for page, text in iter_paginas(markdown):
+                metadata = {"source": path.as_posix()}
+                if page is not None:
+                    metadata["page"] = page
+                documents.append(Document(page_content=text, metadata=metadata))
+            return documents
+
+        return _scan_files(self, cursors, load)
+
+
+class WikiConnector(SourceConnector):
+    """
+    Crawl do wiki com requisições condicionais (``If-None-Match``/``If-Modified-Since``)
+
+    Cada nível da busca em largura é baixado em paralelo. O cursor de cada
+    página guarda ETag, Last-Modified, hash do texto extraído e os links da
+    página, de modo que uma resposta 304 continua o crawl sem baixar nem
+    processar a página de novo. Páginas que não são mais alcançadas saem do
+    índice; páginas que falharam mantêm a versão anterior (e seus links).
+    """
+
+    def __init__(self,
+                 home_url: str,
+                 extract: Callable[[str, str], Tuple[str, List[str]]],
+                 max_depth: int = 2,
+                 max_pages: int = 25,
+                 name: str = "wiki",
+                 interval: float = 3600.0,
+                 timeout: float = 30.0,
+                 workers: int = 8):
+        super().__init__(name, interval)
+        self.home_url = home_url
+        self.extract = extract
+        self.max_depth = max_depth
+        self.max_pages = max_pages
+        self.timeout = timeout
+        self.workers = workers
+        self._session = requests.Session()
+
+    def _fetch(self, url: str, previous: Optional[Dict[str, Any]]) -> Tuple[Optional[requests.Response], Optional[str]]:
+        headers = {}
+        if previous:
+            if previous.get('etag'):
+                headers['If-None-Match'] = previous['etag']
+            if previous.get('last_modified'):
+                headers['If-Modified-Since'] = previous['last_modified']
+        try:
+            response = self._session.get(url, headers=headers, timeout=self.timeout)
+            if response.status_code != 304:
+                response.raise_for_status()
+            return response, None
+        except requests.RequestException as exc:
+            return None, str(exc)
+
+    def sync(self, cursors: Dict[str, Dict[str, Any]]) -> SyncResult:
+        result = SyncResult(source=self.name)
+        visited = set()
+        failed = set()
+        pages = 0
+        level = [urldefrag(self.home_url)[0].rstrip("/")]
+
+        with ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="wiki-sync") as pool:
+            for depth in range(self.max_depth + 1):
+                level = [url for url in dict.fromkeys(level) if url not in visited][:self.max_pages - pages]
+                if not level:
+                    break
+                visited.update(level)
+                responses = list(pool.map(lambda url: self._fetch(url, cursors.get(url)), level))
+
+                next_level: List[str] = []
+                for url, (response, error) in zip(level, responses):
+                    previous = cursors.get(url)
+                    if response is None:
+                        connector_logger.warning(f"Falha ao buscar {url}: {error}")
+                        if not previous:
+                            failed.add(url)
+                            continue
+                        # mantém a versão anterior e segue os links conhecidos
+                        links = previous.get('links', [])
+                        result.unchanged += 1
+                    elif response.status_code == 304 and previous:
+                        links = previous.get('links', [])
+                        result.unchanged += 1
+                    else:
+                        text, links = self.extract(response.text, url)
+                        cursor = {
+                            'etag': response.headers.get('ETag'),
+                            'last_modified': response.headers.get('Last-Modified'),
+                            'hash': hash_text(text),
+                            'links': links,
+                        }
+                        if previous and previous.get('hash') == cursor['hash']:
+                            result.touched[url] = cursor
+                        else:
+                            documents = [Document(page_content=text, metadata={"source": url})] if text else []
+                            result.changed.append(SourceItem(key=url, cursor=cursor, documents=documents))
+
+                    pages += 1
+                    if depth < self.max_depth:
+                        next_level.extend(links)
+                level = next_level
+
+        if not failed:
+            # com falhas o crawl pode ter deixado de alcançar páginas que ainda existem
+            result.removed = [url for url in cursors if url not in visited]
+        return result
+
+
+class SourceStore:
+    """
+    Estado das fontes em SQLite: cursor e documentos de cada item, última sincronização de cada fonte
+
+    Guardar os documentos permite montar o corpus completo sem reler as
+    fontes que não mudaram.
+    """
+
+    def __init__(self, path: Union[str, Path] = DEFAULT_STATE_PATH):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(str(self.path), timeout=30, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript(
+            "CREATE TABLE IF NOT EXISTS sources ("
+            " name TEXT PRIMARY KEY, last_sync REAL NOT NULL, last_error TEXT);"
+            "CREATE TABLE IF NOT EXISTS items ("
+            " source TEXT NOT NULL,"
+            " item_key TEXT NOT NULL,"
+            " cursor TEXT NOT NULL,"
+            " documents TEXT NOT NULL,"
+            " updated_at REAL NOT NULL,"
+            " PRIMARY KEY (source, item_key));"
+        )
+        self._conn.commit()
+
+    def cursors(self, source: str) -> Dict[str, Dict[str, Any]]:
+        with self._lock:
+            rows = self._conn.execute("SELECT item_key, cursor FROM items WHERE source = ?", (source,)).fetchall()
+        return {key: json.loads(cursor) for key, cursor in rows}
+
+    def last_sync(self, source: str) -> Optional[float]:
+        with self._lock:
+            row = self._conn.execute("SELECT last_sync FROM sources WHERE name = ?", (source,)).fetchone()
+        return row[0] if row else None
+
+    def apply(self, result: SyncResult):
+        """Grava o resultado de uma sincronização em uma transação"""
+        now = time.time()
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO items (source, item_key, cursor, documents, updated_at)"
+                " VALUES (?, ?, ?, ?, ?)",
+                [
+                    (result.source, item.key, json.dumps(item.cursor),
+                     json.dumps([{'page_content': doc.page_content, 'metadata': doc.metadata}
+                                 for doc in item.documents], ensure_ascii=False, default=str),
+                     now)
+                    for item in result.changed
+                ],
+            )
+            self._conn.executemany(
+                "UPDATE items SET cursor = ?, updated_at = ? WHERE source = ? AND item_key = ?",
+                [(json.dumps(cursor), now, result.source, key) for key, cursor in result.touched.items()],
+            )
+            self._conn.executemany(
+                "DELETE FROM items WHERE source = ? AND item_key = ?",
+                [(result.source, key) for key in result.removed],
+            )
+            self._conn.execute(
+                "INSERT OR REPLACE INTO sources (name, last_sync, last_error) VALUES (?, ?, ?)",
+                (result.source, now, result.error),
+            )
+            self._conn.commit()
+
+    def documents(self, sources: Sequence[str]) -> List[Document]:
+        """Documentos das fontes indicadas, na ordem das fontes e de inclusão dos itens"""
+        documents: List[Document] = []
+        with self._lock:
+            for source in sources:
+                rows = self._conn.execute(
+                    "SELECT documents FROM items WHERE source = ? ORDER BY rowid", (source,)
+                ).fetchall()
+                for (payload,) in rows:
+                    documents.extend(Document(**doc) for doc in json.loads(payload))
+        return documents
+
+
+class SourceIndexer:
+    """
+    Sincroniza as fontes conforme o intervalo de cada uma e junta seus documentos
+
+    Uma fonte com erro mantém os documentos da sincronização anterior e não
+    impede as demais.
+    """
+
+    def __init__(self, connectors: Sequence[SourceConnector], store: Optional[SourceStore] = None):
+        names = [connector.name for connector in connectors]
+        if len(set(names)) != len(names):
+            raise ValueError(f"Nomes de fontes repetidos: {names}")
+        self.connectors = list(connectors)
+        self.store = store or SourceStore()
+        self._sync_lock = threading.Lock()
+
+    def is_due(self, connector: SourceConnector, now: Optional[float] = None) -> bool:
+        last_sync = self.store.last_sync(connector.name)
+        return last_sync is None or (now or time.time()) - last_sync >= connector.interval
+
+    def sync(self, force: bool = False) -> List[SyncResult]:
+        """Sincroniza as fontes vencidas (ou todas com ``force``) e retorna os resultados"""
+        results: List[SyncResult] = []
+        with self._sync_lock:
+            for connector in self.connectors:
+                if not force and not self.is_due(connector):
+                    continue
+
+                start = time.monotonic()
+                cursors = self.store.cursors(connector.name)
+                try:
+                    result = connector.sync(cursors)
+                except Exception as exc:
+                    connector_logger.error(f"Erro ao sincronizar {connector.name}: {exc}")
+                    result = SyncResult(source=connector.name, error=str(exc))
+                result.elapsed = time.monotonic() - start
+                self.store.apply(result)
+                results.append(result)
+                connector_logger.info(
+                    f"{connector.name}: {len(result.changed)} alterados, {len(result.removed)} removidos, "
+                    f"{result.unchanged + len(result.touched)} sem mudança ({result.elapsed:.2f}s)"
+                )
+        return results
+
+    def documents(self) -> List[Document]:
+        return self.store.documents([connector.name for connector in self.connectors])
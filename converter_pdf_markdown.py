@@ -3,114 +3,229 @@
 """
 Script para converter PDF para Markdown
 Otimizado para documentação técnica
+
+Converte diretórios inteiros de PDFs, com as páginas de cada PDF distribuídas
+em um pool de processos. O resultado é gravado página a página em disco e
+cacheado pelo hash do PDF: PDFs inalterados não são convertidos de novo.
+Cada página recebe um marcador ``<!-- pagina: N -->`` usado pelo indexador
+para preencher ``metadata["page"]`` dos chunks.
 """
 
+import importlib.util
+import json
+import logging
 import os
+import re
+import sys
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
 from pathlib import Path
+from typing import Dict, Iterator, List, Optional, Tuple, Union
 
-def converter_com_pymupdf():
-    """Converte usando PyMuPDF4LLM (recomendado)"""
-    try:
+from job_manifest import hash_file
+
+converter_logger = logging.getLogger("converter_pdf_markdown")
+
+# Backends em ordem de preferência
+BACKENDS = ("pymupdf4llm", "pymupdf", "pdfplumber")
+_BACKEND_MODULES = {"pymupdf4llm": "pymupdf4llm", "pymupdf": "fitz", "pdfplumber": "pdfplumber"}
+
+CACHE_FILENAME = ".conversao_pdf_cache.json"
+OUTPUT_SUFFIX = "_convertido.md"
+
+PAGE_MARKER = "<!-- pagina: {page} -->"
+PAGE_MARKER_PATTERN = re.compile(r"^<!-- pagina: (\d+) -->$", re.MULTILINE)
+
+
+def detectar_backend() -> Optional[str]:
+    """Primeiro backend de conversão instalado, ou ``None``"""
+    for backend in BACKENDS:
+        if importlib.util.find_spec(_BACKEND_MODULES[backend]) is not None:
+            return backend
+    return None
+
+
+def contar_paginas(pdf_path: Union[str, Path], backend: str) -> int:
+    if backend == "pdfplumber":
+        import pdfplumber
+
+        with pdfplumber.open(str(pdf_path)) as pdf:
+            return len(pdf.pages)
+
+    import fitz  # PyMuPDF (também usado pelo pymupdf4llm)
+
+    with fitz.open(str(pdf_path)) as doc:
+        return doc.page_count
+
+
+def extrair_paginas(pdf_path: str, paginas: List[int], backend: str) -> List[Tuple[int, str]]:
+    """
+    Extrai o texto de um intervalo de páginas (0-based) em Markdown
+
+    Executado nos processos do pool: cada processo abre o PDF uma vez por
+    intervalo e devolve ``[(numero_da_pagina, texto), ...]`` (1-based).
+    """
+    if backend == "pymupdf4llm":
         import pymupdf4llm
-        
-        pdf_path = "docs/INT.SP_AT_INT_APLICINSUMOAGRIC.pdf"
-        output_path = "docs/INT.SP_AT_INT_APLICINSUMOAGRIC_convertido.md"
-        
-        print("🔄 Convertendo PDF para Markdown com pymupdf4llm...")
-        
-        # Conversão otimizada para LLMs
-        md_text = pymupdf4llm.to_markdown(pdf_path)
-        
-        with open(output_path, "w", encoding='utf-8') as f:
-            f.write(md_text)
-        
-        print(f"✅ Conversão concluída: {output_path}")
-        return True
-        
-    except ImportError:
-        print("❌ pymupdf4llm não instalada. Instale com: pip install pymupdf4llm")
-        return False
-    except Exception as e:
-        print(f"❌ Erro na conversão: {e}")
-        return False
-
-def converter_com_pymupdf_basico():
-    """Fallback usando PyMuPDF básico"""
-    try:
-        import fitz  # PyMuPDF
-        
-        pdf_path = "docs/INT.SP_AT_INT_APLICINSUMOAGRIC.pdf"
-        output_path = "docs/INT.SP_AT_INT_APLICINSUMOAGRIC_basico.md"
-        
-        print("🔄 Convertendo PDF para Markdown com PyMuPDF...")
-        
-        doc = fitz.open(pdf_path)
-        text = ""
-        
-        for page_num in range(len(doc)):
-            page = doc[page_num]
-            page_text = page.get_text()
-            text += f"## Página {page_num + 1}\n\n{page_text}\n\n---\n\n"
-        
-        doc.close()
-        
-        with open(output_path, 'w', encoding='utf-8') as f:
-            f.write(text)
-        
-        print(f"✅ Conversão concluída: {output_path}")
-        return True
-        
-    except ImportError:
-        print("❌ PyMuPDF não instalada. Instale com: pip install PyMuPDF")
-        return False
-    except Exception as e:
-        print(f"❌ Erro na conversão: {e}")
-        return False
-
-def converter_com_pdfplumber():
-    """Alternativa usando pdfplumber"""
+
+        partes = pymupdf4llm.to_markdown(pdf_path, pages=paginas, page_chunks=True, show_progress=False)
+        return [(pagina + 1, parte.get("text", "")) for pagina, parte in zip(paginas, partes)]
+
+    if backend == "pymupdf":
+        import fitz
+
+        with fitz.open(pdf_path) as doc:
+            return [(pagina + 1, doc[pagina].get_text()) for pagina in paginas]
+
+    import pdfplumber
+
+    with pdfplumber.open(pdf_path) as pdf:
+        return [(pagina + 1, pdf.pages[pagina].extract_text() or "") for pagina in paginas]
+
+
+def _intervalos(total: int, tamanho: int) -> List[List[int]]:
+    return [list(range(inicio, min(inicio + tamanho, total))) for inicio in range(0, total, tamanho)]
+
+
+def _formatar_pagina(numero: int, texto: str) -> str:
+    return f"{PAGE_MARKER.format(page=numero)}\n## Página {numero}\n\n{texto.strip()}\n\n---\n\n"
+
+
+class ConversionCache:
+    """Cache ``{pdf: {hash, saida, paginas, backend}}`` gravado em JSON no diretório de saída"""
+
+    def __init__(self, directory: Union[str, Path]):
+        self.path = Path(directory) / CACHE_FILENAME
+        try:
+            self.entries: Dict[str, Dict] = json.loads(self.path.read_text(encoding="utf-8"))
+        except (FileNotFoundError, json.JSONDecodeError):
+            self.entries = {}
+
+    def is_fresh(self, key: str, content_hash: str) -> bool:
+        entry = self.entries.get(key)
+        return bool(entry) and entry.get("hash") == content_hash and Path(entry.get("saida", "")).exists()
+
+    def update(self, key: str, **entry):
+        self.entries[key] = entry
+        temporary = self.path.with_suffix(".tmp")
+        temporary.write_text(json.dumps(self.entries, ensure_ascii=False, indent=2), encoding="utf-8")
+        os.replace(temporary, self.path)
+
+
+def converter_pdf(pdf_path: Union[str, Path],
+                  output_path: Union[str, Path],
+                  pool: ProcessPoolExecutor,
+                  backend: str,
+                  paginas_por_tarefa: int = 4) -> int:
+    """
+    Converte um PDF distribuindo intervalos de páginas no ``pool``
+
+    As páginas são gravadas em ordem, à medida que os intervalos ficam
+    prontos, em um arquivo temporário renomeado ao final (uma falha não
+    deixa saída parcial no lugar da anterior). Retorna o número de páginas.
+    """
+    pdf_path, output_path = Path(pdf_path), Path(output_path)
+    total = contar_paginas(pdf_path, backend)
+    temporary = output_path.with_suffix(output_path.suffix + ".tmp")
+
+    with open(temporary, "w", encoding="utf-8") as f:
+        f.write(f"# {pdf_path.stem}\n\n")
+        intervalos = _intervalos(total, max(1, paginas_por_tarefa))
+        resultados = pool.map(extrair_paginas, [str(pdf_path)] * len(intervalos), intervalos,
+                              [backend] * len(intervalos))
+        for paginas in resultados:
+            for numero, texto in paginas:
+                if texto.strip():
+                    f.write(_formatar_pagina(numero, texto))
+
+    os.replace(temporary, output_path)
+    return total
+
+
+def converter_diretorio(input_dir: Union[str, Path] = "docs",
+                        output_dir: Optional[Union[str, Path]] = None,
+                        workers: Optional[int] = None,
+                        backend: Optional[str] = None,
+                        recursive: bool = False) -> Dict[str, Dict]:
+    """
+    Converte todos os PDFs de ``input_dir`` para Markdown
+
+    PDFs cujo hash SHA-256 bate com o cache e cuja saída ainda existe são
+    pulados. Retorna ``{pdf: {status, saida, paginas}}`` com status
+    ``convertido``, ``cache`` ou ``erro``.
+    """
+    input_dir = Path(input_dir)
+    output_dir = Path(output_dir) if output_dir else input_dir
+    output_dir.mkdir(parents=True, exist_ok=True)
+
+    pdfs = sorted(input_dir.rglob("*.pdf") if recursive else input_dir.glob("*.pdf"))
+    if not pdfs:
+        return {}
+
+    backend = backend or detectar_backend()
+    if backend is None:
+        raise ImportError("Nenhuma biblioteca de PDF instalada. Instale com: pip install pymupdf4llm")
+
+    cache = ConversionCache(output_dir)
+    relatorio: Dict[str, Dict] = {}
+    pool: Optional[ProcessPoolExecutor] = None
+
     try:
-        import pdfplumber
-        
-        pdf_path = "docs/INT.SP_AT_INT_APLICINSUMOAGRIC.pdf"
-        output_path = "docs/INT.SP_AT_INT_APLICINSUMOAGRIC_pdfplumber.md"
-        
-        print("🔄 Convertendo PDF para Markdown com pdfplumber...")
-        
-        text = "# Documentação Convertida\n\n"
-        
-        with pdfplumber.open(pdf_path) as pdf:
-            for i, page in enumerate(pdf.pages):
-                page_text = page.extract_text()
-                if page_text:
-                    text += f"## Página {i + 1}\n\n{page_text}\n\n---\n\n"
-        
-        with open(output_path, 'w', encoding='utf-8') as f:
-            f.write(text)
-        
-        print(f"✅ Conversão concluída: {output_path}")
-        return True
-        
-    except ImportError:
-        print("❌ pdfplumber não instalada. Instale com: pip install pdfplumber")
-        return False
-    except Exception as e:
-        print(f"❌ Erro na conversão: {e}")
-        return False
+        for pdf_path in pdfs:
+            chave = pdf_path.relative_to(input_dir).as_posix()
+            output_path = output_dir / f"{pdf_path.stem}{OUTPUT_SUFFIX}"
+            content_hash = hash_file(pdf_path)
+
+            if cache.is_fresh(chave, content_hash):
+                relatorio[chave] = {"status": "cache", **cache.entries[chave]}
+                continue
+
+            if pool is None:
+                pool = ProcessPoolExecutor(max_workers=workers or os.cpu_count() or 1,
+                                           mp_context=get_context("spawn"))
+            try:
+                paginas = converter_pdf(pdf_path, output_path, pool, backend)
+            except Exception as e:
+                converter_logger.error(f"Erro ao converter {pdf_path}: {e}")
+                relatorio[chave] = {"status": "erro", "erro": str(e)}
+                continue
+
+            cache.update(chave, hash=content_hash, saida=str(output_path), paginas=paginas, backend=backend)
+            relatorio[chave] = {"status": "convertido", "saida": str(output_path), "paginas": paginas}
+            converter_logger.info(f"{pdf_path} → {output_path} ({paginas} páginas)")
+    finally:
+        if pool is not None:
+            pool.shutdown()
+
+    return relatorio
+
+
+def iter_paginas(markdown: str) -> Iterator[Tuple[Optional[int], str]]:
+    """Divide um Markdown convertido em ``(pagina, texto)`` pelos marcadores de página"""
+    marcadores = list(PAGE_MARKER_PATTERN.finditer(markdown))
+    if not marcadores:
+        yield None, markdown
+        return
+
+    if markdown[:marcadores[0].start()].strip():
+        yield None, markdown[:marcadores[0].start()]
+    for atual, seguinte in zip(marcadores, marcadores[1:] + [None]):
+        fim = seguinte.start() if seguinte else len(markdown)
+        yield int(atual.group(1)), markdown[atual.end():fim]
+
 
 def instalar_dependencias():
     """Instala as dependências necessárias"""
     import subprocess
-    import sys
-    
+
     bibliotecas = [
         "pymupdf4llm",  # Primeira opção
         "PyMuPDF",      # Fallback 1
         "pdfplumber"    # Fallback 2
     ]
-    
+
     print("📦 Instalando dependências...")
-    
+
     for lib in bibliotecas:
         try:
             subprocess.check_call([sys.executable, "-m", "pip", "install", lib])
@@ -122,32 +237,34 @@ def main():
     """Função principal"""
     print("🔄 CONVERSOR PDF → MARKDOWN")
     print("=" * 40)
-    
-    # Verificar se o PDF existe
-    pdf_path = Path("docs/INT.SP_AT_INT_APLICINSUMOAGRIC.pdf")
-    if not pdf_path.exists():
-        print(f"❌ PDF não encontrado: {pdf_path}")
+
+    input_dir = Path(sys.argv[1]) if len(sys.argv) > 1 else Path("docs")
+    if not input_dir.is_dir():
+        print(f"❌ Diretório não encontrado: {input_dir}")
         return
-    
-    print(f"📄 PDF encontrado: {pdf_path}")
-    print()
-    
-    # Tentar conversões em ordem de preferência
-    metodos = [
-        ("PyMuPDF4LLM (Recomendado)", converter_com_pymupdf),
-        ("PyMuPDF Básico", converter_com_pymupdf_basico),
-        ("PDFPlumber", converter_com_pdfplumber)
-    ]
-    
-    for nome, funcao in metodos:
-        print(f"🔧 Tentando: {nome}")
-        if funcao():
-            print(f"🎉 Sucesso com {nome}!")
-            break
-        print()
-    else:
-        print("❌ Nenhum método funcionou. Instale as dependências:")
+
+    backend = detectar_backend()
+    if backend is None:
+        print("❌ Nenhuma biblioteca de PDF encontrada. Instale as dependências:")
         print("pip install pymupdf4llm PyMuPDF pdfplumber")
+        return
+
+    print(f"📂 Diretório: {input_dir}")
+    print(f"🔧 Backend: {backend}")
+    print()
+
+    relatorio = converter_diretorio(input_dir, backend=backend)
+    if not relatorio:
+        print("ℹ️ Nenhum PDF encontrado")
+        return
+
+    for pdf, info in relatorio.items():
+        if info["status"] == "convertido":
+            print(f"✅ {pdf}: {info['paginas']} páginas → {info['saida']}")
+        elif info["status"] == "cache":
+            print(f"⏭️ {pdf}: sem alterações (cache)")
+        else:
+            print(f"❌ {pdf}: {info['erro']}")
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
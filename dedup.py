@@ -0,0 +1,214 @@
+"""
+Detecção de chunks quase duplicados antes da indexação
+MinHash sobre shingles de palavras com LSH por bandas (tempo aproximadamente linear)
+"""
+
+import hashlib
+import logging
+import zlib
+from collections import defaultdict
+from dataclasses import dataclass
+from typing import TYPE_CHECKING, Any, Dict, List, Sequence, Tuple
+
+import numpy as np
+
+if TYPE_CHECKING:
+    from langchain_core.documents import Document
+
+dedup_logger = logging.getLogger("dedup")
+
+# Primo maior que 2^32: (a * x + b) mod p é exato em uint64 para hashes de 32 bits
+_MERSENNE_PRIME = np.uint64(4294967311)
+
+# Metadados copiados para as referências de cada duplicata removida
+BACKREF_FIELDS = ("source", "page", "heading_path", "headings")
+
+
+@dataclass
+class DedupReport:
+    """Resultado da deduplicação: quantos chunks entraram, ficaram e em quantos grupos"""
+    total: int = 0
+    unique: int = 0
+    exact_duplicates: int = 0
+    near_duplicates: int = 0
+    clusters: int = 0
+    candidate_pairs: int = 0
+
+    @property
+    def removed(self) -> int:
+        return self.total - self.unique
+
+    @property
+    def ratio(self) -> float:
+        """Fração de chunks removidos"""
+        return self.removed / self.total if self.total else 0.0
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            'total': self.total,
+            'unique': self.unique,
+            'removed': self.removed,
+            'exact_duplicates': self.exact_duplicates,
+            'near_duplicates': self.near_duplicates,
+            'clusters': self.clusters,
+            'candidate_pairs': self.candidate_pairs,
+            'ratio': self.ratio,
+        }
+
+
+class MinHasher:
+    """
+    Assinaturas MinHash de ``num_perm`` valores sobre shingles de ``shingle_size`` palavras
+
+    Os shingles são mapeados para 32 bits (CRC32) e as permutações são
+    funções ``(a * x + b) mod p`` vetorizadas em numpy: uma assinatura custa
+    uma operação ``num_perm x shingles``.
+    """
+
+    def __init__(self, num_perm: int = 128, shingle_size: int = 3, seed: int = 1):
+        self.num_perm = num_perm
+        self.shingle_size = shingle_size
+        generator = np.random.RandomState(seed)
+        self._a = generator.randint(1, 2 ** 32 - 1, size=num_perm, dtype=np.uint64)
+        self._b = generator.randint(0, 2 ** 32 - 1, size=num_perm, dtype=np.uint64)
+
+    def shingles(self, text: str) -> np.ndarray:
+        words = text.lower().split()
+        size = self.shingle_size
+        if len(words) < size:
+            grams = {" ".join(words)}
+        else:
+            grams = {" ".join(words[i:i + size]) for i in range(len(words) - size + 1)}
+        return np.fromiter((zlib.crc32(gram.encode("utf-8")) for gram in grams), dtype=np.uint64, count=len(grams))
+
+    def signature(self, text: str) -> np.ndarray:
+        hashes = self.shingles(text)
+        permuted = (np.outer(self._a, hashes) + self._b[:, None]) % _MERSENNE_PRIME
+        return permuted.min(axis=1)
+
+
+def _bands(signature: np.ndarray, bands: int) -> List[bytes]:
+    rows = len(signature) // bands
+    return [signature[band * rows:(band + 1) * rows].tobytes() for band in range(bands)]
+
+
+def find_duplicate_clusters(texts: Sequence[str],
+                            threshold: float = 0.8,
+                            num_perm: int = 128,
+                            bands: int = 16,
+                            shingle_size: int = 3,
+                            max_representatives: int = 16) -> Tuple[Dict[int, List[int]], DedupReport]:
+    """
+    Agrupa textos idênticos ou com similaridade de Jaccard estimada ≥ ``threshold``
+
+    Textos idênticos são agrupados por hash antes do MinHash. Para os demais,
+    cada assinatura é dividida em ``bands`` faixas; textos que coincidem em
+    alguma faixa viram candidatos e só esses pares têm a similaridade
+    estimada comparada. Com 128 permutações e 16 faixas, pares com Jaccard
+    acima de ~0,7 quase sempre colidem. Em cada faixa um texto é comparado
+    com no máximo ``max_representatives`` representantes de grupos já vistos,
+    o que mantém o custo linear mesmo quando muitos textos parecidos (mas
+    abaixo do limiar) caem no mesmo bucket.
+
+    Retorna ``{canonico: [duplicatas]}`` (índices em ``texts``; o canônico é
+    a primeira ocorrência) e o relatório.
+    """
+    report = DedupReport(total=len(texts))
+    parent = list(range(len(texts)))
+
+    def find(node: int) -> int:
+        while parent[node] != node:
+            parent[node] = parent[parent[node]]
+            node = parent[node]
+        return node
+
+    def union(first: int, second: int):
+        root_first, root_second = find(first), find(second)
+        if root_first != root_second:
+            # o menor índice vira a raiz: o canônico é a primeira ocorrência
+            parent[max(root_first, root_second)] = min(root_first, root_second)
+
+    first_by_digest: Dict[bytes, int] = {}
+    distinct: List[int] = []
+    for position, text in enumerate(texts):
+        digest = hashlib.sha1(" ".join(text.split()).encode("utf-8")).digest()
+        if digest in first_by_digest:
+            union(first_by_digest[digest], position)
+            report.exact_duplicates += 1
+        else:
+            first_by_digest[digest] = position
+            distinct.append(position)
+
+    hasher = MinHasher(num_perm=num_perm, shingle_size=shingle_size)
+    signatures = {position: hasher.signature(texts[position]) for position in distinct}
+    buckets: Dict[Tuple[int, bytes], List[int]] = defaultdict(list)
+    for position in distinct:
+        for band, key in enumerate(_bands(signatures[position], bands)):
+            buckets[(band, key)].append(position)
+
+    compared = set()
+    for members in buckets.values():
+        # cada membro é comparado só com representantes recentes de grupos já vistos na faixa,
+        # para que blocos de boilerplate muito repetidos não virem comparações n²
+        representatives: List[int] = []
+        for position in members:
+            for representative in representatives[-max_representatives:]:
+                pair = (representative, position)
+                if pair in compared:
+                    continue
+                compared.add(pair)
+                similarity = float(np.mean(signatures[representative] == signatures[position]))
+                if similarity >= threshold:
+                    if find(representative) != find(position):
+                        union(representative, position)
+                        report.near_duplicates += 1
+                    break
+            else:
+                representatives.append(position)
+    report.candidate_pairs = len(compared)
+
+    clusters: Dict[int, List[int]] = defaultdict(list)
+    for position in range(len(texts)):
+        root = find(position)
+        if root != position:
+            clusters[root].append(position)
+    report.unique = len(texts) - sum(len(members) for members in clusters.values())
+    report.clusters = len(clusters)
+    return dict(clusters), report
+
+
+def deduplicate_documents(chunks: Sequence["Document"],
+                          threshold: float = 0.8,
+                          **kwargs) -> Tuple[List["Document"], DedupReport]:
+    """
+    Remove chunks quase duplicados mantendo o canônico com referências às cópias
+
+    O chunk canônico recebe ``metadata["duplicate_sources"]`` (``source``,
+    ``page`` e ``heading_path`` de cada cópia removida) e
+    ``metadata["duplicate_count"]``. A ordem dos chunks restantes é mantida.
+    """
+    from langchain_core.documents import Document
+
+    clusters, report = find_duplicate_clusters([chunk.page_content for chunk in chunks], threshold, **kwargs)
+    removed = {member for members in clusters.values() for member in members}
+
+    unique: List[Document] = []
+    for position, chunk in enumerate(chunks):
+        if position in removed:
+            continue
+        if position in clusters:
+            metadata = dict(chunk.metadata)
+            metadata["duplicate_sources"] = [
+                {key: chunks[member].metadata[key] for key in BACKREF_FIELDS if key in chunks[member].metadata}
+                for member in clusters[position]
+            ]
+            metadata["duplicate_count"] = len(clusters[position])
+            chunk = Document(page_content=chunk.page_content, metadata=metadata)
+        unique.append(chunk)
+
+    dedup_logger.info(
+        f"Deduplicação: {report.total} chunks → {report.unique} "
+        f"({report.ratio:.1%} removidos; {report.exact_duplicates} exatos, "
+        f"{report.near_duplicates} quase duplicados, {report.candidate_pairs} pares candidatos)"
+    )
+    return unique, report
@@ -0,0 +1,167 @@
+"""
+Sidecar de embeddings
+Um único processo carrega o modelo de embeddings e atende os workers da API por um socket
+Unix, de modo que N workers não carregam N cópias do MiniLM
+
+Protocolo (``multiprocessing.connection``, mensagens com tamanho prefixado): o cliente envia
+JSON ``{"op": "documents" | "query", "texts": [...]}`` e recebe ``b"\\x00"`` seguido dos
+vetores em float32 (linha a linha), ou ``b"\\x01"`` seguido da mensagem de erro. Nada é
+desserializado com pickle.
+
+Uso:
+    python embedding_sidecar.py [socket]
+    EMBEDDINGS_PROVIDER=sidecar uvicorn app:app --workers 4
+"""
+
+import json
+import logging
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from multiprocessing.connection import Client, Connection, Listener
+from typing import List, Optional
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+sidecar_logger = logging.getLogger("embedding_sidecar")
+
+DEFAULT_SOCKET_PATH = os.path.join(tempfile.gettempdir(), "mosaic-embeddings.sock")
+CONNECT_TIMEOUT = 120.0
+
+_OK = b"\x00"
+_ERROR = b"\x01"
+
+
+def socket_path() -> str:
+    return os.getenv("EMBEDDINGS_SOCKET", DEFAULT_SOCKET_PATH)
+
+
+class SidecarEmbeddings(Embeddings):
+    """
+    ``Embeddings`` que delega ao sidecar
+
+    Cada thread de cada processo abre a sua conexão (a conexão do mestre
+    não é reaproveitada pelos workers criados com fork).
+    """
+
+    def __init__(self, path: Optional[str] = None, timeout: float = CONNECT_TIMEOUT):
+        self.path = path or socket_path()
+        self.timeout = timeout
+        self._local = threading.local()
+
+    def _connection(self) -> Connection:
+        connection = getattr(self._local, "connection", None)
+        if connection is not None and self._local.pid == os.getpid():
+            return connection
+
+        deadline = time.monotonic() + self.timeout
+        while True:
+            try:
+                connection = Client(self.path, family="AF_UNIX")
+                break
+            except (FileNotFoundError, ConnectionRefusedError):
+                # o sidecar pode ainda estar carregando o modelo
+                if time.monotonic() > deadline:
+                    raise RuntimeError(f"Sidecar de embeddings indisponível em {self.path}")
+                time.sleep(0.1)
+        self._local.connection, self._local.pid = connection, os.getpid()
+        return connection
+
+    def _request(self, op: str, texts: List[str]) -> np.ndarray:
+        payload = json.dumps({'op': op, 'texts': texts}).encode("utf-8")
+        for attempt in range(2):
+            connection = self._connection()
+            try:
+                connection.send_bytes(payload)
+                reply = connection.recv_bytes()
+                break
+            except (EOFError, OSError):
+                # sidecar reiniciado: uma nova conexão e uma nova tentativa
+                self._local.connection = None
+                if attempt:
+                    raise
+        if reply[:1] == _ERROR:
+            raise RuntimeError(f"Sidecar de embeddings: {reply[1:].decode('utf-8')}")
+        vectors = np.frombuffer(reply, dtype=np.float32, offset=1)
+        return vectors.reshape(len(texts), -1) if texts else vectors.reshape(0, 0)
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return self._request("documents", list(texts)).tolist()
+
+    def embed_query(self, text: str) -> List[float]:
+        return self._request("query", [text])[0].tolist()
+
+
+def _load_backend() -> Embeddings:
+    """Modelo real, escolhido por ``EMBEDDINGS_PROVIDER`` como na API (``sidecar`` não faz sentido aqui)"""
+    if os.getenv("EMBEDDINGS_PROVIDER", "").strip().lower() == "sidecar":
+        os.environ["EMBEDDINGS_PROVIDER"] = "huggingface"
+    import main
+
+    return main.get_embeddings_model()
+
+
+def _handle(connection: Connection, embeddings: Embeddings, lock: threading.Lock):
+    with connection:
+        while True:
+            try:
+                request = json.loads(connection.recv_bytes())
+            except (EOFError, OSError):
+                return
+            try:
+                with lock:
+                    if request['op'] == "query":
+                        vectors = [embeddings.embed_query(request['texts'][0])]
+                    else:
+                        vectors = embeddings.embed_documents(request['texts'])
+                connection.send_bytes(_OK + np.asarray(vectors, dtype=np.float32).tobytes())
+            except Exception as e:
+                sidecar_logger.error(f"Erro ao gerar embeddings: {e}")
+                connection.send_bytes(_ERROR + str(e).encode("utf-8"))
+
+
+def serve(path: Optional[str] = None):
+    """Carrega o modelo e atende conexões até o processo ser encerrado (uma thread por conexão)"""
+    path = path or socket_path()
+    embeddings = _load_backend()
+    # chamadas ao modelo em série: o próprio modelo já usa as threads da CPU
+    lock = threading.Lock()
+
+    if os.path.exists(path):
+        os.unlink(path)
+    previous_umask = os.umask(0o077)
+    try:
+        listener = Listener(path, family="AF_UNIX")
+    finally:
+        os.umask(previous_umask)
+
+    sidecar_logger.info(f"Sidecar de embeddings ouvindo em {path}")
+    try:
+        while True:
+            connection = listener.accept()
+            threading.Thread(target=_handle, args=(connection, embeddings, lock), daemon=True).start()
+    finally:
+        listener.close()
+
+
+def start_sidecar(path: Optional[str] = None) -> subprocess.Popen:
+    """Sobe o sidecar em um subprocesso (o cliente espera o socket aparecer ao conectar)"""
+    path = path or socket_path()
+    env = {**os.environ, 'EMBEDDINGS_SOCKET': path}
+    return subprocess.Popen([sys.executable, os.path.abspath(__file__), path], env=env)
+
+
+def main():
+    """Função principal"""
+    logging.basicConfig(level=logging.INFO)
+    path = sys.argv[1] if len(sys.argv) > 1 else socket_path()
+    print(f"🧠 SIDECAR DE EMBEDDINGS: {path}")
+    serve(path)
+
+
+if __name__ == "__main__":
+    main()
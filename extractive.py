@@ -0,0 +1,252 @@
+"""
+Respostas extrativas
+Quando o chunk mais bem ranqueado é muito parecido com a pergunta, a resposta é o trecho dele
+(uma a três frases, linhas de tabela ou um bloco de código) mais próximo da pergunta pelos
+embeddings, com a citação da fonte e sem chamar o LLM; nos demais casos a cadeia gera a resposta
+
+Uso (perguntas de referência do benchmark):
+    python extractive.py [limiar]
+"""
+
+import logging
+import os
+import re
+import sys
+import threading
+import time
+from dataclasses import dataclass
+from functools import lru_cache
+from pathlib import Path
+from typing import Any, Dict, List, Mapping, Optional, Sequence, Tuple
+
+import numpy as np
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+
+from chunking import heading_level
+from config import EXTRACTIVE_CONFIG
+
+extractive_logger = logging.getLogger("extractive")
+
+# Desligado por padrão até o limiar ser calibrado com o modelo de embeddings real (``python extractive.py``)
+EXTRACTIVE_ENABLED = os.getenv("EXTRACTIVE_ANSWERS", "0").strip().lower() in {"1", "true"}
+
+MODE_EXTRACTIVE = "extractive"
+MODE_GENERATIVE = "generative"
+
+# Trechos com menos palavras que isso (marcadores soltos, rótulos) não viram resposta
+MIN_UNIT_WORDS = 3
+# Chunks com trechos e embeddings guardados (os chunks populares se repetem entre perguntas)
+CHUNK_CACHE_SIZE = 1024
+
+_WORD_PATTERN = re.compile(r"\w+")
+_SENTENCE_END = re.compile(r"(?<=[.!?])\s+")
+_TABLE_SEPARATOR = re.compile(r"^\|?[\s:|-]+\|?$")
+
+
+def _word_count(text: str) -> int:
+    return len(_WORD_PATTERN.findall(text))
+
+
+def split_units(text: str, heading_path: str = "") -> List[str]:
+    """
+    Divide um chunk em trechos candidatos: frases, itens de lista, linhas de
+    tabela e blocos de código inteiros
+
+    Títulos e a linha com o caminho de títulos que abre o chunk ficam de fora.
+    """
+    units: List[str] = []
+    fence: List[str] = []
+    for line in text.splitlines():
+        stripped = line.strip()
+        if stripped.startswith("```"):
+            fence.append(line)
+            if len(fence) > 1:
+                units.append("\n".join(fence))
+                fence = []
+            continue
+        if fence:
+            fence.append(line)
+            continue
+        if (not stripped or heading_level(stripped) or _TABLE_SEPARATOR.match(stripped)
+                or (heading_path and heading_path.startswith(stripped))):
+            continue
+        if stripped.startswith("|"):
+            units.append(stripped)
+            continue
+        units.extend(sentence for sentence in _SENTENCE_END.split(stripped) if sentence)
+    if fence:
+        units.append("\n".join(fence))
+    return [unit for unit in units if _word_count(unit) >= MIN_UNIT_WORDS]
+
+
+def format_citation(document: Document) -> str:
+    """``Fonte: arquivo.md › seção (p. 3)``"""
+    metadata = document.metadata or {}
+    source = metadata.get("source") or metadata.get("file_path") or "documento"
+    citation = f"Fonte: {Path(str(source)).name}"
+    if metadata.get("section"):
+        citation += f" › {metadata['section']}"
+    page = metadata.get("page") or metadata.get("page_number")
+    if page is not None:
+        citation += f" (p. {page})"
+    return citation
+
+
+def _normalize(vectors: Any) -> np.ndarray:
+    matrix = np.atleast_2d(np.asarray(vectors, dtype=np.float32))
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    return matrix / np.where(norms == 0, 1.0, norms)
+
+
+@dataclass
+class ExtractiveAnswer:
+    text: str
+    units: List[str]
+    score: float
+    sentence_score: float
+    document: Document
+
+
+class ExtractiveAnswerer:
+    """
+    Escolhe os trechos do primeiro chunk recuperado que respondem à pergunta
+
+    ``score`` é o cosseno entre a pergunta e o chunk inteiro, calculado de novo
+    pelo mesmo modelo (o vetor do FAISS não é lido: no formato compacto ele
+    está quantizado); abaixo de ``min_score``, ou quando nenhum trecho passa
+    de ``min_sentence_score``, ou quando o melhor trecho sozinho passa de
+    ``max_words``, ``answer`` devolve ``None`` e a resposta fica com o LLM.
+    O vetor do chunk e os dos trechos ficam em cache por chunk; com os
+    embeddings do índice (``TracedEmbeddings``) o vetor da pergunta é o
+    mesmo já calculado pela busca densa.
+    """
+
+    def __init__(self, embeddings: Embeddings, config: Mapping[str, Any] = EXTRACTIVE_CONFIG):
+        self.embeddings = embeddings
+        self.min_score = float(os.getenv("EXTRACTIVE_MIN_SCORE", config["min_score"]))
+        self.min_sentence_score = float(config["min_sentence_score"])
+        self.sentence_margin = float(config["sentence_margin"])
+        self.max_sentences = int(config["max_sentences"])
+        self.max_words = int(config["max_words"])
+        self._encode_chunk = lru_cache(maxsize=CHUNK_CACHE_SIZE)(self._encode_chunk_uncached)
+        self._lock = threading.Lock()
+        self.counts = {MODE_EXTRACTIVE: 0, MODE_GENERATIVE: 0}
+
+    def _encode_chunk_uncached(self, text: str, heading_path: str) -> Tuple[np.ndarray, List[str], np.ndarray]:
+        units = split_units(text, heading_path)
+        vectors = _normalize(self.embeddings.embed_documents([text, *units]))
+        return vectors[0], units, vectors[1:]
+
+    def answer(self, question: str, documents: Sequence[Document]) -> Optional[ExtractiveAnswer]:
+        extracted = self._extract(question, documents) if documents else None
+        with self._lock:
+            self.counts[MODE_EXTRACTIVE if extracted is not None else MODE_GENERATIVE] += 1
+        return extracted
+
+    def _extract(self, question: str, documents: Sequence[Document]) -> Optional[ExtractiveAnswer]:
+        document = documents[0]
+        chunk_vector, units, unit_vectors = self._encode_chunk(
+            document.page_content, str((document.metadata or {}).get("heading_path", ""))
+        )
+        question_vector = _normalize(self.embeddings.embed_query(question))[0]
+        score = float(chunk_vector @ question_vector)
+        if score < self.min_score or not units:
+            return None
+
+        scores = unit_vectors @ question_vector
+        order = np.argsort(scores)[::-1]
+        best_score = float(scores[order[0]])
+        if best_score < self.min_sentence_score or _word_count(units[order[0]]) > self.max_words:
+            return None
+
+        chosen, words = [], 0
+        for position in order[:self.max_sentences]:
+            count = _word_count(units[position])
+            if scores[position] < best_score - self.sentence_margin or words + count > self.max_words:
+                break
+            chosen.append(int(position))
+            words += count
+
+        selected = [units[position] for position in sorted(chosen)]
+        # Frases corridas ficam em um parágrafo; linhas de tabela, listas e código, uma por linha
+        prose = all("\n" not in unit and unit[:1] not in "|-*" for unit in selected)
+        body = (" " if prose else "\n").join(selected)
+        return ExtractiveAnswer(
+            text=f"{body}\n\n{format_citation(document)}",
+            units=selected,
+            score=score,
+            sentence_score=best_score,
+            document=document,
+        )
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            extractive, generative = self.counts[MODE_EXTRACTIVE], self.counts[MODE_GENERATIVE]
+        total = extractive + generative
+        return {
+            'extractive': extractive,
+            'generative': generative,
+            'extractive_rate': (extractive / total * 100) if total else 0.0,
+            'min_score': self.min_score,
+        }
+
+
+def benchmark_extractive(min_score: Optional[float] = None,
+                         golden_set_path: str = "fixtures/golden_set.json") -> Dict[str, Any]:
+    """
+    Passa as perguntas de referência pela recuperação e pelo modo extrativo
+
+    Mede a fração respondida sem LLM, quantas dessas respostas contêm os
+    trechos esperados e o tempo da extração (com e sem cache dos chunks).
+    """
+    import main
+    from rag_benchmark import load_golden_set
+
+    questions = load_golden_set(golden_set_path)
+    retriever = main.create_ensemble_retriever(main.get_retrieval_index())
+    answerer = ExtractiveAnswerer(main.get_retrieval_index().vectorstore.embedding_function)
+    if min_score is not None:
+        answerer.min_score = min_score
+
+    print("✂️ RESPOSTAS EXTRATIVAS")
+    print("=" * 40)
+    print(f"Limiar: {answerer.min_score:.2f} | máximo {answerer.max_words} palavras")
+    report: Dict[str, Any] = {'questions': []}
+    timings = {'cold': [], 'warm': []}
+    for question in questions:
+        documents = retriever.invoke(question.question)
+        for phase in ("cold", "warm"):
+            start = time.perf_counter()
+            extracted = answerer._extract(question.question, documents)
+            timings[phase].append(time.perf_counter() - start)
+        answerer.answer(question.question, documents)
+        correct = extracted is not None and all(snippet in extracted.text for snippet in question.expected)
+        report['questions'].append({
+            'id': question.id,
+            'mode': MODE_EXTRACTIVE if extracted is not None else MODE_GENERATIVE,
+            'correct': correct,
+            'score': extracted.score if extracted is not None else None,
+        })
+        marker = ("✅" if correct else "⚠️") if extracted is not None else "➡️"
+        print(f"   {marker} {question.id:24} {'extrativa' if extracted is not None else 'LLM'}")
+
+    extracted_rows = [row for row in report['questions'] if row['mode'] == MODE_EXTRACTIVE]
+    report.update(answerer.stats())
+    report['extractive_correct'] = sum(row['correct'] for row in extracted_rows)
+    report['cold_ms'] = float(np.mean(timings['cold']) * 1000)
+    report['warm_ms'] = float(np.mean(timings['warm']) * 1000)
+    print(f"\nSem LLM: {report['extractive']}/{len(questions)} ({report['extractive_rate']:.0f}%), "
+          f"{report['extractive_correct']} com os trechos esperados")
+    print(f"Extração: {report['cold_ms']:.1f} ms (primeira vez) | {report['warm_ms']:.1f} ms (chunk em cache)")
+    return report
+
+
+def main():
+    """Função principal"""
+    min_score = float(sys.argv[1]) if len(sys.argv) > 1 else None
+    benchmark_extractive(min_score)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,399 @@
+"""
+Extração de texto de páginas HTML do wiki
+Backends plugáveis (selectolax, lxml, BeautifulSoup) com o mesmo resultado:
+texto do contêiner ``wiki-content`` em Markdown simples (títulos, blocos de
+código, tabelas e listas preservados para o chunker) e os links internos
+"""
+
+import importlib.util
+import logging
+import os
+import re
+import time
+from functools import lru_cache
+from pathlib import Path
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple, Union
+from urllib.parse import urldefrag, urljoin
+
+extraction_logger = logging.getLogger("html_extraction")
+
+# Ordem de preferência quando HTML_PARSER=auto
+BACKENDS = ("selectolax", "lxml", "bs4")
+_BACKEND_MODULES = {"selectolax": "selectolax", "lxml": "lxml", "bs4": "bs4"}
+
+# Contêineres procurados, do mais específico ao mais genérico: (tag, atributo, valor)
+CONTAINERS = (("div", "id", "wiki-content"), ("div", "class", "wiki"), ("article", None, None), ("body", None, None))
+WIKI_CONTENT_ID = "wiki-content"
+
+SKIPPED_TAGS = frozenset({"script", "style", "nav", "header", "footer", "noscript", "template", "svg", "button"})
+BLOCK_TAGS = frozenset({"p", "div", "section", "blockquote", "ul", "ol", "dl", "dd", "dt", "figure", "main", "article"})
+HEADING_LEVELS = {"h1": 1, "h2": 2, "h3": 3, "h4": 4, "h5": 5, "h6": 6}
+SKIPPED_LINK_EXTENSIONS = (".pdf", ".png", ".jpg", ".jpeg", ".svg")
+
+_BLANK_LINES = re.compile(r"\n[ \t]*(?:\n[ \t]*)+")
+_INLINE_SPACES = re.compile(r"[ \t\r\f\v]+")
+
+
+def filter_wiki_links(hrefs: Iterable[str], page_url: str, base_url: str) -> List[str]:
+    """Normaliza links (absolutos, sem fragmento) e mantém só páginas internas do wiki"""
+    links: List[str] = []
+    for href in hrefs:
+        href = (href or "").strip()
+        if not href or href.startswith("#"):
+            continue
+
+        absolute_url = urldefrag(urljoin(page_url, href))[0].rstrip("/")
+        if not absolute_url.startswith(base_url):
+            continue
+        if absolute_url.endswith(SKIPPED_LINK_EXTENSIONS):
+            continue
+        links.append(absolute_url)
+    return links
+
+
+def _clean_inline(text: str) -> str:
+    return _INLINE_SPACES.sub(" ", text.replace("\n", " "))
+
+
+def _finish(parts: List[str]) -> str:
+    text = "".join(parts)
+    lines = [line.rstrip() for line in text.split("\n")]
+    return _BLANK_LINES.sub("\n\n", "\n".join(lines)).strip()
+
+
+class HtmlExtractor:
+    """
+    Interface dos backends
+
+    Cada backend implementa o parse, a busca do contêiner e a navegação nos
+    nós (``_tag``, ``_children``, ``_text``, ``_rows``, ``_attribute``); a
+    renderação em Markdown e a coleta de links são compartilhadas, então
+    todos produzem a mesma estrutura e os mesmos links.
+    """
+
+    name = "base"
+
+    def extract(self, html: str, page_url: str, base_url: str) -> Tuple[str, List[str]]:
+        """Retorna ``(texto, links_internos)`` da página"""
+        container = self._container(html)
+        if container is None:
+            return "", []
+        parts: List[str] = []
+        self._render(container, parts)
+        return _finish(parts), filter_wiki_links(self._hrefs(container), page_url, base_url)
+
+    # --- navegação (por backend) ---
+
+    def _container(self, html: str) -> Any:
+        raise NotImplementedError
+
+    def _tag(self, node: Any) -> str:
+        raise NotImplementedError
+
+    def _children(self, node: Any) -> Iterator[Any]:
+        """Filhos em ordem: ``str`` para texto, nó para elementos (comentários omitidos)"""
+        raise NotImplementedError
+
+    def _text(self, node: Any) -> str:
+        raise NotImplementedError
+
+    def _rows(self, table: Any) -> Iterator[List[str]]:
+        raise NotImplementedError
+
+    def _attribute(self, node: Any, name: str) -> Optional[str]:
+        raise NotImplementedError
+
+    # --- links (compartilhado) ---
+
+    def _hrefs(self, node: Any) -> Iterator[str]:
+        """``href`` dos links, fora de ``SKIPPED_TAGS`` (menus, cabeçalho e rodapé), como em ``_render``"""
+        tag = self._tag(node)
+        if tag in SKIPPED_TAGS:
+            return
+        if tag == "a":
+            href = self._attribute(node, "href")
+            if href:
+                yield href
+        for child in self._children(node):
+            if not isinstance(child, str):
+                yield from self._hrefs(child)
+
+    # --- renderação em Markdown (compartilhada) ---
+
+    def _render(self, node: Any, parts: List[str]):
+        tag = self._tag(node)
+        if tag in SKIPPED_TAGS:
+            return
+
+        if tag in HEADING_LEVELS:
+            title = _clean_inline(self._text(node)).strip()
+            if title:
+                parts.append(f"\n\n{'#' * HEADING_LEVELS[tag]} {title}\n\n")
+            return
+        if tag == "pre":
+            code = self._text(node).strip("\n")
+            parts.append(f"\n\n```\n{code}\n```\n\n")
+            return
+        if tag == "table":
+            self._render_table(node, parts)
+            return
+        if tag == "code":
+            parts.append(f"`{_clean_inline(self._text(node)).strip()}`")
+            return
+        if tag == "br":
+            parts.append("\n")
+            return
+        if tag == "hr":
+            parts.append("\n\n---\n\n")
+            return
+
+        if tag == "li":
+            parts.append("\n- ")
+        elif tag in BLOCK_TAGS:
+            parts.append("\n\n")
+
+        for child in self._children(node):
+            if isinstance(child, str):
+                parts.append(_clean_inline(child))
+            else:
+                self._render(child, parts)
+
+        if tag in BLOCK_TAGS:
+            parts.append("\n\n")
+
+    def _render_table(self, table: Any, parts: List[str]):
+        rows = [[_clean_inline(cell).strip().replace("|", "\\|") for cell in row] for row in self._rows(table)]
+        rows = [row for row in rows if row]
+        if not rows:
+            return
+        lines = [f"| {' | '.join(rows[0])} |", f"|{'|'.join('---' for _ in rows[0])}|"]
+        lines.extend(f"| {' | '.join(row)} |" for row in rows[1:])
+        parts.append("\n\n" + "\n".join(lines) + "\n\n")
+
+
+class SelectolaxExtractor(HtmlExtractor):
+    """Parser Lexbor/Modest em C via selectolax (o mais rápido)"""
+
+    name = "selectolax"
+
+    def __init__(self):
+        try:
+            from selectolax.lexbor import LexborHTMLParser as Parser
+        except ImportError:
+            from selectolax.parser import HTMLParser as Parser
+        self._parser = Parser
+
+    def _container(self, html: str) -> Any:
+        tree = self._parser(html)
+        for tag, attribute, value in CONTAINERS:
+            if attribute == "id":
+                selector = f"{tag}#{value}"
+            elif attribute == "class":
+                selector = f"{tag}.{value}"
+            else:
+                selector = tag
+            node = tree.css_first(selector)
+            if node is not None:
+                return node
+        return tree.root
+
+    def _tag(self, node: Any) -> str:
+        return node.tag
+
+    def _children(self, node: Any) -> Iterator[Any]:
+        for child in node.iter(include_text=True):
+            if child.tag == "-text":
+                yield child.text(deep=False)
+            elif not child.tag.startswith(("-", "_", "!")):
+                yield child
+
+    def _text(self, node: Any) -> str:
+        return node.text(deep=True, separator="")
+
+    def _rows(self, table: Any) -> Iterator[List[str]]:
+        for row in table.css("tr"):
+            yield [cell.text(deep=True, separator=" ") for cell in row.iter() if cell.tag in ("th", "td")]
+
+    def _attribute(self, node: Any, name: str) -> Optional[str]:
+        return node.attributes.get(name)
+
+
+class LxmlExtractor(HtmlExtractor):
+    """Parser libxml2 via ``lxml.html``"""
+
+    name = "lxml"
+
+    def __init__(self):
+        import lxml.html
+
+        self._html = lxml.html
+
+    def _container(self, html: str) -> Any:
+        document = self._html.document_fromstring(html)
+        for tag, attribute, value in CONTAINERS:
+            if attribute == "id":
+                found = document.xpath(f'//{tag}[@id="{value}"]')
+            elif attribute == "class":
+                found = document.xpath(f'//{tag}[contains(concat(" ", normalize-space(@class), " "), " {value} ")]')
+            else:
+                found = document.xpath(f"//{tag}")
+            if found:
+                return found[0]
+        return document
+
+    def _tag(self, node: Any) -> str:
+        return node.tag if isinstance(node.tag, str) else ""
+
+    def _children(self, node: Any) -> Iterator[Any]:
+        if node.text:
+            yield node.text
+        for child in node:
+            if isinstance(child.tag, str):
+                yield child
+            if child.tail:
+                yield child.tail
+
+    def _text(self, node: Any) -> str:
+        return node.text_content()
+
+    def _rows(self, table: Any) -> Iterator[List[str]]:
+        for row in table.iter("tr"):
+            yield [cell.text_content() for cell in row if cell.tag in ("th", "td")]
+
+    def _attribute(self, node: Any, name: str) -> Optional[str]:
+        return node.get(name)
+
+
+class BeautifulSoupExtractor(HtmlExtractor):
+    """
+    BeautifulSoup (fallback; ``lxml`` como parser quando instalado)
+
+    Quando a página tem ``id="wiki-content"`` só esse contêiner é montado na
+    árvore (``SoupStrainer``), em vez da página inteira.
+    """
+
+    name = "bs4"
+
+    def __init__(self):
+        from bs4 import BeautifulSoup, Comment, NavigableString, SoupStrainer
+
+        self._soup = BeautifulSoup
+        self._strainer = SoupStrainer
+        self._comment = Comment
+        self._string = NavigableString
+        self._features = "lxml" if importlib.util.find_spec("lxml") else "html.parser"
+
+    def _container(self, html: str) -> Any:
+        if WIKI_CONTENT_ID in html:
+            soup = self._soup(html, self._features, parse_only=self._strainer(id=WIKI_CONTENT_ID))
+            container = soup.find(id=WIKI_CONTENT_ID)
+            if container is not None:
+                return container
+
+        soup = self._soup(html, self._features)
+        for tag, attribute, value in CONTAINERS:
+            container = soup.find(tag, **({attribute if attribute != "class" else "class_": value} if attribute else {}))
+            if container is not None:
+                return container
+        return soup
+
+    def _tag(self, node: Any) -> str:
+        return node.name or ""
+
+    def _children(self, node: Any) -> Iterator[Any]:
+        for child in node.children:
+            if isinstance(child, self._comment):
+                continue
+            if isinstance(child, self._string):
+                yield str(child)
+            else:
+                yield child
+
+    def _text(self, node: Any) -> str:
+        return node.get_text()
+
+    def _rows(self, table: Any) -> Iterator[List[str]]:
+        for row in table.find_all("tr"):
+            yield [cell.get_text(" ") for cell in row.find_all(["th", "td"], recursive=False)]
+
+    def _attribute(self, node: Any, name: str) -> Optional[str]:
+        return node.get(name)
+
+
+_EXTRACTORS = {
+    "selectolax": SelectolaxExtractor,
+    "lxml": LxmlExtractor,
+    "bs4": BeautifulSoupExtractor,
+}
+
+
+def available_backends() -> List[str]:
+    return [name for name in BACKENDS if importlib.util.find_spec(_BACKEND_MODULES[name]) is not None]
+
+
+@lru_cache(maxsize=None)
+def get_extractor(backend: Optional[str] = None) -> HtmlExtractor:
+    """
+    Extrator pelo nome ou por ``HTML_PARSER`` (``auto``, ``selectolax``, ``lxml``, ``bs4``)
+
+    No modo ``auto`` usa o primeiro backend instalado na ordem de ``BACKENDS``.
+    """
+    backend = (backend or os.getenv("HTML_PARSER", "auto")).lower()
+    if backend == "auto":
+        installed = available_backends()
+        if not installed:
+            raise ImportError("Nenhum parser HTML instalado. Instale com: pip install selectolax")
+        backend = installed[0]
+    if backend not in _EXTRACTORS:
+        raise ValueError(f"Parser HTML desconhecido: {backend}")
+    extraction_logger.info(f"Extração de HTML com {backend}")
+    return _EXTRACTORS[backend]()
+
+
+def benchmark_extractors(fixtures_dir: Union[str, Path] = "fixtures/wiki",
+                         repeat: int = 20,
+                         base_url: str = "https://gitlab.com/arii19-group/Arii19-project/-/wikis") -> Dict[str, Dict[str, float]]:
+    """
+    Mede páginas/s e MB/s de cada backend instalado sobre páginas HTML salvas
+
+    Inclui como referência ``bs4-html.parser-completo``, o caminho anterior
+    (página inteira no ``html.parser`` e ``get_text``).
+    """
+    pages = [(path.read_text(encoding="utf-8"), f"{base_url}/{path.stem}")
+             for path in sorted(Path(fixtures_dir).glob("*.html"))]
+    if not pages:
+        raise FileNotFoundError(f"Nenhuma página .html em {fixtures_dir}")
+    total_bytes = sum(len(html.encode("utf-8")) for html, _ in pages)
+
+    def legacy(html: str, page_url: str, base_url: str) -> Tuple[str, List[str]]:
+        from bs4 import BeautifulSoup
+
+        soup = BeautifulSoup(html, "html.parser")
+        for tag in soup(["script", "style", "nav", "header", "footer"]):
+            tag.decompose()
+        container = soup.find("div", id=WIKI_CONTENT_ID) or soup.body or soup
+        hrefs = [link["href"] for link in container.find_all("a", href=True)]
+        return container.get_text(separator="\n").strip(), filter_wiki_links(hrefs, page_url, base_url)
+
+    candidates = {"bs4-html.parser-completo": legacy}
+    for name in available_backends():
+        candidates[name] = _EXTRACTORS[name]().extract
+
+    report: Dict[str, Dict[str, float]] = {}
+    for name, extract in candidates.items():
+        start = time.perf_counter()
+        for _ in range(repeat):
+            for html, page_url in pages:
+                extract(html, page_url, base_url)
+        elapsed = time.perf_counter() - start
+        report[name] = {
+            'pages_per_second': len(pages) * repeat / elapsed,
+            'mb_per_second': total_bytes * repeat / elapsed / 1_000_000,
+        }
+        print(f"⚡ {name}: {report[name]['pages_per_second']:.0f} páginas/s "
+              f"({report[name]['mb_per_second']:.1f} MB/s)")
+    return report
+
+
+if __name__ == "__main__":
+    benchmark_extractors()
@@ -0,0 +1,225 @@
+"""
+Executor híbrido para o pipeline em lote
+Etapas de CPU (parsing de HTML, divisão em chunks, embeddings, BM25) em um pool de
+processos e etapas de I/O (HTTP, LLM, disco) em threads
+"""
+
+import logging
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from multiprocessing import get_context, shared_memory
+from typing import Any, Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+executor_logger = logging.getLogger("batch_processor.executor")
+
+DEFAULT_EMBEDDING_MODEL = "sentence-transformers/all-MiniLM-L6-v2"
+
+# Estado de cada processo do pool, preenchido pelo initializer
+_WORKER_STATE: Dict[str, Any] = {}
+
+
+def _init_cpu_worker(embedding_model_name: Optional[str], bm25_corpus: Optional[List[str]]):
+    """Carrega o modelo de embeddings (e o BM25) uma única vez por processo"""
+    try:
+        import torch
+
+        # um processo por núcleo: evitar que cada um abra N threads de BLAS
+        torch.set_num_threads(1)
+    except ImportError:
+        pass
+
+    if embedding_model_name:
+        from sentence_transformers import SentenceTransformer
+
+        _WORKER_STATE['model'] = SentenceTransformer(embedding_model_name)
+    if bm25_corpus is not None:
+        from langchain_community.retrievers.bm25 import default_preprocessing_func
+        from rank_bm25 import BM25Okapi
+
+        _WORKER_STATE['bm25'] = BM25Okapi([default_preprocessing_func(text) for text in bm25_corpus])
+        _WORKER_STATE['bm25_preprocess'] = default_preprocessing_func
+
+
+def _worker_embedding_dimension() -> int:
+    return int(_WORKER_STATE['model'].get_sentence_embedding_dimension())
+
+
+def _embed_into_shared(name: str, shape: Tuple[int, int], start: int,
+                       texts: List[str], batch_size: int) -> int:
+    """Gera embeddings e grava as linhas ``start:start+len(texts)`` direto na memória compartilhada"""
+    # com spawn os workers usam o resource_tracker do pai, que continua dono do segmento
+    shm = shared_memory.SharedMemory(name=name)
+    try:
+        output = np.ndarray(shape, dtype=np.float32, buffer=shm.buf)
+        vectors = _WORKER_STATE['model'].encode(texts, batch_size=batch_size, convert_to_numpy=True)
+        output[start:start + len(texts)] = vectors
+        del output
+    finally:
+        shm.close()
+    return len(texts)
+
+
+def _bm25_top_k(queries: List[str], k: int) -> List[List[Tuple[int, float]]]:
+    bm25 = _WORKER_STATE['bm25']
+    preprocess = _WORKER_STATE['bm25_preprocess']
+    results = []
+    for query in queries:
+        scores = bm25.get_scores(preprocess(query))
+        top = np.argsort(scores)[::-1][:k]
+        results.append([(int(row), float(scores[row])) for row in top])
+    return results
+
+
+def _split_documents(documents: list) -> list:
+    import main
+
+    return main.split_documents(documents)
+
+
+def _parse_html(page: Tuple[str, str]) -> Tuple[str, List[str]]:
+    import main
+
+    html, url = page
+    return main.extract_wiki_page(html, url)
+
+
+def _partitions(total: int, parts: int) -> List[Tuple[int, int]]:
+    """Divide ``range(total)`` em até ``parts`` faixas contíguas de tamanho parecido"""
+    parts = max(1, min(parts, total))
+    size, remainder = divmod(total, parts)
+    bounds, start = [], 0
+    for index in range(parts):
+        end = start + size + (1 if index < remainder else 0)
+        bounds.append((start, end))
+        start = end
+    return [bound for bound in bounds if bound[0] < bound[1]]
+
+
+class HybridExecutor:
+    """
+    Pool de processos para CPU + pool de threads para I/O
+
+    Os processos são criados com ``spawn`` (seguro com threads e com o torch)
+    e cada um carrega o modelo de embeddings uma vez no initializer. Os
+    embeddings são devolvidos por memória compartilhada: cada worker escreve
+    sua faixa de linhas em um único array ``n x d`` alocado pelo processo pai,
+    sem serializar os vetores pelo pipe.
+
+    Use como context manager para encerrar os pools ao final.
+    """
+
+    def __init__(self,
+                 cpu_workers: Optional[int] = None,
+                 io_workers: int = 16,
+                 embedding_model_name: Optional[str] = DEFAULT_EMBEDDING_MODEL,
+                 bm25_corpus: Optional[Sequence[str]] = None):
+        self.cpu_workers = cpu_workers or os.cpu_count() or 1
+        self.io_workers = io_workers
+        self.embedding_model_name = embedding_model_name
+        self._cpu_pool = ProcessPoolExecutor(
+            max_workers=self.cpu_workers,
+            mp_context=get_context("spawn"),
+            initializer=_init_cpu_worker,
+            initargs=(embedding_model_name, list(bm25_corpus) if bm25_corpus is not None else None),
+        )
+        self._io_pool = ThreadPoolExecutor(max_workers=io_workers, thread_name_prefix="hybrid-io")
+        self._dimension: Optional[int] = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.shutdown()
+
+    def shutdown(self):
+        self._cpu_pool.shutdown(wait=True, cancel_futures=True)
+        self._io_pool.shutdown(wait=True, cancel_futures=True)
+
+    def submit_cpu(self, fn: Callable, *args, **kwargs):
+        """Etapa de CPU; ``fn`` e argumentos precisam ser serializáveis (funções de módulo)"""
+        return self._cpu_pool.submit(fn, *args, **kwargs)
+
+    def submit_io(self, fn: Callable, *args, **kwargs):
+        """Etapa de I/O (rede, LLM, disco) em thread"""
+        return self._io_pool.submit(fn, *args, **kwargs)
+
+    def map_cpu(self, fn: Callable, items: Iterable[Any], chunksize: int = 1) -> Iterable[Any]:
+        return self._cpu_pool.map(fn, items, chunksize=chunksize)
+
+    def map_io(self, fn: Callable, items: Iterable[Any]) -> Iterable[Any]:
+        return self._io_pool.map(fn, items)
+
+    @property
+    def embedding_dimension(self) -> int:
+        if self._dimension is None:
+            self._dimension = self._cpu_pool.submit(_worker_embedding_dimension).result()
+        return self._dimension
+
+    def embed_texts(self, texts: Sequence[str], batch_size: int = 64) -> np.ndarray:
+        """Embeddings de ``texts`` distribuídos entre os processos; retorna matriz ``float32``"""
+        texts = list(texts)
+        if not texts:
+            return np.zeros((0, self.embedding_dimension), dtype=np.float32)
+
+        shape = (len(texts), self.embedding_dimension)
+        shm = shared_memory.SharedMemory(create=True, size=int(np.prod(shape)) * 4)
+        try:
+            # mais faixas que processos para equilibrar textos de tamanhos diferentes
+            ranges = _partitions(len(texts), self.cpu_workers * 4)
+            futures = [
+                self._cpu_pool.submit(_embed_into_shared, shm.name, shape, start, texts[start:end], batch_size)
+                for start, end in ranges
+            ]
+            for future in futures:
+                future.result()
+            return np.array(np.ndarray(shape, dtype=np.float32, buffer=shm.buf))
+        finally:
+            shm.close()
+            shm.unlink()
+
+    def bm25_top_k(self, queries: Sequence[str], k: int = 5) -> List[List[Tuple[int, float]]]:
+        """Top-k do BM25 por pergunta (requer ``bm25_corpus`` no construtor)"""
+        queries = list(queries)
+        futures = [
+            self._cpu_pool.submit(_bm25_top_k, queries[start:end], k)
+            for start, end in _partitions(len(queries), self.cpu_workers)
+        ]
+        results: List[List[Tuple[int, float]]] = []
+        for future in futures:
+            results.extend(future.result())
+        return results
+
+    def split_documents(self, documents: Sequence[Any]) -> list:
+        """Divide documentos em chunks em paralelo (``main.split_documents``), preservando a ordem"""
+        documents = list(documents)
+        futures = [
+            self._cpu_pool.submit(_split_documents, documents[start:end])
+            for start, end in _partitions(len(documents), self.cpu_workers * 2)
+        ]
+        chunks = []
+        for future in futures:
+            chunks.extend(future.result())
+        return chunks
+
+    def parse_html(self, pages: Sequence[Tuple[str, str]]) -> List[Tuple[str, List[str]]]:
+        """Extrai ``(texto, links)`` de páginas ``(html, url)`` em paralelo"""
+        return list(self._cpu_pool.map(_parse_html, pages, chunksize=4))
+
+
+def benchmark_embedding_scaling(texts: Sequence[str],
+                                worker_counts: Sequence[int] = (1, 2, 4, 8, 16),
+                                embedding_model_name: str = DEFAULT_EMBEDDING_MODEL) -> List[Dict[str, float]]:
+    """Mede chunks/s de ``embed_texts`` para diferentes números de processos"""
+    report = []
+    for workers in worker_counts:
+        with HybridExecutor(cpu_workers=workers, embedding_model_name=embedding_model_name) as executor:
+            _ = executor.embedding_dimension  # aquece os processos (carga do modelo fora da medição)
+            start = time.perf_counter()
+            executor.embed_texts(texts)
+            elapsed = time.perf_counter() - start
+        report.append({'workers': workers, 'seconds': elapsed, 'chunks_per_second': len(texts) / elapsed})
+        executor_logger.info(f"{workers} processos: {len(texts) / elapsed:.1f} chunks/s")
+    return report
@@ -0,0 +1,197 @@
+"""
+Manifesto de jobs de processamento em lote
+Registra status e hash de conteúdo de cada item para checkpoint, retomada e reprocessamento incremental
+"""
+
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import Any, Dict, Iterator, Optional, Union
+
+STATUS_PENDING = "pending"
+STATUS_DONE = "done"
+STATUS_FAILED = "failed"
+
+DEFAULT_JOBS_DIR = "batch_jobs"
+
+
+def hash_text(content: str) -> str:
+    return hashlib.sha256(content.encode("utf-8")).hexdigest()
+
+
+def hash_file(path: Union[str, Path], block_size: int = 1024 * 1024) -> str:
+    """Hash SHA-256 do arquivo, lido em blocos"""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(block_size), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+class JobManifest:
+    """
+    Estado persistente de um job (SQLite em ``<jobs_dir>/<job_id>/manifest.sqlite``)
+
+    Cada item guarda status, hash do conteúdo e de onde reler o conteúdo
+    (arquivo de origem ou o próprio texto). Atualizações de status ficam em
+    memória e são gravadas em uma única transação a cada ``checkpoint_every``
+    itens ou ``checkpoint_interval`` segundos; uma queda perde no máximo esse
+    intervalo, e esses itens apenas voltam como pendentes.
+    """
+
+    def __init__(self,
+                 job_id: str,
+                 jobs_dir: Union[str, Path] = DEFAULT_JOBS_DIR,
+                 checkpoint_every: int = 50,
+                 checkpoint_interval: float = 5.0):
+        self.job_id = job_id
+        self.directory = Path(jobs_dir) / job_id
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.path = self.directory / "manifest.sqlite"
+        self.results_path = self.directory / "results.jsonl"
+        self.checkpoint_every = max(1, checkpoint_every)
+        self.checkpoint_interval = checkpoint_interval
+
+        self._lock = threading.Lock()
+        self._pending_updates: Dict[str, tuple] = {}
+        self._last_checkpoint = time.monotonic()
+
+        self._conn = sqlite3.connect(str(self.path), timeout=30, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript(
+            "CREATE TABLE IF NOT EXISTS job_info (key TEXT PRIMARY KEY, value TEXT NOT NULL);"
+            "CREATE TABLE IF NOT EXISTS items ("
+            " item_id TEXT PRIMARY KEY,"
+            " status TEXT NOT NULL,"
+            " content_hash TEXT NOT NULL,"
+            " source TEXT,"
+            " content TEXT,"
+            " metadata TEXT,"
+            " size INTEGER,"
+            " mtime REAL,"
+            " attempts INTEGER NOT NULL DEFAULT 0,"
+            " error TEXT,"
+            " updated_at REAL NOT NULL);"
+            "CREATE INDEX IF NOT EXISTS idx_items_status ON items (status);"
+        )
+        self._conn.commit()
+
+    @classmethod
+    def exists(cls, job_id: str, jobs_dir: Union[str, Path] = DEFAULT_JOBS_DIR) -> bool:
+        return (Path(jobs_dir) / job_id / "manifest.sqlite").exists()
+
+    def set_info(self, **info: Any):
+        """Grava parâmetros do job (tipo, diretório, padrão de arquivos...) para a retomada"""
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO job_info (key, value) VALUES (?, ?)",
+                [(key, json.dumps(value)) for key, value in info.items()],
+            )
+            self._conn.commit()
+
+    def get_info(self) -> Dict[str, Any]:
+        with self._lock:
+            rows = self._conn.execute("SELECT key, value FROM job_info").fetchall()
+        return {key: json.loads(value) for key, value in rows}
+
+    def get(self, item_id: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            cursor = self._conn.execute("SELECT * FROM items WHERE item_id = ?", (item_id,))
+            row = cursor.fetchone()
+            columns = [col[0] for col in cursor.description]
+        return dict(zip(columns, row)) if row else None
+
+    def register(self,
+                 item_id: str,
+                 content_hash: str,
+                 source: Optional[str] = None,
+                 content: Optional[str] = None,
+                 metadata: Optional[Dict[str, Any]] = None,
+                 size: Optional[int] = None,
+                 mtime: Optional[float] = None) -> bool:
+        """
+        Registra (ou atualiza) um item e informa se ele precisa ser processado
+
+        Itens concluídos com o mesmo hash são mantidos; itens novos, alterados
+        (hash diferente) ou ainda não concluídos ficam pendentes.
+        """
+        existing = self.get(item_id)
+        if existing and existing['status'] == STATUS_DONE and existing['content_hash'] == content_hash:
+            if (size, mtime) != (existing['size'], existing['mtime']):
+                # arquivo tocado mas com o mesmo conteúdo: só atualiza o atalho size/mtime
+                with self._lock:
+                    self._conn.execute(
+                        "UPDATE items SET size = ?, mtime = ? WHERE item_id = ?", (size, mtime, item_id)
+                    )
+                    self._conn.commit()
+            return False
+
+        with self._lock:
+            self._conn.execute(
+                "INSERT INTO items (item_id, status, content_hash, source, content, metadata,"
+                " size, mtime, updated_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)"
+                " ON CONFLICT(item_id) DO UPDATE SET status = excluded.status,"
+                " content_hash = excluded.content_hash, source = excluded.source,"
+                " content = excluded.content, metadata = excluded.metadata,"
+                " size = excluded.size, mtime = excluded.mtime, error = NULL,"
+                " updated_at = excluded.updated_at",
+                (item_id, STATUS_PENDING, content_hash, source, content,
+                 json.dumps(metadata or {}, ensure_ascii=False, default=str), size, mtime, time.time()),
+            )
+            self._conn.commit()
+        return True
+
+    def mark(self, item_id: str, success: bool, error: Optional[str] = None):
+        """Registra o resultado de um item; gravado no próximo checkpoint"""
+        with self._lock:
+            self._pending_updates[item_id] = (STATUS_DONE if success else STATUS_FAILED, error)
+            due = (
+                len(self._pending_updates) >= self.checkpoint_every
+                or time.monotonic() - self._last_checkpoint >= self.checkpoint_interval
+            )
+        if due:
+            self.checkpoint()
+
+    def checkpoint(self):
+        """Grava as atualizações de status acumuladas em uma transação"""
+        with self._lock:
+            updates = self._pending_updates
+            self._pending_updates = {}
+            self._last_checkpoint = time.monotonic()
+            if not updates:
+                return
+            now = time.time()
+            self._conn.executemany(
+                "UPDATE items SET status = ?, error = ?, attempts = attempts + 1, updated_at = ?"
+                " WHERE item_id = ?",
+                [(status, error, now, item_id) for item_id, (status, error) in updates.items()],
+            )
+            self._conn.commit()
+
+    def iter_unfinished(self) -> Iterator[Dict[str, Any]]:
+        """Itens pendentes ou que falharam, na ordem de registro"""
+        with self._lock:
+            cursor = self._conn.execute(
+                "SELECT * FROM items WHERE status != ? ORDER BY rowid", (STATUS_DONE,)
+            )
+            columns = [col[0] for col in cursor.description]
+            rows = cursor.fetchall()
+        for row in rows:
+            record = dict(zip(columns, row))
+            record['metadata'] = json.loads(record['metadata'] or "{}")
+            yield record
+
+    def counts(self) -> Dict[str, int]:
+        with self._lock:
+            rows = self._conn.execute("SELECT status, COUNT(*) FROM items GROUP BY status").fetchall()
+        counts = {STATUS_PENDING: 0, STATUS_DONE: 0, STATUS_FAILED: 0}
+        counts.update(dict(rows))
+        return counts
+
+    def close(self):
+        self.checkpoint()
+        with self._lock:
+            self._conn.close()
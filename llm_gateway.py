@@ -0,0 +1,573 @@
+"""
+Gateway de LLM
+Prazo por tentativa e por resposta, retry com backoff, requisição "hedged" quando a primeira
+passa do p95 recente, circuit breaker por modelo e fallback para um modelo secundário ou um
+stub local; modelos e limites vêm de ``config.MODEL_CONFIG``
+
+Uso (simulação de provedor degradado com o modelo falso do ``load_test``):
+    python llm_gateway.py [chamadas] [taxa_de_erro] [taxa_lenta]
+"""
+
+import logging
+import random
+import re
+import sys
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass
+from typing import Any, Dict, Iterator, List, Mapping, Optional, Sequence
+
+from langchain_core.language_models import BaseChatModel, SimpleChatModel
+from langchain_core.messages import BaseMessage
+from langchain_core.outputs import ChatGeneration, ChatResult
+
+from config import MODEL_CONFIG
+from rate_control import RETRYABLE_OUTCOMES, RetryPolicy, classify_error
+from tracing import inc, observe
+
+gateway_logger = logging.getLogger("llm_gateway")
+
+STUB_MODEL = "stub"
+LATENCY_WINDOW = 200
+
+BREAKER_CLOSED = "fechado"
+BREAKER_OPEN = "aberto"
+BREAKER_HALF_OPEN = "meio-aberto"
+
+_WORD_PATTERN = re.compile(r"\w+")
+# Marcadores do CONDENSE_QUESTION_PROMPT do LangChain (reformulação da pergunta com o histórico)
+_CONDENSE_MARKER = "Follow Up Input:"
+_CONDENSE_END = "\nStandalone question:"
+
+# Rotas locais (stub) usadas pela requisição corrente; ver ``track_degraded``
+_DEGRADED: ContextVar[Optional[List[str]]] = ContextVar("llm_gateway_degraded", default=None)
+
+
+class GatewayError(RuntimeError):
+    """Nenhum modelo respondeu dentro do prazo"""
+
+
+class RouteSaturated(RuntimeError):
+    """Todas as vagas de chamada da rota estão ocupadas (inclusive por chamadas abandonadas)"""
+
+
+@contextmanager
+def track_degraded() -> Iterator[List[str]]:
+    """
+    Lista das rotas locais (stub) que responderam dentro do bloco
+
+    Uma resposta degradada não deve ser reaproveitada por outras requisições
+    (``coalescing``) nem guardada em cache.
+    """
+    routes: List[str] = []
+    token = _DEGRADED.set(routes)
+    try:
+        yield routes
+    finally:
+        _DEGRADED.reset(token)
+
+
+@dataclass
+class GatewaySettings:
+    call_timeout: float = 20.0
+    deadline: float = 45.0
+    max_retries: int = 2
+    retry_base_delay: float = 0.5
+    max_concurrent_calls: int = 32
+    hedge_quantile: Optional[float] = 0.95
+    hedge_min_delay: float = 1.0
+    hedge_min_samples: int = 20
+    hedge_budget: float = 0.1
+    breaker_failures: int = 5
+    breaker_reset_seconds: float = 30.0
+
+    @classmethod
+    def from_config(cls, config: Mapping[str, Any] = MODEL_CONFIG) -> "GatewaySettings":
+        defaults = cls()
+        return cls(
+            call_timeout=float(config.get("call_timeout_seconds", defaults.call_timeout)),
+            deadline=float(config.get("deadline_seconds", defaults.deadline)),
+            max_retries=int(config.get("max_retries", defaults.max_retries)),
+            retry_base_delay=float(config.get("retry_base_delay_seconds", defaults.retry_base_delay)),
+            max_concurrent_calls=int(config.get("max_concurrent_calls", defaults.max_concurrent_calls)),
+            hedge_quantile=config.get("hedge_quantile", defaults.hedge_quantile),
+            hedge_min_delay=float(config.get("hedge_min_delay_seconds", defaults.hedge_min_delay)),
+            hedge_budget=float(config.get("hedge_budget", defaults.hedge_budget)),
+            breaker_failures=int(config.get("breaker_failures", defaults.breaker_failures)),
+            breaker_reset_seconds=float(config.get("breaker_reset_seconds", defaults.breaker_reset_seconds)),
+        )
+
+
+class CircuitBreaker:
+    """
+    Abre depois de ``failure_threshold`` falhas seguidas e fica aberto por
+    ``reset_seconds``; então deixa passar uma chamada de teste (meio-aberto),
+    que fecha o circuito se der certo ou o reabre se falhar. Um teste sem
+    conclusão (erro definitivo, rota sem vaga) é liberado por ``settle_probe``
+    e a próxima chamada testa de novo.
+    """
+
+    def __init__(self, failure_threshold: int = 5, reset_seconds: float = 30.0):
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+        self._lock = threading.Lock()
+        self._failures = 0
+        self._opened_at: Optional[float] = None
+        self._probing = False
+        self._probe_thread: Optional[int] = None
+
+    @property
+    def state(self) -> str:
+        with self._lock:
+            return self._state()
+
+    def _state(self) -> str:
+        if self._opened_at is None:
+            return BREAKER_CLOSED
+        if time.monotonic() - self._opened_at >= self.reset_seconds:
+            return BREAKER_HALF_OPEN
+        return BREAKER_OPEN
+
+    def allow(self) -> bool:
+        with self._lock:
+            state = self._state()
+            if state == BREAKER_CLOSED:
+                return True
+            if state == BREAKER_HALF_OPEN and not self._probing:
+                self._probing = True
+                self._probe_thread = threading.get_ident()
+                return True
+            return False
+
+    def settle_probe(self):
+        """Libera o teste em andamento desta thread que não terminou em sucesso nem em falha transitória"""
+        with self._lock:
+            if self._probing and self._probe_thread == threading.get_ident():
+                self._probing = False
+                self._probe_thread = None
+
+    def record_success(self):
+        with self._lock:
+            self._failures = 0
+            self._opened_at = None
+            self._probing = False
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            if self._probing or self._failures >= self.failure_threshold:
+                if self._opened_at is None or self._probing:
+                    gateway_logger.warning(f"Circuito aberto após {self._failures} falha(s)")
+                self._opened_at = time.monotonic()
+                self._probing = False
+
+
+class LatencyWindow:
+    """Últimas ``size`` latências de sucesso, para o limiar do hedge"""
+
+    def __init__(self, size: int = LATENCY_WINDOW):
+        self._values: deque = deque(maxlen=size)
+        self._lock = threading.Lock()
+
+    def add(self, seconds: float):
+        with self._lock:
+            self._values.append(seconds)
+
+    def __len__(self) -> int:
+        return len(self._values)
+
+    def quantile(self, q: float) -> Optional[float]:
+        with self._lock:
+            values = sorted(self._values)
+        if not values:
+            return None
+        return values[min(len(values) - 1, int(q * len(values)))]
+
+
+class ExtractiveStubLLM(SimpleChatModel):
+    """
+    LLM determinístico: responde com as linhas do contexto que mais
+    compartilham palavras com a pergunta (mesma entrada, mesma saída)
+
+    Entende o ``QA_PROMPT`` e o ``CHAT_PROMPT`` (pergunta na última
+    mensagem); no prompt de reformulação (``CONDENSE_QUESTION_PROMPT``)
+    devolve a pergunta do usuário sem mudanças. É o último fallback do
+    gateway e o ``llm`` do benchmark offline (``rag_benchmark``).
+    """
+
+    max_lines: int = 3
+
+    @property
+    def _llm_type(self) -> str:
+        return "extractive-stub"
+
+    def _call(self, messages: List[Any], stop: Optional[List[str]] = None, run_manager: Any = None,
+              **kwargs: Any) -> str:
+        prompt = "\n".join(str(message.content) for message in messages)
+        if _CONDENSE_MARKER in prompt:
+            follow_up = prompt.rpartition(_CONDENSE_MARKER)[2]
+            return follow_up.partition(_CONDENSE_END)[0].strip()
+        if "\nQuestion:" in prompt:
+            context, _, question = prompt.rpartition("\nQuestion:")
+        else:
+            # Prompt de chat (CHAT_PROMPT): contexto na mensagem de sistema, pergunta na última mensagem
+            context = "\n".join(str(message.content) for message in messages[:-1])
+            question = str(messages[-1].content) if messages else ""
+        question_words = set(_WORD_PATTERN.findall(question.lower()))
+
+        scored = []
+        for position, line in enumerate(context.splitlines()):
+            overlap = len(question_words & set(_WORD_PATTERN.findall(line.lower())))
+            if overlap:
+                scored.append((overlap, position, line.strip()))
+        best = sorted(scored, key=lambda item: (-item[0], item[1]))[:self.max_lines]
+        if not best:
+            return "Não sei."
+        return "\n".join(line for _, _, line in sorted(best, key=lambda item: item[1]))
+
+
+class ModelRoute:
+    """
+    Um modelo do gateway com o seu circuit breaker, a sua janela de latência e
+    um pool de ``max_concurrent_calls`` threads
+
+    O pool nunca enfileira: sem vaga livre (muitas chamadas em andamento ou
+    abandonadas por prazo/hedge e ainda não terminadas), ``submit`` falha na
+    hora com ``RouteSaturated`` em vez de deixar a chamada esperar com o prazo
+    já correndo.
+    """
+
+    def __init__(self, name: str, model: BaseChatModel, settings: GatewaySettings, local: bool = False):
+        self.name = name
+        self.model = model
+        self.local = local
+        self.breaker = CircuitBreaker(settings.breaker_failures, settings.breaker_reset_seconds)
+        self.latencies = LatencyWindow()
+        self.max_concurrent_calls = settings.max_concurrent_calls
+        self._slots = threading.BoundedSemaphore(settings.max_concurrent_calls)
+        self._executor: Optional[ThreadPoolExecutor] = None
+        if not local:
+            self._executor = ThreadPoolExecutor(max_workers=settings.max_concurrent_calls,
+                                                thread_name_prefix=f"llm-{name.rsplit('/', 1)[-1]}")
+
+    def submit(self, messages: List[BaseMessage], stop: Optional[List[str]]) -> Future:
+        if not self._slots.acquire(blocking=False):
+            raise RouteSaturated(f"{self.max_concurrent_calls} chamadas em andamento")
+        try:
+            future = self._executor.submit(self.model.invoke, messages, stop=stop)
+        except BaseException:
+            self._slots.release()
+            raise
+        future.add_done_callback(lambda _: self._slots.release())
+        return future
+
+
+def _first_result(futures: Sequence[Future], timeout: float) -> BaseMessage:
+    """Resultado da primeira chamada que terminar com sucesso dentro de ``timeout``"""
+    end = time.monotonic() + timeout
+    pending = set(futures)
+    error: Optional[BaseException] = None
+    while pending:
+        done, pending = wait(pending, timeout=max(0.0, end - time.monotonic()), return_when=FIRST_COMPLETED)
+        if not done:
+            break
+        for future in done:
+            if future.exception() is None:
+                return future.result()
+            error = future.exception()
+    if error is not None and not pending:
+        raise error
+    raise TimeoutError(f"sem resposta em {timeout:.1f}s")
+
+
+class LLMGateway(BaseChatModel):
+    """
+    Modelo de chat que encaminha cada chamada pelas rotas configuradas
+
+    Para cada rota (na ordem): circuito aberto → próxima rota; senão até
+    ``max_retries`` novas tentativas com backoff para falhas transitórias
+    (429, 5xx, prazo da tentativa). O prazo total ``deadline`` vale para a
+    resposta inteira; a rota ``stub`` é local e sempre responde.
+    """
+
+    routes: List[Any]
+    settings: Any
+
+    _hedge_lock: Any = None
+    _calls: int = 0
+    _hedges: int = 0
+
+    class Config:
+        arbitrary_types_allowed = True
+        underscore_attrs_are_private = True
+
+    def __init__(self, **kwargs: Any):
+        super().__init__(**kwargs)
+        self._hedge_lock = threading.Lock()
+        self._calls = 0
+        self._hedges = 0
+
+    @property
+    def _llm_type(self) -> str:
+        return "llm-gateway"
+
+    def _generate(self, messages: List[BaseMessage], stop: Optional[List[str]] = None, run_manager: Any = None,
+                  **kwargs: Any) -> ChatResult:
+        deadline = time.monotonic() + self.settings.deadline
+        errors = []
+        for position, route in enumerate(self.routes):
+            if not route.local and deadline - time.monotonic() <= 0:
+                errors.append(f"{route.name}: prazo da resposta esgotado")
+                continue
+            if not route.breaker.allow():
+                inc("llm_breaker_skips_total", model=route.name)
+                errors.append(f"{route.name}: circuito aberto")
+                continue
+            try:
+                message = self._call_route(route, messages, stop, deadline)
+            except Exception as e:
+                gateway_logger.warning(f"Modelo {route.name} falhou: {e}")
+                errors.append(f"{route.name}: {e}")
+                continue
+            if position:
+                inc("llm_fallbacks_total", model=route.name)
+            return ChatResult(generations=[ChatGeneration(message=message)], llm_output={'model': route.name})
+        raise GatewayError("Nenhum modelo respondeu: " + "; ".join(errors))
+
+    def _call_route(self, route: ModelRoute, messages: List[BaseMessage], stop: Optional[List[str]],
+                    deadline: float) -> BaseMessage:
+        if route.local:
+            degraded = _DEGRADED.get()
+            if degraded is not None:
+                degraded.append(route.name)
+            return route.model.invoke(messages, stop=stop)
+
+        try:
+            return self._call_remote_route(route, messages, stop, deadline)
+        finally:
+            # Toda chamada de teste (circuito meio-aberto) termina resolvida, qualquer que seja o resultado
+            route.breaker.settle_probe()
+
+    def _call_remote_route(self, route: ModelRoute, messages: List[BaseMessage], stop: Optional[List[str]],
+                           deadline: float) -> BaseMessage:
+        retry_policy = RetryPolicy(base_delay=self.settings.retry_base_delay, max_delay=self.settings.call_timeout)
+        attempt = 0
+        while True:
+            timeout = min(self.settings.call_timeout, deadline - time.monotonic())
+            start = time.perf_counter()
+            try:
+                if timeout <= 0:
+                    raise TimeoutError("prazo da resposta esgotado")
+                message = self._attempt(route, messages, stop, timeout)
+            except RouteSaturated:
+                # Sem vaga na rota: nem retry nem falha no circuit breaker, vai direto para o fallback
+                observe("llm_call_seconds", time.perf_counter() - start, model=route.name, outcome="saturated")
+                raise
+            except Exception as e:
+                outcome = classify_error(e)
+                observe("llm_call_seconds", time.perf_counter() - start, model=route.name, outcome=outcome)
+                if outcome in RETRYABLE_OUTCOMES:
+                    route.breaker.record_failure()
+                attempt += 1
+                if (outcome not in RETRYABLE_OUTCOMES or attempt > self.settings.max_retries
+                        or route.breaker.state != BREAKER_CLOSED):
+                    raise
+                delay = retry_policy.delay(attempt, e)
+                if time.monotonic() + delay >= deadline:
+                    raise
+                time.sleep(delay)
+                continue
+
+            elapsed = time.perf_counter() - start
+            observe("llm_call_seconds", elapsed, model=route.name, outcome="success")
+            route.breaker.record_success()
+            route.latencies.add(elapsed)
+            return message
+
+    def _hedge_delay(self, route: ModelRoute) -> Optional[float]:
+        quantile = self.settings.hedge_quantile
+        if quantile is None or len(route.latencies) < self.settings.hedge_min_samples:
+            return None
+        return max(self.settings.hedge_min_delay, route.latencies.quantile(quantile))
+
+    def _take_hedge(self) -> bool:
+        """Limita os hedges a ``hedge_budget`` das chamadas (não dobra a carga de um provedor lento)"""
+        with self._hedge_lock:
+            if self._hedges + 1 > self.settings.hedge_budget * self._calls:
+                return False
+            self._hedges += 1
+            return True
+
+    def _attempt(self, route: ModelRoute, messages: List[BaseMessage], stop: Optional[List[str]],
+                 timeout: float) -> BaseMessage:
+        with self._hedge_lock:
+            self._calls += 1
+        futures = [route.submit(messages, stop)]
+
+        hedge_delay = self._hedge_delay(route)
+        if hedge_delay is None or hedge_delay >= timeout:
+            return _first_result(futures, timeout)
+
+        done, _ = wait(futures, timeout=hedge_delay)
+        if not done and self._take_hedge():
+            try:
+                futures.append(route.submit(messages, stop))
+                inc("llm_hedges_total", model=route.name)
+            except RouteSaturated:
+                pass
+        return _first_result(futures, timeout - hedge_delay)
+
+    def status(self) -> List[Dict[str, Any]]:
+        return [
+            {'model': route.name, 'breaker': route.breaker.state, 'p95': route.latencies.quantile(0.95)}
+            for route in self.routes
+        ]
+
+
+def _create_model(name: str, provider: str, settings: GatewaySettings,
+                  config: Mapping[str, Any]) -> BaseChatModel:
+    if provider == "fake":
+        from load_test import FakeGeminiChat
+
+        return FakeGeminiChat.from_env()
+
+    from langchain_google_genai.chat_models import ChatGoogleGenerativeAI
+
+    # Retries e prazos ficam com o gateway: uma única tentativa no cliente
+    return ChatGoogleGenerativeAI(
+        model=name,
+        temperature=config.get("temperature"),
+        max_output_tokens=config.get("max_tokens"),
+        timeout=settings.call_timeout,
+        max_retries=1,
+    )
+
+
+def create_llm_gateway(provider: str = "gemini", config: Mapping[str, Any] = MODEL_CONFIG) -> LLMGateway:
+    """Gateway com o modelo principal e os fallbacks de ``config`` (``provider="fake"`` usa o modelo simulado)"""
+    settings = GatewaySettings.from_config(config)
+    routes = []
+    for name in [config["primary_model"], *config.get("fallback_models", [])]:
+        if name == STUB_MODEL:
+            routes.append(ModelRoute(name, ExtractiveStubLLM(), settings, local=True))
+        else:
+            routes.append(ModelRoute(name, _create_model(name, provider, settings, config), settings))
+    return LLMGateway(routes=routes, settings=settings)
+
+
+def simulate_degraded_provider(calls: int = 200,
+                               error_rate: float = 0.1,
+                               slow_rate: float = 0.05,
+                               concurrency: int = 8) -> Dict[str, Dict[str, Any]]:
+    """
+    Compara o modelo simulado chamado direto com o mesmo modelo atrás do gateway
+
+    O provedor falha em ``error_rate`` das chamadas (503) e demora 10x mais em
+    ``slow_rate`` delas; o gateway usa prazos curtos para a simulação.
+    """
+    from langchain_core.messages import HumanMessage
+
+    from load_test import FakeGeminiChat
+    from metrics import LatencyHistogram
+
+    degraded = FakeGeminiChat(latency=0.2, tokens_per_second=0.0, tokens=20,
+                              error_rate=error_rate, slow_rate=slow_rate, slow_latency=2.0)
+    settings = GatewaySettings(call_timeout=1.0, deadline=2.5, retry_base_delay=0.05, hedge_min_delay=0.25,
+                               hedge_min_samples=10)
+    gateway = LLMGateway(routes=[ModelRoute("degradado", degraded, settings),
+                                 ModelRoute(STUB_MODEL, ExtractiveStubLLM(), settings, local=True)],
+                         settings=settings)
+
+    prompt = [HumanMessage(content="Contexto:\nA origem dos dados é o PIMS.\nQuestion: Qual é a origem dos dados?")]
+    report = {}
+    print("🛡️ GATEWAY DE LLM COM PROVEDOR DEGRADADO")
+    print("=" * 40)
+    print(f"{calls} chamadas, {error_rate:.0%} com erro, {slow_rate:.0%} lentas")
+    for name, model in (("direto", degraded), ("gateway", gateway)):
+        histogram, failures = LatencyHistogram(), 0
+        lock = threading.Lock()
+
+        def call(_):
+            nonlocal failures
+            start = time.perf_counter()
+            try:
+                model.invoke(prompt)
+                ok = True
+            except Exception:
+                ok = False
+            with lock:
+                histogram.observe(time.perf_counter() - start)
+                failures += 0 if ok else 1
+
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            list(pool.map(call, range(calls)))
+        summary = histogram.summary()
+        report[name] = {**summary, 'failures': failures}
+        print(f"   {name:8} p50 {summary['p50'] * 1000:6.0f} ms | p95 {summary['p95'] * 1000:6.0f} ms | "
+              f"p99 {summary['p99'] * 1000:6.0f} ms | máx {summary['max'] * 1000:6.0f} ms | falhas {failures}")
+    report['gateway']['routes'] = gateway.status()
+    report['breaker_recovery'] = simulate_breaker_recovery()
+    return report
+
+
+class _ScriptedError(RuntimeError):
+    def __init__(self, status_code: int):
+        super().__init__(f"{status_code} (simulado)")
+        self.status_code = status_code
+
+
+class _ScriptedChat(SimpleChatModel):
+    """Modelo que falha com os status de ``failures``, na ordem, e depois responde normalmente"""
+
+    failures: List[int] = []
+
+    @property
+    def _llm_type(self) -> str:
+        return "scripted"
+
+    def _call(self, messages: List[Any], stop: Optional[List[str]] = None, run_manager: Any = None,
+              **kwargs: Any) -> str:
+        if self.failures:
+            raise _ScriptedError(self.failures.pop(0))
+        return "resposta do modelo"
+
+
+def simulate_breaker_recovery(reset_seconds: float = 0.2) -> Dict[str, Any]:
+    """
+    Circuito aberto por dois 503, chamada de teste com erro definitivo (400) e
+    modelo saudável em seguida: o circuito precisa voltar a fechar
+    """
+    from langchain_core.messages import HumanMessage
+
+    settings = GatewaySettings(max_retries=0, breaker_failures=2, breaker_reset_seconds=reset_seconds,
+                               hedge_quantile=None)
+    route = ModelRoute("instavel", _ScriptedChat(failures=[503, 503, 400]), settings)
+    gateway = LLMGateway(routes=[route, ModelRoute(STUB_MODEL, ExtractiveStubLLM(), settings, local=True)],
+                         settings=settings)
+    prompt = [HumanMessage(content="Contexto:\nQuestion: teste")]
+
+    answers = [gateway.invoke(prompt).content for _ in range(2)]  # dois 503: circuito aberto
+    time.sleep(reset_seconds)
+    answers.append(gateway.invoke(prompt).content)                # teste com 400
+    answers += [gateway.invoke(prompt).content for _ in range(3)]  # modelo saudável
+    recovered = answers[-3:] == ["resposta do modelo"] * 3
+    print(f"   circuito após teste com erro definitivo: {route.breaker.state} "
+          f"({'recuperado' if recovered else 'preso no fallback'})")
+    return {'state': route.breaker.state, 'recovered': recovered}
+
+
+def main():
+    """Função principal"""
+    calls = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    error_rate = float(sys.argv[2]) if len(sys.argv) > 2 else 0.1
+    slow_rate = float(sys.argv[3]) if len(sys.argv) > 3 else 0.05
+    random.seed(0)
+    simulate_degraded_provider(calls, error_rate, slow_rate)
+
+
+if __name__ == "__main__":
+    main()
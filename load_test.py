@@ -0,0 +1,372 @@
+"""
+Teste de carga HTTP da API sem dependências externas
+Sobe o ``app.py`` com um Gemini simulado (latência e taxa de tokens configuráveis), embeddings
+determinísticos e SQLite, varia a concorrência contra ``/api/chat`` e ``/api/history`` e mede
+vazão, latência de cauda e memória por sessão de usuário
+
+Uso:
+    python load_test.py [concorrencias] [segundos_por_nivel] [workers_uvicorn] [uvicorn|prefork]
+    python load_test.py 1,4,16,32 20 2
+    python load_test.py 1,4,16,32 20 4 prefork
+"""
+
+import json
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Optional, Sequence
+
+import requests
+from langchain_core.language_models import BaseChatModel
+from langchain_core.messages import AIMessage, AIMessageChunk, BaseMessage
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+
+from metrics import ShardedMetrics
+
+# Perfil do modelo simulado (sobrescrito por FAKE_LLM_LATENCY, FAKE_LLM_TOKENS_PER_SECOND e FAKE_LLM_TOKENS)
+FAKE_LLM_LATENCY = 0.8
+FAKE_LLM_TOKENS_PER_SECOND = 80.0
+FAKE_LLM_TOKENS = 120
+# Degradação do provedor (FAKE_LLM_ERROR_RATE, FAKE_LLM_SLOW_RATE, FAKE_LLM_SLOW_SECONDS): erros 503 e chamadas lentas
+FAKE_LLM_ERROR_RATE = 0.0
+FAKE_LLM_SLOW_RATE = 0.0
+FAKE_LLM_SLOW_SECONDS = 10.0
+
+DEFAULT_CONCURRENCY = (1, 4, 16, 32)
+DEFAULT_PORT = 8799
+HEALTH_TIMEOUT = 120
+
+PERGUNTAS_CARGA = [
+    "O que é a procedure SP_AT_INT_APLICINSUMOAGRIC?",
+    "Como é formado o campo SE_USINA?",
+    "Quais insumos recebem os sufixos RES.90 e RES.60?",
+    "Como são tratados zeros em quantidade e dosagem?",
+    "Qual é a origem dos dados no sistema?",
+    "Como consultar aplicações por período?",
+]
+
+
+def _env_number(name: str, default: float) -> float:
+    try:
+        return float(os.getenv(name, str(default)))
+    except ValueError:
+        return default
+
+
+class FakeProviderError(RuntimeError):
+    """Falha simulada do provedor (classificada como erro de servidor pelo ``rate_control``)"""
+    status_code = 503
+
+
+class FakeGeminiChat(BaseChatModel):
+    """
+    Modelo de chat simulado: espera ``latency`` segundos até o primeiro token e
+    então gera ``tokens`` tokens a ``tokens_per_second`` (também via ``stream``)
+
+    O texto é determinístico (palavras da última mensagem repetidas), sem rede
+    e sem chave de API. Ativado no ``main.get_llm`` com ``LLM_PROVIDER=fake``.
+    Uma fração ``error_rate`` das chamadas falha com status 503 e uma fração
+    ``slow_rate`` espera ``slow_latency`` em vez de ``latency``.
+    """
+
+    latency: float = FAKE_LLM_LATENCY
+    tokens_per_second: float = FAKE_LLM_TOKENS_PER_SECOND
+    tokens: int = FAKE_LLM_TOKENS
+    error_rate: float = FAKE_LLM_ERROR_RATE
+    slow_rate: float = FAKE_LLM_SLOW_RATE
+    slow_latency: float = FAKE_LLM_SLOW_SECONDS
+
+    @classmethod
+    def from_env(cls) -> "FakeGeminiChat":
+        return cls(
+            latency=_env_number("FAKE_LLM_LATENCY", FAKE_LLM_LATENCY),
+            tokens_per_second=_env_number("FAKE_LLM_TOKENS_PER_SECOND", FAKE_LLM_TOKENS_PER_SECOND),
+            tokens=int(_env_number("FAKE_LLM_TOKENS", FAKE_LLM_TOKENS)),
+            error_rate=_env_number("FAKE_LLM_ERROR_RATE", FAKE_LLM_ERROR_RATE),
+            slow_rate=_env_number("FAKE_LLM_SLOW_RATE", FAKE_LLM_SLOW_RATE),
+            slow_latency=_env_number("FAKE_LLM_SLOW_SECONDS", FAKE_LLM_SLOW_SECONDS),
+        )
+
+    @property
+    def _llm_type(self) -> str:
+        return "fake-gemini"
+
+    def _first_token_latency(self) -> float:
+        """Sorteia a falha ou a lentidão desta chamada"""
+        if self.error_rate and random.random() < self.error_rate:
+            raise FakeProviderError("503 Service Unavailable (simulado)")
+        if self.slow_rate and random.random() < self.slow_rate:
+            return self.slow_latency
+        return self.latency
+
+    def _words(self, messages: List[BaseMessage]) -> List[str]:
+        words = str(messages[-1].content).split()[-40:] if messages else []
+        words = words or ["resposta"]
+        return [words[position % len(words)] for position in range(self.tokens)]
+
+    def _stream(self, messages: List[BaseMessage], stop: Optional[List[str]] = None, run_manager: Any = None,
+                **kwargs: Any) -> Iterator[ChatGenerationChunk]:
+        time.sleep(self._first_token_latency())
+        interval = 1 / self.tokens_per_second if self.tokens_per_second > 0 else 0.0
+        for position, word in enumerate(self._words(messages)):
+            if interval:
+                time.sleep(interval)
+            token = word if position == 0 else f" {word}"
+            chunk = ChatGenerationChunk(message=AIMessageChunk(content=token))
+            if run_manager:
+                run_manager.on_llm_new_token(token, chunk=chunk)
+            yield chunk
+
+    def _generate(self, messages: List[BaseMessage], stop: Optional[List[str]] = None, run_manager: Any = None,
+                  **kwargs: Any) -> ChatResult:
+        # Mesma duração do streaming em uma única espera
+        rate = self.tokens_per_second
+        time.sleep(self._first_token_latency() + (self.tokens / rate if rate > 0 else 0.0))
+        text = " ".join(self._words(messages))
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content=text))])
+
+
+def _process_tree(root_pid: int) -> List[int]:
+    """O processo e todos os descendentes, lidos de ``/proc`` (Linux)"""
+    children: Dict[int, List[int]] = {}
+    for entry in Path("/proc").iterdir():
+        if not entry.name.isdigit():
+            continue
+        try:
+            stat = (entry / "stat").read_text()
+        except OSError:
+            continue
+        parent = int(stat.rsplit(")", 1)[1].split()[1])
+        children.setdefault(parent, []).append(int(entry.name))
+
+    pids, pending = [], [root_pid]
+    while pending:
+        pid = pending.pop()
+        pids.append(pid)
+        pending.extend(children.get(pid, []))
+    return pids
+
+
+def _read_kb(path: str, field: str) -> int:
+    try:
+        for line in Path(path).read_text().splitlines():
+            if line.startswith(field):
+                return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return 0
+
+
+def _process_tree_rss(root_pid: int) -> int:
+    """RSS (bytes) somado da árvore de processos (páginas compartilhadas contam uma vez por processo)"""
+    return sum(_read_kb(f"/proc/{pid}/status", "VmRSS:") for pid in _process_tree(root_pid))
+
+
+def _process_tree_pss(root_pid: int) -> int:
+    """PSS (bytes) da árvore: páginas compartilhadas divididas entre os processos que as mapeiam"""
+    return sum(_read_kb(f"/proc/{pid}/smaps_rollup", "Pss:") for pid in _process_tree(root_pid))
+
+
+class LoadTestServer:
+    """
+    ``uvicorn app:app`` em um subprocesso, com LLM simulado, embeddings determinísticos e SQLite
+
+    Com ``prefork=True`` sobe o ``serving.py`` (índice construído uma vez no
+    mestre e compartilhado pelos workers) no lugar do ``uvicorn --workers``.
+    """
+
+    def __init__(self, workers: int = 1, port: int = DEFAULT_PORT, env: Optional[Dict[str, str]] = None,
+                 prefork: bool = False):
+        self.workers = workers
+        self.prefork = prefork
+        self.port = port
+        self.base_url = f"http://127.0.0.1:{port}"
+        self._tempdir = tempfile.TemporaryDirectory(prefix="carga_")
+        self.env = {
+            **os.environ,
+            "DATABASE_URL": f"sqlite:///{self._tempdir.name}/chat.sqlite",
+            "SOURCES_STATE_PATH": f"{self._tempdir.name}/sources.sqlite",
+            "LLM_PROVIDER": "fake",
+            "EMBEDDINGS_PROVIDER": "fake",
+            "FETCH_WIKI_DOCS": "0",
+            "SOURCE_SYNC_POLL_SECONDS": "0",
+            **(env or {}),
+        }
+        self.process: Optional[subprocess.Popen] = None
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.stop()
+
+    def start(self):
+        if self.prefork:
+            command = [sys.executable, "serving.py", str(self.workers), str(self.port)]
+            env = {**self.env, "HOST": "127.0.0.1"}
+        else:
+            command = [sys.executable, "-m", "uvicorn", "app:app", "--host", "127.0.0.1", "--port", str(self.port),
+                       "--workers", str(self.workers), "--log-level", "warning"]
+            env = self.env
+        self.process = subprocess.Popen(command, env=env)
+        deadline = time.monotonic() + HEALTH_TIMEOUT
+        while time.monotonic() < deadline:
+            if self.process.poll() is not None:
+                raise RuntimeError(f"uvicorn terminou com código {self.process.returncode}")
+            try:
+                if requests.get(f"{self.base_url}/api/health", timeout=1).ok:
+                    return
+            except requests.RequestException:
+                pass
+            time.sleep(0.2)
+        self.stop()
+        raise TimeoutError(f"API não respondeu em {HEALTH_TIMEOUT}s")
+
+    def stop(self):
+        if self.process is not None and self.process.poll() is None:
+            self.process.terminate()
+            try:
+                self.process.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                self.process.kill()
+        self.process = None
+        self._tempdir.cleanup()
+
+    def rss(self) -> int:
+        return _process_tree_rss(self.process.pid) if self.process is not None else 0
+
+    def pss(self) -> int:
+        return _process_tree_pss(self.process.pid) if self.process is not None else 0
+
+
+def _virtual_user(base_url: str, user_id: str, deadline: float, history_ratio: float,
+                  metrics: ShardedMetrics, seed: int):
+    """Alterna perguntas e consultas de histórico até ``deadline`` (uma sessão HTTP por usuário)"""
+    rng = random.Random(seed)
+    with requests.Session() as session:
+        while time.monotonic() < deadline:
+            if rng.random() < history_ratio:
+                endpoint = "history"
+                call = lambda: session.get(f"{base_url}/api/history/{user_id}", timeout=120)  # noqa: E731
+            else:
+                endpoint = "chat"
+                question = rng.choice(PERGUNTAS_CARGA)
+                call = lambda: session.post(f"{base_url}/api/chat",  # noqa: E731
+                                            json={"user_id": user_id, "question": question}, timeout=120)
+            start = time.perf_counter()
+            try:
+                response = call()
+                ok = response.status_code < 400
+            except requests.RequestException:
+                ok = False
+            metrics.observe(f"{endpoint}_seconds", time.perf_counter() - start)
+            metrics.inc(f"{endpoint}_{'ok' if ok else 'erro'}")
+
+
+def run_level(server: LoadTestServer, concurrency: int, duration: float,
+              history_ratio: float = 0.2) -> Dict[str, Any]:
+    """Executa ``concurrency`` usuários simultâneos por ``duration`` segundos"""
+    metrics = ShardedMetrics()
+    rss_before = server.rss()
+    deadline = time.monotonic() + duration
+    threads = [
+        threading.Thread(
+            target=_virtual_user,
+            args=(server.base_url, f"carga-{concurrency}-{user}", deadline, history_ratio, metrics, user),
+            daemon=True,
+        )
+        for user in range(concurrency)
+    ]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+    rss_after = server.rss()
+
+    counters = metrics.counters()
+    report: Dict[str, Any] = {
+        'concurrency': concurrency,
+        'seconds': elapsed,
+        'rss_mb': rss_after / 2 ** 20,
+        # memória efetiva: com pré-fork o RSS conta o índice compartilhado uma vez por worker
+        'pss_mb': server.pss() / 2 ** 20,
+        # cada nível usa usuários novos: o crescimento de memória vem das sessões criadas
+        'kb_per_session': (rss_after - rss_before) / 1024 / concurrency,
+    }
+    total = 0
+    for endpoint in ("chat", "history"):
+        summary = metrics.histogram(f"{endpoint}_seconds").summary()
+        ok, errors = counters.get(f"{endpoint}_ok", 0), counters.get(f"{endpoint}_erro", 0)
+        total += ok + errors
+        report[endpoint] = {
+            'requests': ok + errors,
+            'errors': errors,
+            'rps': (ok + errors) / elapsed,
+            **{key: summary[key] for key in ("p50", "p95", "p99", "max")},
+        }
+    report['rps'] = total / elapsed
+    return report
+
+
+def run_sweep(concurrency_levels: Sequence[int] = DEFAULT_CONCURRENCY,
+              duration: float = 20.0,
+              workers: int = 1,
+              history_ratio: float = 0.2,
+              port: int = DEFAULT_PORT,
+              env: Optional[Dict[str, str]] = None,
+              prefork: bool = False) -> List[Dict[str, Any]]:
+    """
+    Sobe a API e mede cada nível de concorrência em sequência
+
+    Uma pergunta de aquecimento constrói o índice e a cadeia antes da
+    medição (em cada worker, conforme o balanceamento do uvicorn).
+    """
+    reports = []
+    with LoadTestServer(workers=workers, port=port, env=env, prefork=prefork) as server:
+        for worker in range(workers):
+            requests.post(f"{server.base_url}/api/chat",
+                          json={"user_id": f"aquecimento-{worker}", "question": PERGUNTAS_CARGA[0]}, timeout=300)
+        for concurrency in concurrency_levels:
+            report = run_level(server, concurrency, duration, history_ratio)
+            reports.append(report)
+            chat, history = report['chat'], report['history']
+            print(f"👥 {concurrency:>3} usuários | {report['rps']:.1f} req/s | "
+                  f"chat p50 {_ms(chat['p50'])} p95 {_ms(chat['p95'])} p99 {_ms(chat['p99'])} | "
+                  f"histórico p95 {_ms(history['p95'])} | erros {chat['errors'] + history['errors']} | "
+                  f"RSS {report['rss_mb']:.0f} MB, PSS {report['pss_mb']:.0f} MB "
+                  f"({report['kb_per_session']:.0f} KB/sessão)")
+    return reports
+
+
+def _ms(seconds: Optional[float]) -> str:
+    return f"{seconds * 1000:.0f} ms" if seconds is not None else "-"
+
+
+def main():
+    """Função principal"""
+    print("🏋️ TESTE DE CARGA DA API (Gemini simulado + SQLite)")
+    print("=" * 50)
+
+    levels = [int(level) for level in sys.argv[1].split(",")] if len(sys.argv) > 1 else list(DEFAULT_CONCURRENCY)
+    duration = float(sys.argv[2]) if len(sys.argv) > 2 else 20.0
+    workers = int(sys.argv[3]) if len(sys.argv) > 3 else 1
+    prefork = len(sys.argv) > 4 and sys.argv[4] == "prefork"
+    print(f"🔧 {workers} worker(s) {'pré-fork' if prefork else 'uvicorn'}, {duration:.0f}s por nível, "
+          f"LLM com {_env_number('FAKE_LLM_LATENCY', FAKE_LLM_LATENCY):.1f}s até o primeiro token")
+
+    reports = run_sweep(levels, duration=duration, workers=workers, prefork=prefork)
+    output = Path(f"load_test_{workers}w{'_prefork' if prefork else ''}.json")
+    output.write_text(json.dumps(reports, ensure_ascii=False, indent=2), encoding="utf-8")
+    print(f"💾 Resultados salvos em {output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,23 +1,44 @@
+import hashlib
+import json
 import logging
 import os
-from collections import deque
+import threading
+import time
 from functools import lru_cache
-from typing import Dict, List, Optional
-from urllib.parse import urljoin, urldefrag
+from typing import TYPE_CHECKING, Any, Dict, List, NamedTuple, Optional, Sequence, Tuple
 
-import requests
-from bs4 import BeautifulSoup
 from dotenv import load_dotenv
-from langchain.chains import ConversationalRetrievalChain
-from langchain.memory import ConversationBufferMemory
-from langchain.retrievers import EnsembleRetriever
 from langchain_core.documents import Document
-from langchain_community.document_loaders import DirectoryLoader, TextLoader
-from langchain_community.embeddings import HuggingFaceEmbeddings
-from langchain_community.retrievers import BM25Retriever
-from langchain_community.vectorstores import FAISS
-from langchain_google_genai.chat_models import ChatGoogleGenerativeAI
-from langchain_text_splitters import RecursiveCharacterTextSplitter
+from langchain_core.embeddings import Embeddings
+from langchain_core.language_models import BaseChatModel
+from langchain_core.retrievers import BaseRetriever
+
+from chunking import attach_heading_paths, split_documents_by_structure
+from config import MODEL_CONFIG
+from connectors import (
+    DEFAULT_STATE_PATH,
+    LocalDirectoryConnector,
+    PdfFolderConnector,
+    SourceConnector,
+    SourceIndexer,
+    SourceStore,
+    WikiConnector,
+)
+from converter_pdf_markdown import OUTPUT_SUFFIX as PDF_OUTPUT_SUFFIX, detectar_backend
+from dedup import deduplicate_documents
+from extractive import EXTRACTIVE_ENABLED, ExtractiveAnswerer
+from html_extraction import get_extractor
+from metadata_filter import FilteredHybridRetriever, MetadataFilter, MetadataIndex
+from tracing import callbacks as tracing_callbacks, current_trace, request_trace, set_trace_labels, stage, traced_embeddings
+
+if TYPE_CHECKING:
+    # Importados sob demanda nas funções: o SDK do Gemini, o FAISS e as cadeias do
+    # LangChain respondem pela maior parte do tempo de import (ver startup.py)
+    from langchain.chains import ConversationalRetrievalChain
+    from langchain.memory import ConversationBufferMemory
+    from langchain.retrievers import EnsembleRetriever
+    from langchain_community.retrievers import BM25Retriever
+    from langchain_community.vectorstores import FAISS
 
 
 WIKI_BASE_URL = "https://gitlab.com/arii19-group/Arii19-project/-/wikis"
@@ -26,13 +47,38 @@ WIKI_MAX_DEPTH_DEFAULT = 2
 WIKI_MAX_PAGES_DEFAULT = 25
 WIKI_REQUEST_TIMEOUT = 30
 
+LLM_MODEL_NAME = MODEL_CONFIG["primary_model"]
+LLM_TEMPERATURE = MODEL_CONFIG["temperature"]
+# Incrementar sempre que o prompt ou a montagem da cadeia mudar (invalida caches de respostas)
+PROMPT_VERSION = "conversational-retrieval-v1" + ("+extractive" if EXTRACTIVE_ENABLED else "")
+
+EMBEDDING_MODEL_NAME = "sentence-transformers/all-MiniLM-L6-v2"
+EMBEDDING_DIMENSION = 384
+CHUNK_SIZE = 1200
+CHUNK_OVERLAP = 150
+DEDUP_THRESHOLD_DEFAULT = 0.8
+RETRIEVER_K = 5
+# Pesos do EnsembleRetriever: (BM25, denso)
+ENSEMBLE_WEIGHTS = (0.4, 0.6)
+# Resposta fixa (sem chamar o LLM) quando nenhum chunk satisfaz o filtro de metadados
+NO_FILTER_MATCH_ANSWER = "Nenhum documento corresponde aos filtros informados."
+
 logger = logging.getLogger(__name__)
 
 
+def _llm_provider() -> str:
+    """``gemini`` (padrão) ou ``fake`` (modelo simulado do ``load_test``, sem rede nem chave)."""
+
+    return os.getenv("LLM_PROVIDER", "gemini").strip().lower()
+
+
 def _ensure_environment() -> None:
     """Carregar variáveis de ambiente e garantir que as chaves necessárias estejam disponíveis."""
 
     load_dotenv()
+    if _llm_provider() == "fake":
+        return
+
     google_api_key = os.getenv("GOOGLE_API_KEY")
     if not google_api_key:
         raise RuntimeError(
@@ -42,154 +88,434 @@ def _ensure_environment() -> None:
     os.environ["GOOGLE_API_KEY"] = google_api_key
 
 
-@lru_cache(maxsize=1)
-def _fetch_wiki_documents(max_depth: int, max_pages: int) -> List[Document]:
-    """Baixar páginas do wiki e retornar como documentos LangChain."""
+def extract_wiki_page(html: str, page_url: str) -> Tuple[str, List[str]]:
+    """Extrair o texto de uma página do wiki e os links internos (já normalizados)."""
 
-    visited = set()
-    documents: List[Document] = []
-    queue = deque([(WIKI_HOME_URL, 0)])
+    # Backend definido por HTML_PARSER (selectolax, lxml ou BeautifulSoup);
+    # títulos, código e tabelas saem em Markdown para o chunker
+    return get_extractor().extract(html, page_url, WIKI_BASE_URL)
 
-    while queue and len(documents) < max_pages:
-        current_url, depth = queue.popleft()
-        normalized_url = urldefrag(current_url)[0].rstrip("/")
 
-        if normalized_url in visited or depth > max_depth:
-            continue
+def _env_float(name: str, default: float) -> float:
+    try:
+        return float(os.getenv(name, str(default)))
+    except ValueError:
+        return default
 
-        try:
-            response = requests.get(current_url, timeout=WIKI_REQUEST_TIMEOUT)
-            response.raise_for_status()
-        except requests.RequestException as exc:
-            logger.warning("Falha ao buscar %s: %s", current_url, exc)
-            visited.add(normalized_url)
-            continue
-
-        soup = BeautifulSoup(response.text, "html.parser")
-        for tag in soup(["script", "style", "nav", "header", "footer"]):
-            tag.decompose()
-
-        content_container = (
-            soup.find("div", id="wiki-content")
-            or soup.find("div", class_="wiki")
-            or soup.find("article")
-            or soup.body
-            or soup
-        )
 
-        page_text = content_container.get_text(separator="\n").strip() if content_container else ""
+def _build_connectors() -> List[SourceConnector]:
+    """Montar as fontes de documentos a partir das variáveis de ambiente."""
+
+    try:
+        max_depth = int(os.getenv("WIKI_MAX_DEPTH", str(WIKI_MAX_DEPTH_DEFAULT)))
+    except ValueError:
+        max_depth = WIKI_MAX_DEPTH_DEFAULT
+
+    try:
+        max_pages = int(os.getenv("WIKI_MAX_PAGES", str(WIKI_MAX_PAGES_DEFAULT)))
+    except ValueError:
+        max_pages = WIKI_MAX_PAGES_DEFAULT
+
+    connectors: List[SourceConnector] = []
+
+    fetch_remote = os.getenv("FETCH_WIKI_DOCS", "1").lower() not in {"0", "false"}
+    if fetch_remote:
+        connectors.append(
+            WikiConnector(
+                WIKI_HOME_URL,
+                extract=extract_wiki_page,
+                max_depth=max_depth,
+                max_pages=max_pages,
+                interval=_env_float("WIKI_SYNC_INTERVAL", 3600.0),
+                timeout=WIKI_REQUEST_TIMEOUT,
+            )
+        )
 
-        if page_text:
-            documents.append(
-                Document(page_content=page_text, metadata={"source": normalized_url})
+    convert_pdfs = os.getenv("CONVERT_PDF_DOCS", "1").lower() not in {"0", "false"}
+    if convert_pdfs and detectar_backend() is None:
+        logger.info("Nenhuma biblioteca de PDF instalada; PDFs locais não serão indexados")
+        convert_pdfs = False
+
+    for directory in filter(None, (d.strip() for d in os.getenv("LOCAL_DOCS_DIRS", "docs/").split(","))):
+        connectors.append(
+            LocalDirectoryConnector(
+                directory,
+                pattern="*.md",
+                interval=_env_float("LOCAL_DOCS_SYNC_INTERVAL", 60.0),
+                # Markdown gerado a partir de PDF é indexado pela fonte de PDFs (com páginas)
+                exclude_suffixes=(PDF_OUTPUT_SUFFIX,) if convert_pdfs else (),
+            )
+        )
+        if convert_pdfs:
+            connectors.append(
+                PdfFolderConnector(directory, interval=_env_float("PDF_SYNC_INTERVAL", 300.0))
             )
 
-        visited.add(normalized_url)
+    return connectors
 
-        if depth >= max_depth:
-            continue
 
-        for link in content_container.find_all("a", href=True) if content_container else []:
-            href = link["href"].strip()
-            if not href or href.startswith("#"):
-                continue
+@lru_cache(maxsize=1)
+def get_source_indexer() -> SourceIndexer:
+    """Disponibilizar o indexador de fontes (estado em ``SOURCES_STATE_PATH``)."""
 
-            absolute_url = urljoin(current_url, href)
-            absolute_url = urldefrag(absolute_url)[0].rstrip("/")
+    store = SourceStore(os.getenv("SOURCES_STATE_PATH", DEFAULT_STATE_PATH))
+    return SourceIndexer(_build_connectors(), store)
 
-            if not absolute_url.startswith(WIKI_BASE_URL):
-                continue
 
-            if any(absolute_url.endswith(ext) for ext in (".pdf", ".png", ".jpg", ".jpeg", ".svg")):
-                continue
+def split_documents(docs: List[Document]) -> List[Document]:
+    """Dividir documentos em chunks conforme ``CHUNK_STRATEGY`` (``recursivo`` ou ``estrutura``).
 
-            if absolute_url not in visited:
-                queue.append((absolute_url, depth + 1))
+    O divisor por estrutura só vira o padrão quando superar o recursivo em
+    ``chunking.comparar_chunkers`` (acerto no top-3 e MRR). Nos dois casos os
+    chunks de Markdown recebem ``heading_path``/``section`` (filtro por
+    ``section``, citações); no recursivo eles vêm dos títulos em vigor na
+    posição do chunk no documento original.
+    """
 
-    return documents
+    if os.getenv("CHUNK_STRATEGY", "recursivo").lower() == "estrutura":
+        # Títulos, blocos de código/SQL e tabelas do Markdown preservados
+        return split_documents_by_structure(docs, chunk_size=CHUNK_SIZE, chunk_overlap=CHUNK_OVERLAP)
+
+    from langchain_text_splitters import RecursiveCharacterTextSplitter
+
+    splitter = RecursiveCharacterTextSplitter(
+        chunk_size=CHUNK_SIZE,
+        chunk_overlap=CHUNK_OVERLAP,
+        separators=["\n\n", "\n", " ", ".", ",", ""],
+        add_start_index=True,
+    )
+    chunks: List[Document] = []
+    for doc in docs:
+        chunks.extend(attach_heading_paths(doc.page_content, splitter.split_documents([doc])))
+    return chunks
 
 
 @lru_cache(maxsize=1)
 def _load_documents() -> list:
-    """Carregar e dividir documentos do wiki ou do diretório local."""
+    """Carregar e dividir os documentos de todas as fontes (wiki, diretórios locais, PDFs)."""
 
-    try:
-        max_depth = int(os.getenv("WIKI_MAX_DEPTH", str(WIKI_MAX_DEPTH_DEFAULT)))
-    except ValueError:
-        max_depth = WIKI_MAX_DEPTH_DEFAULT
+    # Só fontes vencidas são sincronizadas, e só itens alterados são relidos;
+    # as demais entram com os documentos guardados na última sincronização
+    indexer = get_source_indexer()
+    indexer.sync()
+    return prepare_chunks(indexer.documents())
+
+
+def prepare_chunks(docs: List[Document]) -> List[Document]:
+    """Dividir documentos em chunks e remover quase duplicados (``DEDUP_CHUNKS``)."""
+
+    chunks = split_documents(docs)
+
+    if os.getenv("DEDUP_CHUNKS", "1").lower() not in {"0", "false"}:
+        # Boilerplate repetido entre páginas vira um único chunk com referências às origens
+        try:
+            threshold = float(os.getenv("DEDUP_THRESHOLD", str(DEDUP_THRESHOLD_DEFAULT)))
+        except ValueError:
+            threshold = DEDUP_THRESHOLD_DEFAULT
+        chunks, _ = deduplicate_documents(chunks, threshold=threshold)
+
+    return chunks
+
+
+@lru_cache(maxsize=1)
+def get_corpus_version() -> str:
+    """Identificar a versão do corpus indexado (hash do conteúdo e da origem dos chunks)."""
+
+    return compute_corpus_version(_load_documents())
+
+
+def compute_corpus_version(chunks: List[Document]) -> str:
+    """Hash curto do conteúdo, da origem e da seção (``heading_path``) de ``chunks``."""
+
+    digest = hashlib.sha256()
+    for chunk in chunks:
+        digest.update(str(chunk.metadata.get("source", "")).encode("utf-8"))
+        digest.update(b"\x1f")
+        digest.update(str(chunk.metadata.get("heading_path", "")).encode("utf-8"))
+        digest.update(b"\x1f")
+        digest.update(chunk.page_content.encode("utf-8"))
+        digest.update(b"\x1e")
+    return digest.hexdigest()[:16]
+
+
+class RetrievalIndex(NamedTuple):
+    """Estruturas de busca sobre os chunks; a linha ``i`` do FAISS e do BM25 é ``chunks[i]``."""
+
+    chunks: Sequence[Document]
+    embeddings: Embeddings
+    vectorstore: "FAISS"
+    bm25: "BM25Retriever"
+    metadata: MetadataIndex
+
+
+@lru_cache(maxsize=1)
+def _chunk_embeddings_store() -> Any:
+    """Embeddings de chunks já calculados, por hash do texto (reaproveitados entre reconstruções do índice)."""
+
+    from langchain.storage import InMemoryByteStore
+
+    return InMemoryByteStore()
+
+
+def _embeddings_provider() -> str:
+    return os.getenv("EMBEDDINGS_PROVIDER", "huggingface").strip().lower()
+
+
+def embedding_model_id() -> str:
+    """Identifica o modelo que gera os vetores (o sidecar serve o mesmo modelo do ``huggingface``)."""
+
+    if _embeddings_provider() == "fake":
+        return f"fake-deterministic-{EMBEDDING_DIMENSION}"
+    return EMBEDDING_MODEL_NAME
+
+
+@lru_cache(maxsize=1)
+def get_embeddings_model() -> Embeddings:
+    """Carregar (uma vez) o modelo de embeddings.
+
+    Com ``EMBEDDINGS_PROVIDER=fake`` usa vetores determinísticos por hash do
+    texto (testes de carga offline, sem baixar o modelo); com ``sidecar`` delega
+    ao processo de ``embedding_sidecar`` (um modelo para todos os workers).
+    """
+
+    provider = _embeddings_provider()
+    if provider == "sidecar":
+        from embedding_sidecar import SidecarEmbeddings
+
+        return SidecarEmbeddings()
+
+    if provider == "fake":
+        from langchain_community.embeddings import DeterministicFakeEmbedding
+
+        return DeterministicFakeEmbedding(size=EMBEDDING_DIMENSION)
+
+    from langchain_community.embeddings import HuggingFaceEmbeddings
+
+    return HuggingFaceEmbeddings(model_name=EMBEDDING_MODEL_NAME)
+
+
+@lru_cache(maxsize=1)
+def get_retrieval_index() -> RetrievalIndex:
+    """Construir (uma vez) o índice denso FAISS e o índice lexical BM25 sobre os chunks."""
+
+    _ensure_environment()
+    index = build_retrieval_index(_load_documents())
+    if _index_storage() == "compacto":
+        # O texto dos chunks passa a ser lido do blob em disco; a lista carregada das fontes sai da memória
+        get_corpus_version()
+        _load_documents.cache_clear()
+    return index
+
+
+def _index_storage() -> str:
+    """``memoria`` (padrão: FAISS float32 e ``Document`` em memória) ou ``compacto`` (ver ``compact_store``)."""
+
+    return os.getenv("INDEX_STORAGE", "memoria").strip().lower()
+
+
+class _ProcessPoolEmbeddings(Embeddings):
+    """Embeddings do ``HuggingFaceEmbeddings`` calculados em um pool de processos (um modelo por processo).
+
+    O pool só é aberto quando há textos a calcular; atrás do
+    ``CacheBackedEmbeddings`` isso significa só para os chunks fora do cache.
+    """
+
+    def __init__(self, cpu_workers: int):
+        self.cpu_workers = cpu_workers
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        from hybrid_executor import HybridExecutor
+
+        with HybridExecutor(cpu_workers=self.cpu_workers, embedding_model_name=EMBEDDING_MODEL_NAME) as executor:
+            return executor.embed_texts(texts).tolist()
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.embed_documents([text])[0]
+
+
+def _embed_chunks(chunks: List[Document], embeddings_model: Embeddings) -> List[List[float]]:
+    """Embeddings do corpus com cache por texto (pool de processos com ``INDEX_CPU_WORKERS`` > 1).
+
+    O pool carrega o ``EMBEDDING_MODEL_NAME`` em cada processo, então só é
+    usado com ``EMBEDDINGS_PROVIDER=huggingface``; com ``sidecar`` ou
+    ``fake`` os vetores vêm sempre de ``embeddings_model``.
+    """
+
+    from langchain.embeddings import CacheBackedEmbeddings
 
     try:
-        max_pages = int(os.getenv("WIKI_MAX_PAGES", str(WIKI_MAX_PAGES_DEFAULT)))
+        cpu_workers = int(os.getenv("INDEX_CPU_WORKERS", "0"))
     except ValueError:
-        max_pages = WIKI_MAX_PAGES_DEFAULT
+        cpu_workers = 0
 
-    wiki_docs: List[Document] = []
+    if cpu_workers > 1 and _embeddings_provider() != "huggingface":
+        logger.warning("INDEX_CPU_WORKERS ignorado: o pool de processos só calcula embeddings do huggingface")
+        cpu_workers = 0
+    if cpu_workers > 1:
+        embeddings_model = _ProcessPoolEmbeddings(cpu_workers)
 
-    fetch_remote = os.getenv("FETCH_WIKI_DOCS", "1").lower() not in {"0", "false"}
-    if fetch_remote:
-        wiki_docs = _fetch_wiki_documents(max_depth=max_depth, max_pages=max_pages)
-
-    if not wiki_docs:
-        loader = DirectoryLoader(
-            "docs/",
-            glob="*.md",
-            loader_cls=TextLoader,
-            loader_kwargs={"encoding": "utf-8", "autodetect_encoding": True},
-        )
-        docs = loader.load()
-    else:
-        docs = wiki_docs
+    # Após uma sincronização só os chunks novos ou alterados são recalculados
+    cached_embeddings = CacheBackedEmbeddings.from_bytes_store(
+        embeddings_model, _chunk_embeddings_store(), namespace=embedding_model_id()
+    )
+    return cached_embeddings.embed_documents([chunk.page_content for chunk in chunks])
 
-    splitter = RecursiveCharacterTextSplitter(
-        chunk_size=1200,
-        chunk_overlap=150,
-        separators=["\n\n", "\n", " ", ".", ",", ""],
+
+def _load_compact_vectorstore(chunks: List[Document], embeddings_model: Embeddings) -> Tuple["FAISS", Any]:
+    """Abrir o índice compacto da versão atual do corpus, gravando-o antes se ainda não existir.
+
+    Um índice gravado com outro modelo de embeddings (ou outra dimensão) é
+    regravado: os vetores não seriam comparáveis com os da pergunta.
+    """
+
+    import numpy as np
+
+    from compact_store import (
+        DEFAULT_CODEC,
+        compact_index_path,
+        load_compact_index,
+        prune_compact_indexes,
+        read_manifest,
+        write_compact_index,
     )
 
-    chunks = splitter.split_documents(docs)
-    return chunks
+    root = os.getenv("INDEX_DIR", "index_compacto")
+    codec = os.getenv("VECTOR_CODEC", DEFAULT_CODEC).strip().lower()
+    directory = compact_index_path(root, compute_corpus_version(chunks), codec)
+    model_id = embedding_model_id()
+    manifest = read_manifest(directory) if directory.exists() else None
+    stale = manifest is not None and (
+        manifest.get('embedding_model') != model_id
+        or (manifest.get('count') and manifest.get('dimension') != EMBEDDING_DIMENSION)
+    )
+    if stale:
+        logger.warning("Índice compacto em %s foi gravado com %s (%s dimensões); regravando com %s",
+                       directory, manifest.get('embedding_model'), manifest.get('dimension'), model_id)
+    if manifest is None or stale:
+        vectors = np.asarray(_embed_chunks(chunks, embeddings_model), dtype="float32")
+        write_compact_index(directory, chunks, vectors, codec, extra={'embedding_model': model_id})
+        prune_compact_indexes(root, keep=directory)
+        logger.info("Índice compacto gravado em %s", directory)
+    return load_compact_index(directory, embeddings_model)
+
+
+def build_retrieval_index(chunks: List[Document]) -> RetrievalIndex:
+    """Indexar ``chunks`` no FAISS, no BM25 e no índice de metadados (usado também pelo benchmark).
+
+    Com ``INDEX_STORAGE=compacto`` os vetores ficam quantizados (``VECTOR_CODEC``
+    ``sq8`` ou ``fp16``) e os chunks em um blob por mmap em ``INDEX_DIR``; o
+    ``RetrievalIndex`` e o BM25 passam a criar os ``Document`` sob demanda.
+    """
+
+    from langchain_community.retrievers import BM25Retriever
+    from langchain_community.vectorstores import FAISS
+
+    embeddings_model = get_embeddings_model()
+    metadata_index = MetadataIndex(chunks)
+    bm25_retriever = BM25Retriever.from_documents(chunks)
+    bm25_retriever.k = RETRIEVER_K
+
+    if _index_storage() == "compacto":
+        vectorstore, stored_chunks = _load_compact_vectorstore(chunks, embeddings_model)
+        # Mesmas posições: o BM25 devolve ``docs[i]``, materializado do blob só para o top-k
+        bm25_retriever.docs = stored_chunks
+        chunks = stored_chunks
+    else:
+        vectorstore = FAISS.from_embeddings(
+            text_embeddings=list(zip((chunk.page_content for chunk in chunks), _embed_chunks(chunks, embeddings_model))),
+            embedding=embeddings_model,
+            metadatas=[chunk.metadata for chunk in chunks],
+        )
+
+    # Tempo do embedding da pergunta separado do tempo da busca no FAISS (tracing.py)
+    vectorstore.embedding_function = traced_embeddings(vectorstore.embedding_function)
+
+    return RetrievalIndex(chunks, embeddings_model, vectorstore, bm25_retriever, metadata_index)
 
 
 @lru_cache(maxsize=1)
-def _build_ensemble_retriever() -> EnsembleRetriever:
+def _build_ensemble_retriever() -> "EnsembleRetriever":
     """Criar um recuperador híbrido combinando BM25 e embeddings densos."""
 
-    _ensure_environment()
-    chunks = _load_documents()
+    return create_ensemble_retriever(get_retrieval_index())
 
-    embedding_model_name = "sentence-transformers/all-MiniLM-L6-v2"
-    embeddings_model = HuggingFaceEmbeddings(model_name=embedding_model_name)
 
-    vectorstore = FAISS.from_documents(documents=chunks, embedding=embeddings_model)
-    vector_retriever = vectorstore.as_retriever(search_kwargs={"k": 5})
+def create_ensemble_retriever(index: RetrievalIndex, k: int = RETRIEVER_K) -> "EnsembleRetriever":
+    """Combinar o BM25 e o FAISS de ``index`` com os pesos ``ENSEMBLE_WEIGHTS``."""
 
-    bm25_retriever = BM25Retriever.from_documents(chunks)
-    bm25_retriever.k = 5
+    from langchain.retrievers import EnsembleRetriever
+    from langchain_community.retrievers import BM25Retriever
+
+    bm25_retriever = index.bm25
+    if k != bm25_retriever.k:
+        # Mesmo vetorizador BM25, só com outro k
+        bm25_retriever = BM25Retriever(
+            vectorizer=index.bm25.vectorizer, docs=index.bm25.docs, k=k, preprocess_func=index.bm25.preprocess_func
+        )
+    vector_retriever = index.vectorstore.as_retriever(search_kwargs={"k": k})
 
     ensemble_retriever = EnsembleRetriever(
         retrievers=[bm25_retriever, vector_retriever],
-        weights=[0.4, 0.6],
+        weights=list(ENSEMBLE_WEIGHTS),
     )
     return ensemble_retriever
 
 
-_USER_CHAINS: Dict[str, ConversationalRetrievalChain] = {}
+@lru_cache(maxsize=1)
+def get_extractive_answerer() -> ExtractiveAnswerer:
+    """Respostas extrativas (sem LLM) para perguntas respondidas por um único chunk (``EXTRACTIVE_ANSWERS=1`` ativa)."""
+
+    # Embeddings do índice: a pergunta já foi embutida pela busca densa da mesma requisição
+    return ExtractiveAnswerer(get_retrieval_index().vectorstore.embedding_function)
+
+
+@lru_cache(maxsize=1)
+def get_llm() -> BaseChatModel:
+    """Disponibilizar o modelo de chat compartilhado (sem estado de conversa)."""
+
+    _ensure_environment()
+    from llm_gateway import create_llm_gateway
+
+    # Prazos, retries, hedge, circuit breaker e fallback (modelos em config.MODEL_CONFIG)
+    return create_llm_gateway(_llm_provider())
+
+
+_USER_CHAINS: Dict[str, "ConversationalRetrievalChain"] = {}
+
+
+def _create_chain(memory: Optional["ConversationBufferMemory"] = None,
+                  retriever: Optional[BaseRetriever] = None,
+                  metadata_filter: Optional[MetadataFilter] = None) -> "ConversationalRetrievalChain":
+    """Criar uma nova instância de cadeia de recuperação de conversas.
 
+    Perguntas iguais em andamento compartilham a recuperação e a resposta
+    (``coalescing``) dentro da mesma versão do corpus e do mesmo filtro.
+    """
 
-def _create_chain() -> ConversationalRetrievalChain:
-    """Criar uma nova instância de cadeia de recuperação de conversas.."""
+    from langchain.memory import ConversationBufferMemory
 
-    retriever = _build_ensemble_retriever()
-    llm = ChatGoogleGenerativeAI(model="gemini-2.5-flash", temperature=0.3)
+    from coalescing import CoalescingRetrievalChain
+    from result_cache import make_cache_key
 
-    memory = ConversationBufferMemory(
+    if retriever is None:
+        retriever = (_build_filtered_retriever(metadata_filter) if metadata_filter is not None
+                     else _build_ensemble_retriever())
+    llm = get_llm()
+
+    memory = memory or ConversationBufferMemory(
         memory_key="chat_history",
         output_key="answer",
         return_messages=True,
     )
 
-    return ConversationalRetrievalChain.from_llm(
+    scope = make_cache_key(
+        json.dumps(metadata_filter.to_dict() if metadata_filter is not None else {}, sort_keys=True),
+        corpus_version=get_corpus_version(),
+        prompt_version=PROMPT_VERSION,
+    )
+    return CoalescingRetrievalChain.from_llm(
         llm=llm,
+        extractive=get_extractive_answerer() if EXTRACTIVE_ENABLED else None,
         retriever=retriever,
         memory=memory,
         verbose=False,
@@ -197,10 +523,12 @@ def _create_chain() -> ConversationalRetrievalChain:
         get_chat_history=lambda history: "\n".join(
             [message.content for message in history]
         ),
+        coalesce_scope=scope,
+        response_if_no_docs_found=NO_FILTER_MATCH_ANSWER if metadata_filter is not None else None,
     )
 
 
-def get_rag_chain(user_id: Optional[str] = None) -> ConversationalRetrievalChain:
+def get_rag_chain(user_id: Optional[str] = None) -> "ConversationalRetrievalChain":
     """Disponibilizar uma cadeia de recuperação de conversas para o usuário indicado."""
 
     cache_key = user_id or "default"
@@ -209,11 +537,42 @@ def get_rag_chain(user_id: Optional[str] = None) -> ConversationalRetrievalChain
     return _USER_CHAINS[cache_key]
 
 
-def answer_question(question: str, user_id: Optional[str] = None) -> Dict:
-    """Executar o pipeline RAG para uma pergunta e retornar a saída bruta da cadeia."""
+def _build_filtered_retriever(metadata_filter: MetadataFilter) -> FilteredHybridRetriever:
+    """Criar um recuperador híbrido restrito aos chunks que satisfazem o filtro de metadados."""
+
+    index = get_retrieval_index()
+    return FilteredHybridRetriever.from_filter(
+        index, index.metadata, metadata_filter, k=RETRIEVER_K, weights=ENSEMBLE_WEIGHTS
+    )
+
 
-    chain = get_rag_chain(user_id=user_id)
-    return chain.invoke({"question": question})
+def answer_question(question: str, user_id: Optional[str] = None,
+                    filters: Optional[Dict[str, List[str]]] = None) -> Dict:
+    """Executar o pipeline RAG para uma pergunta e retornar a saída bruta da cadeia.
+
+    ``filters`` (``source``, ``section``, ``entity``) restringe a busca aos chunks
+    correspondentes; a conversa continua usando a mesma memória do usuário.
+    Sem nenhum chunk correspondente a resposta é ``NO_FILTER_MATCH_ANSWER``,
+    sem chamar o LLM.
+    Requisições simultâneas com a mesma pergunta reformulada compartilham uma
+    única recuperação e chamada ao LLM (``COALESCE_REQUESTS=0`` desativa).
+    Quando o primeiro chunk responde à pergunta, a resposta é extraída dele
+    sem chamar o LLM (``answer_mode`` na saída; ver ``extractive``).
+    O tempo de cada etapa é registrado pelo ``tracing`` (rótulo ``cache=miss``
+    quando a requisição precisou construir o índice ou a cadeia do usuário).
+    """
+
+    with request_trace("answer"):
+        warm = get_retrieval_index.cache_info().currsize > 0 and (user_id or "default") in _USER_CHAINS
+        with stage("setup"):
+            chain = get_rag_chain(user_id=user_id)
+        if current_trace() is not None:
+            set_trace_labels(corpus_version=get_corpus_version(), cache="hit" if warm else "miss")
+
+        metadata_filter = MetadataFilter.from_dict(filters)
+        if not metadata_filter.is_empty():
+            chain = _create_chain(memory=chain.memory, metadata_filter=metadata_filter)
+        return chain.invoke({"question": question}, config={"callbacks": tracing_callbacks()})
 
 
 def reset_user_memory(user_id: Optional[str] = None) -> None:
@@ -223,6 +582,42 @@ def reset_user_memory(user_id: Optional[str] = None) -> None:
     _USER_CHAINS.pop(cache_key, None)
 
 
+def refresh_sources(force: bool = False) -> bool:
+    """Sincronizar as fontes vencidas e, se algo mudou, reconstruir o índice mantendo as conversas."""
+
+    results = get_source_indexer().sync(force=force)
+    if not any(result.has_changes for result in results):
+        return False
+
+    _load_documents.cache_clear()
+    get_corpus_version.cache_clear()
+    get_retrieval_index.cache_clear()
+    _build_ensemble_retriever.cache_clear()
+
+    # Cadeias existentes passam a usar o novo índice com a mesma memória
+    for cache_key, chain in list(_USER_CHAINS.items()):
+        _USER_CHAINS[cache_key] = _create_chain(memory=chain.memory)
+
+    logger.info("Índice atualizado: %s", ", ".join(result.source for result in results if result.has_changes))
+    return True
+
+
+def start_source_scheduler(poll_interval: float) -> threading.Thread:
+    """Verificar periodicamente as fontes em segundo plano (cada uma respeita o próprio intervalo)."""
+
+    def loop() -> None:
+        while True:
+            time.sleep(poll_interval)
+            try:
+                refresh_sources()
+            except Exception as exc:
+                logger.error("Erro ao atualizar as fontes: %s", exc)
+
+    thread = threading.Thread(target=loop, name="source-sync", daemon=True)
+    thread.start()
+    return thread
+
+
 if __name__ == "__main__":
     response = answer_question("O que é a int.aplicinsumoagric?")
     print(response.get("answer", "[sem resposta]"))
\ No newline at end of file
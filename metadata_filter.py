@@ -0,0 +1,247 @@
+"""
+Filtro de metadados para a recuperação híbrida
+Índice invertido fonte/seção/entidade → ids de chunks, usado para restringir o BM25 e o
+FAISS antes da pontuação (o custo da busca acompanha o tamanho do subconjunto)
+"""
+
+import logging
+import re
+import time
+from collections import defaultdict
+from dataclasses import dataclass, field
+from typing import TYPE_CHECKING, Any, Dict, Iterable, List, Mapping, Optional, Sequence, Tuple
+
+import numpy as np
+from langchain_core.callbacks import CallbackManagerForRetrieverRun
+from langchain_core.documents import Document
+from langchain_core.retrievers import BaseRetriever
+
+from chunking import HEADING_PATH_SEPARATOR
+from tracing import stage
+
+if TYPE_CHECKING:
+    from main import RetrievalIndex
+
+filter_logger = logging.getLogger("metadata_filter")
+
+# Constante de suavização do Reciprocal Rank Fusion (mesma do EnsembleRetriever)
+RRF_C = 60
+
+FILTER_FIELDS = ("source", "section", "entity")
+
+# Procedures, tabelas e colunas no padrão da documentação (SP_AT_INT_..., INT.TEMP_DES_..., CD_INSUMO),
+# com ou sem o schema na frente
+ENTITY_PATTERN = re.compile(r"\b(?:[A-Za-z]\w*\.)?([A-Za-z][A-Za-z0-9]*(?:_[A-Za-z0-9]+)+)\b")
+
+
+def normalize_entity(name: str) -> str:
+    """``int.sp_at_int_x`` → ``SP_AT_INT_X`` (sem schema, maiúsculas)"""
+    return name.rsplit(".", 1)[-1].upper()
+
+
+def extract_entities(text: str) -> List[str]:
+    """Identificadores de procedures/tabelas/colunas citados no texto (somente os em maiúsculas)"""
+    found = []
+    for match in ENTITY_PATTERN.finditer(text):
+        name = match.group(1)
+        if name.isupper():
+            found.append(normalize_entity(name))
+    return found
+
+
+@dataclass
+class MetadataFilter:
+    """
+    Restrição da busca: valores dentro de um campo são combinados com OU e
+    campos diferentes com E. ``source`` e ``section`` casam por trecho (sem
+    diferenciar maiúsculas); ``entity`` casa pelo nome exato, ignorando o schema.
+    """
+    source: List[str] = field(default_factory=list)
+    section: List[str] = field(default_factory=list)
+    entity: List[str] = field(default_factory=list)
+
+    @classmethod
+    def from_dict(cls, data: Optional[Mapping[str, Any]]) -> "MetadataFilter":
+        data = data or {}
+        values = {}
+        for name in FILTER_FIELDS:
+            raw = data.get(name) or []
+            if isinstance(raw, str):
+                raw = [raw]
+            values[name] = [str(value).strip() for value in raw if str(value).strip()]
+        return cls(**values)
+
+    def is_empty(self) -> bool:
+        return not (self.source or self.section or self.entity)
+
+    def to_dict(self) -> Dict[str, List[str]]:
+        return {name: list(getattr(self, name)) for name in FILTER_FIELDS if getattr(self, name)}
+
+
+class MetadataIndex:
+    """
+    Índice invertido ``campo → valor → ids de chunks`` (arrays ``int64`` ordenados)
+
+    Os ids são as posições em ``RetrievalIndex.chunks``, que coincidem com as
+    linhas do FAISS e com os documentos do BM25. As seções incluem todos os
+    títulos de ``heading_path`` e de ``headings``, de modo que filtrar por um
+    título também traz as subseções. Um chunk que absorveu quase duplicados
+    (``duplicate_sources`` do ``dedup``) entra também nas fontes e seções deles.
+    """
+
+    def __init__(self, chunks: Sequence[Document]):
+        self.size = len(chunks)
+        postings: Dict[str, Dict[str, set]] = {name: defaultdict(set) for name in FILTER_FIELDS}
+        for chunk_id, chunk in enumerate(chunks):
+            metadata = chunk.metadata
+            for origin in (metadata, *(metadata.get("duplicate_sources") or ())):
+                source = origin.get("source")
+                if source:
+                    postings["source"][str(source).casefold()].add(chunk_id)
+
+                headings = str(origin.get("heading_path") or "").split(HEADING_PATH_SEPARATOR)
+                for heading in {*headings, *(origin.get("headings") or ()), str(origin.get("section") or "")}:
+                    if heading.strip():
+                        postings["section"][heading.strip().casefold()].add(chunk_id)
+
+            for entity in extract_entities(chunk.page_content):
+                postings["entity"][entity].add(chunk_id)
+
+        self.postings: Dict[str, Dict[str, np.ndarray]] = {
+            name: {key: np.fromiter(sorted(ids), dtype=np.int64, count=len(ids)) for key, ids in values.items()}
+            for name, values in postings.items()
+        }
+
+    def values(self, name: str) -> List[str]:
+        """Valores indexados de um campo (útil para montar filtros no frontend)"""
+        return sorted(self.postings[name])
+
+    def lookup(self, name: str, value: str) -> np.ndarray:
+        """Ids dos chunks que casam com um valor de um campo"""
+        entries = self.postings[name]
+        if name == "entity":
+            ids = entries.get(normalize_entity(value))
+            return ids if ids is not None else np.empty(0, dtype=np.int64)
+
+        needle = value.casefold()
+        matches = [ids for key, ids in entries.items() if needle in key]
+        if not matches:
+            return np.empty(0, dtype=np.int64)
+        return np.unique(np.concatenate(matches))
+
+    def resolve(self, metadata_filter: MetadataFilter) -> Optional[np.ndarray]:
+        """Ids que satisfazem o filtro, ou ``None`` quando o filtro é vazio (sem restrição)"""
+        selected: Optional[np.ndarray] = None
+        for name in FILTER_FIELDS:
+            values = getattr(metadata_filter, name)
+            if not values:
+                continue
+            ids = np.unique(np.concatenate([self.lookup(name, value) for value in values]))
+            selected = ids if selected is None else np.intersect1d(selected, ids, assume_unique=True)
+        return selected
+
+
+def _top_rows(scores: np.ndarray, rows: np.ndarray, k: int) -> np.ndarray:
+    if len(rows) <= k:
+        order = np.argsort(scores)[::-1]
+    else:
+        top = np.argpartition(scores, -k)[-k:]
+        order = top[np.argsort(scores[top])[::-1]]
+    return rows[order]
+
+
+def bm25_rows(index: "RetrievalIndex", query: str, chunk_ids: np.ndarray, k: int) -> np.ndarray:
+    """Top-k do BM25 pontuando só ``chunk_ids`` (custo proporcional ao subconjunto)"""
+    bm25 = index.bm25
+    with stage("bm25"):
+        scores = np.asarray(bm25.vectorizer.get_batch_scores(bm25.preprocess_func(query), chunk_ids.tolist()))
+        return _top_rows(scores, chunk_ids, k)
+
+
+def dense_rows(index: "RetrievalIndex", query: str, chunk_ids: np.ndarray, k: int) -> np.ndarray:
+    """Top-k do FAISS restrito a ``chunk_ids`` por um ``IDSelector`` (as demais linhas não são comparadas)"""
+    import faiss
+
+    with stage("embedding"):
+        vector = np.asarray([index.embeddings.embed_query(query)], dtype="float32")
+    with stage("faiss"):
+        selector = faiss.IDSelectorBatch(chunk_ids)
+        _, rows = index.vectorstore.index.search(vector, k, params=faiss.SearchParameters(sel=selector))
+    return rows[0][rows[0] >= 0]
+
+
+def filtered_search(index: "RetrievalIndex",
+                    query: str,
+                    chunk_ids: np.ndarray,
+                    k: int,
+                    weights: Tuple[float, float]) -> List[Tuple[int, float]]:
+    """Busca híbrida (BM25 + FAISS, RRF ponderado) restrita a ``chunk_ids``; retorna ``[(chunk_id, score)]``"""
+    if len(chunk_ids) == 0:
+        return []
+    k = min(k, len(chunk_ids))
+    bm25_weight, dense_weight = weights
+
+    rrf: Dict[int, float] = defaultdict(float)
+    for weight, rows in ((bm25_weight, bm25_rows(index, query, chunk_ids, k)),
+                         (dense_weight, dense_rows(index, query, chunk_ids, k))):
+        for rank, row in enumerate(rows, start=1):
+            rrf[int(row)] += weight / (rank + RRF_C)
+    return sorted(rrf.items(), key=lambda pair: pair[1], reverse=True)[:k]
+
+
+class FilteredHybridRetriever(BaseRetriever):
+    """Recuperador híbrido que só considera os chunks selecionados por um ``MetadataFilter``"""
+
+    index: Any
+    chunk_ids: Any
+    k: int = 5
+    weights: Tuple[float, float] = (0.4, 0.6)
+
+    @classmethod
+    def from_filter(cls, index: "RetrievalIndex", metadata_index: MetadataIndex,
+                    metadata_filter: MetadataFilter, **kwargs) -> "FilteredHybridRetriever":
+        chunk_ids = metadata_index.resolve(metadata_filter)
+        if chunk_ids is None:
+            chunk_ids = np.arange(metadata_index.size, dtype=np.int64)
+        filter_logger.info(
+            f"Filtro {metadata_filter.to_dict()}: {len(chunk_ids)} de {metadata_index.size} chunks"
+        )
+        return cls(index=index, chunk_ids=chunk_ids, **kwargs)
+
+    def _get_relevant_documents(self, query: str, *,
+                                run_manager: CallbackManagerForRetrieverRun) -> List[Document]:
+        ranked = filtered_search(self.index, query, self.chunk_ids, self.k, self.weights)
+        return [self.index.chunks[chunk_id] for chunk_id, _ in ranked]
+
+
+def benchmark_filtered_retrieval(queries: Iterable[str],
+                                 filters: Sequence[Mapping[str, Any]],
+                                 index: Optional["RetrievalIndex"] = None,
+                                 metadata_index: Optional[MetadataIndex] = None,
+                                 k: int = 5,
+                                 repeat: int = 5) -> List[Dict[str, Any]]:
+    """Mede o tempo médio por pergunta de cada filtro (``{}`` = corpus inteiro) e o tamanho do subconjunto"""
+    import main
+
+    index = index or main.get_retrieval_index()
+    metadata_index = metadata_index or index.metadata
+    queries = list(queries)
+    report = []
+
+    print("🔎 BUSCA HÍBRIDA COM FILTRO DE METADADOS")
+    print("=" * 40)
+    for raw_filter in filters:
+        metadata_filter = MetadataFilter.from_dict(raw_filter)
+        chunk_ids = metadata_index.resolve(metadata_filter)
+        if chunk_ids is None:
+            chunk_ids = np.arange(metadata_index.size, dtype=np.int64)
+
+        start = time.perf_counter()
+        for _ in range(repeat):
+            for query in queries:
+                filtered_search(index, query, chunk_ids, k, main.ENSEMBLE_WEIGHTS)
+        elapsed = (time.perf_counter() - start) / max(repeat * len(queries), 1)
+
+        report.append({'filter': metadata_filter.to_dict(), 'chunks': len(chunk_ids), 'ms_per_query': elapsed * 1000})
+        print(f"   {metadata_filter.to_dict() or 'sem filtro'}: {len(chunk_ids)} chunks, {elapsed * 1000:.2f} ms/pergunta")
+    return report
@@ -0,0 +1,278 @@
+"""
+Primitivas de métricas com baixa contenção
+Contadores e histogramas de latência por thread, agregados apenas na leitura,
+com exportação no formato de texto do Prometheus
+"""
+
+import bisect
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+# Limites (em segundos) compatíveis com os buckets padrão dos clientes Prometheus,
+# estendidos para cobrir chamadas longas ao LLM
+DEFAULT_LATENCY_BUCKETS: Tuple[float, ...] = (
+    0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0,
+)
+
+
+class LatencyHistogram:
+    """
+    Histograma de latência com buckets fixos
+
+    Não é thread-safe por si só: cada thread escreve no seu próprio histograma
+    e os histogramas são combinados com ``merge`` na leitura.
+    """
+
+    def __init__(self, buckets: Sequence[float] = DEFAULT_LATENCY_BUCKETS):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)  # último = +Inf
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, value: float):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+        if value > self.max:
+            self.max = value
+
+    def merge(self, other: "LatencyHistogram") -> "LatencyHistogram":
+        """Soma ``other`` neste histograma (mesmos buckets) e o retorna"""
+        for i, value in enumerate(list(other.counts)):
+            self.counts[i] += value
+        self.count += other.count
+        self.sum += other.sum
+        self.max = max(self.max, other.max)
+        return self
+
+    def since(self, base: "LatencyHistogram") -> "LatencyHistogram":
+        """
+        Observações feitas depois de ``base`` (um retrato anterior deste histograma)
+
+        O máximo do intervalo não é conhecido: fica o limite do bucket mais alto
+        com observações (o máximo geral quando é o ``+Inf``).
+        """
+        delta = LatencyHistogram(self.buckets)
+        delta.counts = [current - previous for current, previous in zip(self.counts, base.counts)]
+        delta.count = self.count - base.count
+        delta.sum = self.sum - base.sum
+        top = max((i for i, value in enumerate(delta.counts) if value), default=None)
+        if top is not None:
+            delta.max = min(self.buckets[top], self.max) if top < len(self.buckets) else self.max
+        return delta
+
+    def quantile(self, q: float) -> Optional[float]:
+        """Estima o quantil ``q`` interpolando linearmente dentro do bucket"""
+        if self.count == 0:
+            return None
+
+        rank = q * self.count
+        cumulative = 0
+        for i, bucket_count in enumerate(self.counts):
+            if bucket_count and cumulative + bucket_count >= rank:
+                lower = self.buckets[i - 1] if i > 0 else 0.0
+                upper = self.buckets[i] if i < len(self.buckets) else self.max
+                upper = min(upper, self.max)
+                fraction = (rank - cumulative) / bucket_count
+                return lower + (max(upper, lower) - lower) * fraction
+            cumulative += bucket_count
+        return self.max
+
+    def summary(self) -> Dict[str, Optional[float]]:
+        return {
+            'count': self.count,
+            'mean': (self.sum / self.count) if self.count else None,
+            'p50': self.quantile(0.50),
+            'p95': self.quantile(0.95),
+            'p99': self.quantile(0.99),
+            'max': self.max if self.count else None,
+        }
+
+
+class _Shard:
+    """Contadores e histogramas escritos por uma única thread (``owner``)"""
+
+    def __init__(self, buckets: Sequence[float], owner: Optional[threading.Thread] = None):
+        self.buckets = buckets
+        self.owner = owner
+        self.counters: Dict[str, float] = {}
+        self.histograms: Dict[str, LatencyHistogram] = {}
+
+    def absorb(self, other: "_Shard"):
+        for name, value in other.counters.items():
+            self.counters[name] = self.counters.get(name, 0) + value
+        for name, histogram in other.histograms.items():
+            self.histograms.setdefault(name, LatencyHistogram(self.buckets)).merge(histogram)
+
+
+class ShardedMetrics:
+    """
+    Registro de métricas particionado por thread
+
+    Escritas (``inc``/``observe``) tocam apenas o shard da thread corrente e não
+    usam lock; a leitura (``counters``/``histogram``) percorre todos os shards e
+    soma os valores. O lock só é usado para registrar um shard novo.
+
+    Os shards de threads encerradas (workers de execuções anteriores) são
+    somados a um shard aposentado ao registrar um shard novo ou em
+    ``retire_dead_shards``, para a lista não crescer a cada execução.
+    """
+
+    def __init__(self, buckets: Sequence[float] = DEFAULT_LATENCY_BUCKETS):
+        self.buckets = tuple(buckets)
+        self._local = threading.local()
+        self._shards: List[_Shard] = []
+        self._retired = _Shard(self.buckets)
+        self._lock = threading.Lock()
+
+    def _shard(self) -> _Shard:
+        shard = getattr(self._local, "shard", None)
+        if shard is None:
+            shard = _Shard(self.buckets, threading.current_thread())
+            with self._lock:
+                self._retire_dead_locked()
+                self._shards.append(shard)
+            self._local.shard = shard
+        return shard
+
+    def retire_dead_shards(self):
+        """Soma os shards de threads já encerradas ao shard aposentado"""
+        with self._lock:
+            self._retire_dead_locked()
+
+    def _retire_dead_locked(self):
+        dead = [shard for shard in self._shards if shard.owner is not None and not shard.owner.is_alive()]
+        if not dead:
+            return
+        # Cópia nova em vez de alterar o aposentado: leituras em curso continuam com o anterior
+        retired = _Shard(self.buckets)
+        for shard in (self._retired, *dead):
+            retired.absorb(shard)
+        self._retired = retired
+        self._shards = [shard for shard in self._shards if shard not in dead]
+
+    def inc(self, name: str, value: float = 1):
+        counters = self._shard().counters
+        counters[name] = counters.get(name, 0) + value
+
+    def observe(self, name: str, value: float):
+        histograms = self._shard().histograms
+        histogram = histograms.get(name)
+        if histogram is None:
+            histogram = histograms[name] = LatencyHistogram(self.buckets)
+        histogram.observe(value)
+
+    def _snapshot_shards(self) -> List[_Shard]:
+        with self._lock:
+            return [self._retired, *self._shards]
+
+    def counters(self) -> Dict[str, float]:
+        totals: Dict[str, float] = {}
+        for shard in self._snapshot_shards():
+            for name, value in list(shard.counters.items()):
+                totals[name] = totals.get(name, 0) + value
+        return totals
+
+    def counter(self, name: str) -> float:
+        return self.counters().get(name, 0)
+
+    def histogram(self, name: str) -> LatencyHistogram:
+        merged = LatencyHistogram(self.buckets)
+        for shard in self._snapshot_shards():
+            histogram = shard.histograms.get(name)
+            if histogram is not None:
+                merged.merge(histogram)
+        return merged
+
+    def histogram_names(self) -> List[str]:
+        names = set()
+        for shard in self._snapshot_shards():
+            names.update(list(shard.histograms))
+        return sorted(names)
+
+    def reset(self):
+        with self._lock:
+            self._shards = []
+            self._retired = _Shard(self.buckets)
+        self._local = threading.local()
+
+
+def _format_labels(labels: Optional[Dict[str, str]]) -> str:
+    if not labels:
+        return ""
+    parts = []
+    for key, value in sorted(labels.items()):
+        escaped = str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+        parts.append(f'{key}="{escaped}"')
+    return "{" + ",".join(parts) + "}"
+
+
+def format_counter(name: str, value: float, labels: Optional[Dict[str, str]] = None,
+                   help_text: str = "", metric_type: str = "counter") -> List[str]:
+    """Linhas de exposição Prometheus para um contador ou gauge"""
+    lines = []
+    if help_text:
+        lines.append(f"# HELP {name} {help_text}")
+    lines.append(f"# TYPE {name} {metric_type}")
+    lines.append(f"{name}{_format_labels(labels)} {value}")
+    return lines
+
+
+def format_histogram(name: str, histogram: LatencyHistogram,
+                     labels: Optional[Dict[str, str]] = None, help_text: str = "",
+                     include_header: bool = True) -> List[str]:
+    """Linhas de exposição Prometheus (buckets cumulativos, _sum e _count) para um histograma"""
+    lines = []
+    if include_header:
+        if help_text:
+            lines.append(f"# HELP {name} {help_text}")
+        lines.append(f"# TYPE {name} histogram")
+
+    labels = dict(labels or {})
+    cumulative = 0
+    for bound, count in zip(histogram.buckets, histogram.counts):
+        cumulative += count
+        lines.append(f"{name}_bucket{_format_labels({**labels, 'le': repr(float(bound))})} {cumulative}")
+    lines.append(f"{name}_bucket{_format_labels({**labels, 'le': '+Inf'})} {histogram.count}")
+    lines.append(f"{name}_sum{_format_labels(labels)} {histogram.sum}")
+    lines.append(f"{name}_count{_format_labels(labels)} {histogram.count}")
+    return lines
+
+
+def render_lines(lines: Iterable[str]) -> str:
+    return "\n".join(lines) + "\n"
+
+
+PROMETHEUS_CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+def start_metrics_server(render: Callable[[], str], port: int = 9100,
+                         host: str = "0.0.0.0") -> ThreadingHTTPServer:
+    """
+    Sobe um endpoint HTTP ``/metrics`` em uma thread daemon
+
+    ``render`` é chamado a cada scrape e deve devolver o texto no formato
+    Prometheus. Use ``server.shutdown()`` para encerrar.
+    """
+
+    class _MetricsHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split("?")[0] not in ("/metrics", "/"):
+                self.send_error(404)
+                return
+            body = render().encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", PROMETHEUS_CONTENT_TYPE)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):  # noqa: A002 - assinatura da stdlib
+            return
+
+    server = ThreadingHTTPServer((host, port), _MetricsHandler)
+    thread = threading.Thread(target=server.serve_forever, name="metrics-server", daemon=True)
+    thread.start()
+    return server
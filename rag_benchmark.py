@@ -0,0 +1,295 @@
+"""
+Benchmark offline do RAG
+Executa um conjunto de perguntas de referência (golden set) em cada configuração de recuperação
+com um LLM determinístico no lugar do Gemini, mede recall@k, MRR e latência (p50/p95) e grava
+os resultados em JSON para comparar entre commits
+
+Uso:
+    python rag_benchmark.py run [saida.json]
+    python rag_benchmark.py compare base.json novo.json
+"""
+
+import json
+import logging
+import subprocess
+import sys
+import time
+from dataclasses import dataclass
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional, Sequence, Union
+
+import numpy as np
+from langchain.chains.conversational_retrieval.prompts import QA_PROMPT
+from langchain_core.documents import Document
+
+import main
+from llm_gateway import ExtractiveStubLLM
+
+benchmark_logger = logging.getLogger("rag_benchmark")
+
+GOLDEN_SET_PATH = "fixtures/golden_set.json"
+RESULTS_DIR = "benchmark_results"
+RERANKER_MODEL_NAME = "BAAI/bge-reranker-base"
+# Candidatos do ensemble passados ao cross-encoder na configuração reranqueada
+RERANK_CANDIDATES = 20
+
+# Tolerâncias do ``compare``: queda absoluta de qualidade e aumento relativo do p95
+QUALITY_TOLERANCE = 0.02
+LATENCY_TOLERANCE = 0.25
+# Diferenças de p95 abaixo disso são ruído de medição
+LATENCY_FLOOR_MS = 1.0
+
+
+@dataclass
+class GoldenQuestion:
+    """Pergunta de referência; um chunk é relevante se contém todos os trechos de ``expected``"""
+    id: str
+    question: str
+    expected: List[str]
+
+    def is_relevant(self, document: Document) -> bool:
+        return all(snippet in document.page_content for snippet in self.expected)
+
+
+def load_golden_set(path: Union[str, Path] = GOLDEN_SET_PATH) -> List[GoldenQuestion]:
+    with open(path, encoding="utf-8") as f:
+        return [GoldenQuestion(**entry) for entry in json.load(f)]
+
+
+def _load_corpus(docs_dir: Union[str, Path]) -> List[Document]:
+    from langchain_community.document_loaders import DirectoryLoader, TextLoader
+
+    documents = DirectoryLoader(
+        str(docs_dir), glob="**/*.md", loader_cls=TextLoader, loader_kwargs={"encoding": "utf-8"}
+    ).load()
+    return main.prepare_chunks(documents)
+
+
+def build_retrievers(index: main.RetrievalIndex, k: int,
+                     include_reranker: bool = True) -> Dict[str, Callable[[str], List[Document]]]:
+    """
+    Configurações avaliadas: ``bm25``, ``dense``, ``ensemble`` (a de produção) e
+    ``reranked`` (ensemble com ``RERANK_CANDIDATES`` candidatos reordenados por
+    um cross-encoder; omitida se o modelo não puder ser carregado)
+    """
+    from langchain_community.retrievers import BM25Retriever
+
+    bm25 = BM25Retriever(vectorizer=index.bm25.vectorizer, docs=index.bm25.docs, k=k,
+                         preprocess_func=index.bm25.preprocess_func)
+    retrievers: Dict[str, Callable[[str], List[Document]]] = {
+        'bm25': bm25.invoke,
+        'dense': index.vectorstore.as_retriever(search_kwargs={"k": k}).invoke,
+        'ensemble': main.create_ensemble_retriever(index, k=k).invoke,
+    }
+
+    if include_reranker:
+        try:
+            from langchain.retrievers import ContextualCompressionRetriever
+            from langchain.retrievers.document_compressors import CrossEncoderReranker
+            from langchain_community.cross_encoders import HuggingFaceCrossEncoder
+
+            reranker = CrossEncoderReranker(model=HuggingFaceCrossEncoder(model_name=RERANKER_MODEL_NAME), top_n=k)
+            retrievers['reranked'] = ContextualCompressionRetriever(
+                base_compressor=reranker,
+                base_retriever=main.create_ensemble_retriever(index, k=max(k, RERANK_CANDIDATES)),
+            ).invoke
+        except Exception as e:
+            benchmark_logger.warning(f"Configuração 'reranked' ignorada: {e}")
+    return retrievers
+
+
+def _percentile(samples: Sequence[float], q: float) -> Optional[float]:
+    return float(np.percentile(samples, q)) if samples else None
+
+
+def evaluate_retriever(retrieve: Callable[[str], List[Document]],
+                       questions: Sequence[GoldenQuestion],
+                       chunks: Sequence[Document],
+                       k: int,
+                       llm: Any,
+                       repeat: int = 3) -> Dict[str, Any]:
+    """
+    Qualidade e latência de uma configuração sobre o golden set
+
+    ``recall@k`` é a fração dos chunks relevantes do corpus que aparecem no
+    top-``k``; ``hit@k`` indica se ao menos um apareceu; o MRR usa a posição
+    do primeiro relevante (0 fora do top-``k``). A latência de recuperação e a
+    de ponta a ponta (recuperação + prompt + LLM) são medidas em ``repeat``
+    execuções após um aquecimento; ``answer_coverage`` é a fração dos trechos
+    esperados presentes na resposta do LLM determinístico.
+    """
+    retrieval_ms: List[float] = []
+    end_to_end_ms: List[float] = []
+    per_question = []
+
+    for question in questions:
+        relevant_total = sum(1 for chunk in chunks if question.is_relevant(chunk))
+        retrieve(question.question)  # aquecimento (caches de tokenização, threads do BLAS)
+
+        for _ in range(repeat):
+            start = time.perf_counter()
+            documents = retrieve(question.question)[:k]
+            retrieved = time.perf_counter()
+            prompt = QA_PROMPT.format(context="\n\n".join(d.page_content for d in documents),
+                                      question=question.question)
+            answer = llm.invoke(prompt)
+            finished = time.perf_counter()
+            retrieval_ms.append((retrieved - start) * 1000)
+            end_to_end_ms.append((finished - start) * 1000)
+
+        relevant_ranks = [rank for rank, document in enumerate(documents, start=1) if question.is_relevant(document)]
+        answer_text = getattr(answer, "content", str(answer))
+        per_question.append({
+            'id': question.id,
+            'relevant_in_corpus': relevant_total,
+            'relevant_ranks': relevant_ranks,
+            'recall': len(relevant_ranks) / relevant_total if relevant_total else 0.0,
+            'reciprocal_rank': 1 / relevant_ranks[0] if relevant_ranks else 0.0,
+            'answer_coverage': sum(snippet in answer_text for snippet in question.expected) / len(question.expected),
+        })
+
+    total = max(len(per_question), 1)
+    return {
+        f'recall@{k}': sum(item['recall'] for item in per_question) / total,
+        f'hit@{k}': sum(1 for item in per_question if item['relevant_ranks']) / total,
+        'mrr': sum(item['reciprocal_rank'] for item in per_question) / total,
+        'answer_coverage': sum(item['answer_coverage'] for item in per_question) / total,
+        'retrieval_p50_ms': _percentile(retrieval_ms, 50),
+        'retrieval_p95_ms': _percentile(retrieval_ms, 95),
+        'end_to_end_p50_ms': _percentile(end_to_end_ms, 50),
+        'end_to_end_p95_ms': _percentile(end_to_end_ms, 95),
+        'questions': per_question,
+    }
+
+
+def _git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_benchmark(golden_set_path: Union[str, Path] = GOLDEN_SET_PATH,
+                  docs_dir: Union[str, Path] = "docs",
+                  k: int = main.RETRIEVER_K,
+                  repeat: int = 3,
+                  configs: Optional[Sequence[str]] = None,
+                  output_path: Optional[Union[str, Path]] = None) -> Dict[str, Any]:
+    """
+    Indexa ``docs_dir`` como em produção (mesma divisão, deduplicação e
+    índices), avalia cada configuração e grava o JSON em ``output_path``
+    (padrão: ``benchmark_results/<data>_<commit>.json``)
+    """
+    questions = load_golden_set(golden_set_path)
+
+    start = time.perf_counter()
+    chunks = _load_corpus(docs_dir)
+    index = main.build_retrieval_index(chunks)
+    index_seconds = time.perf_counter() - start
+
+    retrievers = build_retrievers(index, k, include_reranker=configs is None or 'reranked' in configs)
+    llm = ExtractiveStubLLM()
+
+    results: Dict[str, Any] = {}
+    for name, retrieve in retrievers.items():
+        if configs is not None and name not in configs:
+            continue
+        results[name] = evaluate_retriever(retrieve, questions, index.chunks, k, llm, repeat=repeat)
+        benchmark_logger.info(f"{name}: MRR {results[name]['mrr']:.3f}")
+
+    commit = _git_commit()
+    report = {
+        'commit': commit,
+        'created_at': datetime.now().isoformat(timespec="seconds"),
+        'corpus_version': main.compute_corpus_version(index.chunks),
+        'settings': {
+            'k': k,
+            'repeat': repeat,
+            'chunks': len(index.chunks),
+            'chunk_size': main.CHUNK_SIZE,
+            'chunk_overlap': main.CHUNK_OVERLAP,
+            'ensemble_weights': list(main.ENSEMBLE_WEIGHTS),
+            'embedding_model': main.EMBEDDING_MODEL_NAME,
+            'golden_set': str(golden_set_path),
+            'questions': len(questions),
+        },
+        'index_seconds': index_seconds,
+        'results': results,
+    }
+
+    if output_path is None:
+        stamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+        output_path = Path(RESULTS_DIR) / f"{stamp}_{commit or 'sem-commit'}.json"
+    output_path = Path(output_path)
+    output_path.parent.mkdir(parents=True, exist_ok=True)
+    output_path.write_text(json.dumps(report, ensure_ascii=False, indent=2), encoding="utf-8")
+    report['output_path'] = str(output_path)
+    return report
+
+
+def compare_results(baseline: Dict[str, Any], candidate: Dict[str, Any],
+                    quality_tolerance: float = QUALITY_TOLERANCE,
+                    latency_tolerance: float = LATENCY_TOLERANCE) -> List[str]:
+    """
+    Regressões do ``candidate`` em relação ao ``baseline``: métricas de
+    qualidade que caíram mais que ``quality_tolerance`` (absoluto) e p95 que
+    subiram mais que ``latency_tolerance`` (relativo) e que ``LATENCY_FLOOR_MS``
+    """
+    regressions = []
+    for name, base in baseline['results'].items():
+        current = candidate['results'].get(name)
+        if current is None:
+            continue
+        for metric, value in base.items():
+            if not isinstance(value, (int, float)) or metric not in current:
+                continue
+            new_value = current[metric]
+            if metric.endswith("_ms"):
+                if (metric.endswith("p95_ms") and value and new_value > value * (1 + latency_tolerance)
+                        and new_value - value > LATENCY_FLOOR_MS):
+                    regressions.append(f"{name} {metric}: {value:.2f} → {new_value:.2f} ms")
+            elif new_value < value - quality_tolerance:
+                regressions.append(f"{name} {metric}: {value:.3f} → {new_value:.3f}")
+    return regressions
+
+
+def print_report(report: Dict[str, Any]):
+    k = report['settings']['k']
+    print(f"📚 {report['settings']['chunks']} chunks (corpus {report['corpus_version']}), "
+          f"{report['settings']['questions']} perguntas, indexação {report['index_seconds']:.1f}s")
+    for name, result in report['results'].items():
+        print(f"   {name:<9} recall@{k} {result[f'recall@{k}']:.2f} | hit@{k} {result[f'hit@{k}']:.2f} | "
+              f"MRR {result['mrr']:.2f} | resposta {result['answer_coverage']:.2f} | "
+              f"recuperação p50 {result['retrieval_p50_ms']:.1f} ms p95 {result['retrieval_p95_ms']:.1f} ms")
+
+
+def main_cli(argv: Sequence[str]) -> int:
+    """Função principal"""
+    command = argv[1] if len(argv) > 1 else "run"
+
+    if command == "compare" and len(argv) == 4:
+        baseline, candidate = (json.loads(Path(path).read_text(encoding="utf-8")) for path in argv[2:4])
+        regressions = compare_results(baseline, candidate)
+        print(f"🔍 {baseline.get('commit')} → {candidate.get('commit')}")
+        for line in regressions:
+            print(f"❌ {line}")
+        if not regressions:
+            print("✅ Sem regressões de qualidade ou de latência")
+        return 1 if regressions else 0
+
+    if command == "run":
+        print("🧪 BENCHMARK OFFLINE DO RAG")
+        print("=" * 40)
+        report = run_benchmark(output_path=argv[2] if len(argv) > 2 else None)
+        print_report(report)
+        print(f"💾 Resultados salvos em {report['output_path']}")
+        return 0
+
+    print(__doc__)
+    return 2
+
+
+if __name__ == "__main__":
+    sys.exit(main_cli(sys.argv))
@@ -0,0 +1,239 @@
+"""
+Controle de taxa para chamadas ao LLM
+Token bucket com rajadas, concorrência adaptativa (AIMD) e retry com backoff exponencial
+"""
+
+import random
+import threading
+import time
+from dataclasses import dataclass
+from typing import Optional
+
+# Classificação de falhas das chamadas ao provedor
+OUTCOME_SUCCESS = "success"
+OUTCOME_THROTTLED = "throttled"      # 429 / quota esgotada
+OUTCOME_SERVER_ERROR = "server_error"  # 5xx / indisponibilidade temporária
+OUTCOME_ERROR = "error"              # erro definitivo (não adianta repetir)
+
+RETRYABLE_OUTCOMES = {OUTCOME_THROTTLED, OUTCOME_SERVER_ERROR}
+
+# Nomes das exceções do google-api-core, comparados por nome para não exigir o pacote
+_THROTTLED_EXCEPTIONS = {"ResourceExhausted", "TooManyRequests", "RateLimitError"}
+_SERVER_EXCEPTIONS = {
+    "ServiceUnavailable", "InternalServerError", "GatewayTimeout",
+    "DeadlineExceeded", "BadGateway", "ServerError",
+}
+
+
+def _status_code(exc: BaseException) -> Optional[int]:
+    """Extrai o status HTTP de uma exceção, quando disponível"""
+    for attr in ("status_code", "code", "status"):
+        value = getattr(exc, attr, None)
+        if isinstance(value, int):
+            return value
+    response = getattr(exc, "response", None)
+    value = getattr(response, "status_code", None)
+    return value if isinstance(value, int) else None
+
+
+def classify_error(exc: BaseException) -> str:
+    """Classifica uma exceção do provedor em throttling, erro de servidor ou erro definitivo"""
+    status = _status_code(exc)
+    if status == 429:
+        return OUTCOME_THROTTLED
+    if status is not None and 500 <= status < 600:
+        return OUTCOME_SERVER_ERROR
+
+    names = {cls.__name__ for cls in type(exc).__mro__}
+    if names & _THROTTLED_EXCEPTIONS:
+        return OUTCOME_THROTTLED
+    if names & _SERVER_EXCEPTIONS or isinstance(exc, (TimeoutError, ConnectionError)):
+        return OUTCOME_SERVER_ERROR
+
+    message = str(exc).lower()
+    if "429" in message or "quota" in message or "rate limit" in message:
+        return OUTCOME_THROTTLED
+    if any(code in message for code in ("500", "502", "503", "504")):
+        return OUTCOME_SERVER_ERROR
+    return OUTCOME_ERROR
+
+
+def retry_after_seconds(exc: BaseException) -> Optional[float]:
+    """Lê o atraso sugerido pelo servidor (Retry-After) quando a exceção o expõe"""
+    value = getattr(exc, "retry_after", None)
+    if value is None:
+        headers = getattr(getattr(exc, "response", None), "headers", None) or {}
+        value = headers.get("Retry-After") if hasattr(headers, "get") else None
+    try:
+        return max(0.0, float(value)) if value is not None else None
+    except (TypeError, ValueError):
+        return None
+
+
+class TokenBucket:
+    """
+    Token bucket thread-safe
+
+    Repõe ``rate`` tokens por segundo até ``capacity``, permitindo rajadas de
+    até ``capacity`` requisições. A espera acontece fora do lock, então threads
+    bloqueadas não impedem as demais de consultar o balde.
+    """
+
+    def __init__(self, rate: float, capacity: Optional[float] = None):
+        self.rate = rate
+        self.capacity = max(1.0, capacity if capacity is not None else rate)
+        self._tokens = self.capacity
+        self._updated_at = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self, now: float):
+        elapsed = now - self._updated_at
+        self._tokens = min(self.capacity, self._tokens + elapsed * self.rate)
+        self._updated_at = now
+
+    def try_acquire(self, tokens: float = 1.0) -> float:
+        """Tenta consumir tokens; retorna 0 se conseguiu ou o tempo de espera estimado"""
+        with self._lock:
+            now = time.monotonic()
+            self._refill(now)
+            if self._tokens >= tokens:
+                self._tokens -= tokens
+                return 0.0
+            return (tokens - self._tokens) / self.rate
+
+    def acquire(self, tokens: float = 1.0, timeout: Optional[float] = None) -> bool:
+        """Bloqueia até haver tokens disponíveis (ou até ``timeout``)"""
+        if self.rate <= 0:
+            return True
+
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            wait = self.try_acquire(tokens)
+            if wait <= 0:
+                return True
+            if deadline is not None:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return False
+                wait = min(wait, remaining)
+            time.sleep(wait)
+
+
+class AIMDConcurrencyController:
+    """
+    Limite de concorrência adaptativo (additive increase / multiplicative decrease)
+
+    Cada resposta rápida e bem-sucedida soma ``1 / limite`` ao limite (≈ +1 por
+    janela completa); throttling, erro 5xx ou latência acima de
+    ``latency_target`` multiplicam o limite por ``decrease_factor``. Reduções
+    ficam espaçadas por ``cooldown`` segundos para que uma rajada de 429 de
+    requisições já em voo não derrube o limite ao mínimo de uma vez.
+    """
+
+    def __init__(self,
+                 initial_limit: int,
+                 min_limit: int = 1,
+                 max_limit: Optional[int] = None,
+                 latency_target: Optional[float] = None,
+                 decrease_factor: float = 0.5,
+                 cooldown: float = 1.0):
+        self.min_limit = max(1, min_limit)
+        self.max_limit = max(self.min_limit, max_limit or initial_limit)
+        self.latency_target = latency_target
+        self.decrease_factor = decrease_factor
+        self.cooldown = cooldown
+
+        self._limit = float(min(max(initial_limit, self.min_limit), self.max_limit))
+        self._in_flight = 0
+        self._last_decrease = 0.0
+        self._condition = threading.Condition()
+
+    @property
+    def limit(self) -> int:
+        return int(self._limit)
+
+    @property
+    def in_flight(self) -> int:
+        return self._in_flight
+
+    def acquire(self):
+        """Bloqueia até haver uma vaga dentro do limite atual"""
+        with self._condition:
+            while self._in_flight >= int(self._limit):
+                self._condition.wait()
+            self._in_flight += 1
+
+    def release(self, outcome: str, latency: Optional[float] = None, adjust: bool = True):
+        """Libera a vaga e ajusta o limite conforme o resultado observado"""
+        with self._condition:
+            self._in_flight = max(0, self._in_flight - 1)
+            if not adjust:
+                self._condition.notify_all()
+                return
+
+            too_slow = (
+                outcome == OUTCOME_SUCCESS
+                and self.latency_target is not None
+                and latency is not None
+                and latency > self.latency_target
+            )
+            if outcome in RETRYABLE_OUTCOMES or too_slow:
+                now = time.monotonic()
+                if now - self._last_decrease >= self.cooldown:
+                    self._limit = max(self.min_limit, self._limit * self.decrease_factor)
+                    self._last_decrease = now
+            elif outcome == OUTCOME_SUCCESS:
+                self._limit = min(self.max_limit, self._limit + 1.0 / self._limit)
+
+            self._condition.notify_all()
+
+
+@dataclass
+class RetryPolicy:
+    """Backoff exponencial com jitter completo ("full jitter")"""
+    base_delay: float = 0.5
+    max_delay: float = 30.0
+    multiplier: float = 2.0
+
+    def delay(self, attempt: int, exc: Optional[BaseException] = None) -> float:
+        """Tempo de espera antes da tentativa ``attempt`` (1 = primeira repetição)"""
+        ceiling = min(self.max_delay, self.base_delay * (self.multiplier ** max(0, attempt - 1)))
+        delay = random.uniform(0, ceiling)
+        suggested = retry_after_seconds(exc) if exc is not None else None
+        if suggested is not None:
+            delay = max(delay, min(suggested, self.max_delay))
+        return delay
+
+
+class RateController:
+    """Combina token bucket, concorrência AIMD e política de retry para os workers"""
+
+    def __init__(self,
+                 rate_limit: float,
+                 burst: Optional[float] = None,
+                 max_concurrency: int = 4,
+                 adaptive: bool = True,
+                 latency_target: Optional[float] = None,
+                 retry_policy: Optional[RetryPolicy] = None):
+        self.bucket = TokenBucket(rate_limit, burst)
+        self.concurrency = AIMDConcurrencyController(
+            initial_limit=max_concurrency,
+            max_limit=max_concurrency,
+            latency_target=latency_target,
+        )
+        self.adaptive = adaptive
+        self.retry_policy = retry_policy or RetryPolicy()
+
+    def acquire(self):
+        """Reserva uma vaga de concorrência e um token antes da chamada ao provedor"""
+        self.concurrency.acquire()
+        try:
+            self.bucket.acquire()
+        except BaseException:
+            self.concurrency.release(OUTCOME_ERROR)
+            raise
+
+    def release(self, outcome: str, latency: Optional[float] = None):
+        """Registra o resultado da chamada e libera a vaga"""
+        # sem adaptação o limite fica fixo em ``max_concurrency``
+        self.concurrency.release(outcome, latency, adjust=self.adaptive)
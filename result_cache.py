@@ -0,0 +1,248 @@
+"""
+Backends de cache para resultados de processamento em lote
+LRU em memória com orçamento de bytes e armazenamento persistente em SQLite
+"""
+
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from pathlib import Path
+from typing import Any, Dict, Optional
+
+
+def make_cache_key(content: str, **versions: Optional[str]) -> str:
+    """
+    Gera a chave de cache a partir do conteúdo e das versões que afetam o resultado
+
+    Qualquer mudança de prompt, modelo ou corpus (``prompt_version``,
+    ``model_version``, ``corpus_version``...) produz uma chave diferente, então
+    entradas antigas simplesmente deixam de ser encontradas.
+    """
+    digest = hashlib.sha256()
+    for name in sorted(versions):
+        digest.update(f"{name}={versions[name] or ''}\x1f".encode("utf-8"))
+    digest.update(content.encode("utf-8"))
+    return digest.hexdigest()
+
+
+def _encode(value: Any) -> bytes:
+    return json.dumps(value, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+def _decode(payload: bytes) -> Any:
+    return json.loads(payload.decode("utf-8"))
+
+
+class CacheBackend:
+    """Interface comum dos backends; valores precisam ser serializáveis em JSON"""
+
+    def __init__(self):
+        self.hits = 0
+        self.misses = 0
+        self._stats_lock = threading.Lock()
+
+    def _count(self, hit: bool):
+        with self._stats_lock:
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+
+    def get(self, key: str) -> Optional[Any]:
+        raise NotImplementedError
+
+    def set(self, key: str, value: Any):
+        raise NotImplementedError
+
+    def size_bytes(self) -> int:
+        raise NotImplementedError
+
+    def __len__(self) -> int:
+        raise NotImplementedError
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {
+            'backend': type(self).__name__,
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': (self.hits / lookups * 100) if lookups else 0.0,
+            'entries': len(self),
+            'bytes': self.size_bytes(),
+        }
+
+
+class LRUCache(CacheBackend):
+    """Cache em memória com descarte LRU quando o total serializado excede ``max_bytes``"""
+
+    def __init__(self, max_bytes: int = 64 * 1024 * 1024):
+        super().__init__()
+        self.max_bytes = max_bytes
+        self._entries: "OrderedDict[str, bytes]" = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[Any]:
+        with self._lock:
+            payload = self._entries.get(key)
+            if payload is not None:
+                self._entries.move_to_end(key)
+        self._count(payload is not None)
+        return _decode(payload) if payload is not None else None
+
+    def set(self, key: str, value: Any):
+        payload = _encode(value)
+        if len(payload) > self.max_bytes:
+            return
+
+        with self._lock:
+            previous = self._entries.pop(key, None)
+            if previous is not None:
+                self._bytes -= len(previous)
+            self._entries[key] = payload
+            self._bytes += len(payload)
+
+            while self._bytes > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self._bytes -= len(evicted)
+
+    def size_bytes(self) -> int:
+        return self._bytes
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+class SQLiteCache(CacheBackend):
+    """
+    Cache persistente em SQLite, compartilhado entre threads, processos e execuções
+
+    Usa uma conexão por thread e o journal WAL para que leituras concorrentes
+    não bloqueiem. Com ``max_bytes`` definido, as entradas acessadas há mais
+    tempo são removidas quando o total ultrapassa o orçamento.
+    """
+
+    _EVICTION_CHECK_EVERY = 100
+
+    def __init__(self, path: str = "batch_cache.sqlite", max_bytes: Optional[int] = None):
+        super().__init__()
+        self.path = str(path)
+        self.max_bytes = max_bytes
+        self._local = threading.local()
+        self._writes = 0
+        self._writes_lock = threading.Lock()
+
+        Path(self.path).parent.mkdir(parents=True, exist_ok=True)
+        conn = self._connection()
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS results ("
+            " key TEXT PRIMARY KEY,"
+            " value BLOB NOT NULL,"
+            " size INTEGER NOT NULL,"
+            " created_at REAL NOT NULL,"
+            " accessed_at REAL NOT NULL)"
+        )
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_results_accessed ON results (accessed_at)")
+        conn.commit()
+
+    def _connection(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def get(self, key: str) -> Optional[Any]:
+        conn = self._connection()
+        row = conn.execute("SELECT value FROM results WHERE key = ?", (key,)).fetchone()
+        self._count(row is not None)
+        if row is None:
+            return None
+        conn.execute("UPDATE results SET accessed_at = ? WHERE key = ?", (time.time(), key))
+        conn.commit()
+        return _decode(row[0])
+
+    def set(self, key: str, value: Any):
+        payload = _encode(value)
+        now = time.time()
+        conn = self._connection()
+        conn.execute(
+            "INSERT OR REPLACE INTO results (key, value, size, created_at, accessed_at)"
+            " VALUES (?, ?, ?, ?, ?)",
+            (key, payload, len(payload), now, now),
+        )
+        conn.commit()
+
+        with self._writes_lock:
+            self._writes += 1
+            check_eviction = self.max_bytes is not None and self._writes % self._EVICTION_CHECK_EVERY == 0
+        if check_eviction:
+            self._evict()
+
+    def _evict(self):
+        conn = self._connection()
+        excess = self.size_bytes() - self.max_bytes
+        if excess <= 0:
+            return
+        # remove as entradas menos acessadas até liberar o excesso
+        victims = []
+        freed = 0
+        for key, size in conn.execute("SELECT key, size FROM results ORDER BY accessed_at"):
+            victims.append((key,))
+            freed += size
+            if freed >= excess:
+                break
+        conn.executemany("DELETE FROM results WHERE key = ?", victims)
+        conn.commit()
+
+    def size_bytes(self) -> int:
+        row = self._connection().execute("SELECT COALESCE(SUM(size), 0) FROM results").fetchone()
+        return int(row[0])
+
+    def __len__(self) -> int:
+        return int(self._connection().execute("SELECT COUNT(*) FROM results").fetchone()[0])
+
+    def close(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is not None:
+            conn.close()
+            self._local.conn = None
+
+
+class TieredCache(CacheBackend):
+    """Combina um cache rápido (memória) com um persistente (disco), promovendo acertos do disco"""
+
+    def __init__(self, memory: CacheBackend, disk: CacheBackend):
+        super().__init__()
+        self.memory = memory
+        self.disk = disk
+
+    def get(self, key: str) -> Optional[Any]:
+        value = self.memory.get(key)
+        if value is None:
+            value = self.disk.get(key)
+            if value is not None:
+                self.memory.set(key, value)
+        self._count(value is not None)
+        return value
+
+    def set(self, key: str, value: Any):
+        self.memory.set(key, value)
+        self.disk.set(key, value)
+
+    def size_bytes(self) -> int:
+        return self.disk.size_bytes()
+
+    def __len__(self) -> int:
+        return len(self.disk)
+
+    def stats(self) -> Dict[str, Any]:
+        stats = super().stats()
+        stats['memory'] = self.memory.stats()
+        stats['disk'] = self.disk.stats()
+        return stats
@@ -0,0 +1,248 @@
+"""
+Gravação incremental de resultados de processamento em lote
+JSONL com fsync em lotes, Parquet opcional (pyarrow) e retomada de execuções
+"""
+
+import json
+import logging
+import os
+import time
+import uuid
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, Set, Union
+
+writer_logger = logging.getLogger("batch_processor.writer")
+
+
+def _record_from(result: Any) -> Dict[str, Any]:
+    """Aceita ``BatchResult`` (ou qualquer objeto com os mesmos atributos) ou dicionário"""
+    if isinstance(result, dict):
+        return result
+    return {
+        'item_id': result.item_id,
+        'success': result.success,
+        'result': result.result,
+        'error': result.error,
+        'processing_time': result.processing_time,
+        'timestamp': result.timestamp,
+    }
+
+
+class ResultWriter:
+    """Interface dos gravadores: ``write`` por resultado e ``close`` ao final"""
+
+    def write(self, result: Any):
+        raise NotImplementedError
+
+    def flush(self):
+        pass
+
+    def close(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+
+class JsonlResultWriter(ResultWriter):
+    """
+    Acrescenta um resultado por linha assim que ele fica pronto
+
+    Cada linha é enviada ao sistema operacional imediatamente; o ``fsync``
+    (garantia de persistência em disco) é feito a cada ``fsync_every`` linhas
+    ou ``fsync_interval`` segundos, o que vier primeiro. Uma queda perde no
+    máximo esse intervalo, nunca a execução inteira.
+    """
+
+    def __init__(self, path: Union[str, Path], append: bool = True,
+                 fsync_every: int = 100, fsync_interval: float = 1.0):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.fsync_every = max(1, fsync_every)
+        self.fsync_interval = fsync_interval
+        self.written = 0
+
+        needs_newline = False
+        if append and self.path.exists() and self.path.stat().st_size > 0:
+            # uma queda pode deixar a última linha incompleta; não emendar nela
+            with open(self.path, "rb") as existing:
+                existing.seek(-1, os.SEEK_END)
+                needs_newline = existing.read(1) != b"\n"
+
+        self._file = open(self.path, "a" if append else "w", encoding="utf-8")
+        if needs_newline:
+            self._file.write("\n")
+        self._pending = 0
+        self._last_sync = time.monotonic()
+
+    def write(self, result: Any):
+        self._file.write(json.dumps(_record_from(result), ensure_ascii=False, default=str) + "\n")
+        self._file.flush()
+        self.written += 1
+        self._pending += 1
+        if self._pending >= self.fsync_every or time.monotonic() - self._last_sync >= self.fsync_interval:
+            self._sync()
+
+    def _sync(self):
+        os.fsync(self._file.fileno())
+        self._pending = 0
+        self._last_sync = time.monotonic()
+
+    def flush(self):
+        if not self._file.closed:
+            self._file.flush()
+            self._sync()
+
+    def close(self):
+        if not self._file.closed:
+            self.flush()
+            self._file.close()
+
+
+class ParquetResultWriter(ResultWriter):
+    """
+    Grava resultados em Parquet para análise (requer ``pyarrow``)
+
+    ``path`` é um diretório de dataset: cada execução cria um arquivo
+    ``part-*.parquet`` novo, de modo que retomadas não reescrevem partes
+    anteriores. Linhas são acumuladas e gravadas em row groups de
+    ``row_group_size``. O campo ``result`` é gravado como JSON.
+
+    A parte é gravada como ``part-*.parquet.tmp`` e só é renomeada no
+    ``close`` (o rodapé do Parquet só existe depois dele). A retomada enxerga
+    apenas partes fechadas: os itens de uma execução interrompida são
+    processados de novo.
+    """
+
+    def __init__(self, path: Union[str, Path], row_group_size: int = 1000):
+        try:
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+        except ImportError as exc:
+            raise ImportError(
+                "Saída em Parquet requer pyarrow. Instale com: pip install pyarrow"
+            ) from exc
+
+        self._pa = pa
+        self.directory = Path(path)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.row_group_size = max(1, row_group_size)
+        self.written = 0
+
+        self._schema = pa.schema([
+            ('item_id', pa.string()),
+            ('success', pa.bool_()),
+            ('result', pa.string()),
+            ('error', pa.string()),
+            ('processing_time', pa.float64()),
+            ('timestamp', pa.string()),
+        ])
+        part_name = f"part-{datetime.now().strftime('%Y%m%dT%H%M%S')}-{uuid.uuid4().hex[:8]}.parquet"
+        self.path = self.directory / part_name
+        self._tmp_path = self.path.with_name(part_name + ".tmp")
+        self._writer = pq.ParquetWriter(str(self._tmp_path), self._schema)
+        self._rows: List[Dict[str, Any]] = []
+
+    def write(self, result: Any):
+        record = dict(_record_from(result))
+        record['result'] = json.dumps(record.get('result'), ensure_ascii=False, default=str)
+        self._rows.append(record)
+        self.written += 1
+        if len(self._rows) >= self.row_group_size:
+            self.flush()
+
+    def flush(self):
+        if self._rows:
+            table = self._pa.Table.from_pylist(self._rows, schema=self._schema)
+            self._writer.write_table(table)
+            self._rows = []
+
+    def close(self):
+        if self._writer is not None:
+            self.flush()
+            self._writer.close()
+            self._writer = None
+            os.replace(self._tmp_path, self.path)
+
+
+class MultiResultWriter(ResultWriter):
+    """Replica cada resultado em vários gravadores (ex.: JSONL + Parquet)"""
+
+    def __init__(self, writers: Iterable[ResultWriter]):
+        self.writers = list(writers)
+
+    def write(self, result: Any):
+        for writer in self.writers:
+            writer.write(result)
+
+    def flush(self):
+        for writer in self.writers:
+            writer.flush()
+
+    def close(self):
+        for writer in self.writers:
+            writer.close()
+
+
+def _is_parquet(path: Union[str, Path]) -> bool:
+    path = Path(path)
+    return path.suffix == ".parquet" or (path.is_dir() and any(path.glob("*.parquet*")))
+
+
+def open_result_writer(path: Union[str, Path], append: bool = True, **kwargs) -> ResultWriter:
+    """Escolhe o gravador pela extensão: ``.parquet`` (diretório de dataset) ou JSONL"""
+    if _is_parquet(path):
+        return ParquetResultWriter(path, **kwargs)
+    return JsonlResultWriter(path, append=append, **kwargs)
+
+
+def _iter_records(path: Path) -> Iterable[Dict[str, Any]]:
+    if _is_parquet(path):
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        for part in sorted(path.glob("*.parquet")):
+            try:
+                table = pq.read_table(str(part), columns=['item_id', 'success'])
+            except (OSError, pa.ArrowException) as exc:
+                # parte sem rodapé (gravada por uma versão sem o ``.tmp``) ou corrompida
+                writer_logger.warning(f"Parte ilegível ignorada em {part}: {exc}")
+                continue
+            yield from table.to_pylist()
+        return
+
+    with open(path, "r", encoding="utf-8") as f:
+        for line_number, line in enumerate(f, start=1):
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                yield json.loads(line)
+            except json.JSONDecodeError:
+                # linha truncada por uma queda durante a gravação
+                writer_logger.warning(f"Linha {line_number} inválida ignorada em {path}")
+
+
+def load_completed_ids(path: Union[str, Path], include_failed: bool = False) -> Set[str]:
+    """
+    Lê os ids já presentes em uma saída anterior para retomar a execução
+
+    Vale o último registro de cada id; por padrão apenas sucessos contam como
+    concluídos, então itens que falharam são processados novamente. Em
+    Parquet só as partes fechadas contam (``*.parquet.tmp`` e partes
+    ilegíveis ficam de fora, com aviso para as ilegíveis).
+    """
+    path = Path(path)
+    if not path.exists():
+        return set()
+
+    status: Dict[str, bool] = {}
+    for record in _iter_records(path):
+        item_id = record.get('item_id')
+        if item_id is not None:
+            status[str(item_id)] = bool(record.get('success'))
+    return {item_id for item_id, success in status.items() if success or include_failed}
@@ -0,0 +1,184 @@
+"""
+Escalonamento justo das requisições de chat
+No máximo uma pergunta em execução por usuário (a memória de conversa não é thread-safe), um
+limite global de execuções simultâneas repartido em rodízio entre os usuários com perguntas na
+fila, e rejeição com Retry-After quando as filas passam do limite
+"""
+
+import asyncio
+import logging
+import math
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Awaitable, Callable, Deque, Dict, Optional, Set, Tuple
+
+scheduler_logger = logging.getLogger("scheduler")
+
+DEFAULT_MAX_CONCURRENCY = 16
+DEFAULT_MAX_QUEUE_PER_USER = 4
+DEFAULT_MAX_QUEUED = 256
+# Média móvel exponencial do tempo de execução, usada para estimar o Retry-After
+SERVICE_TIME_ALPHA = 0.2
+
+
+class SchedulerFull(Exception):
+    """Fila cheia (do usuário ou global); ``retry_after`` em segundos"""
+
+    def __init__(self, reason: str, retry_after: int):
+        super().__init__(f"Fila cheia ({reason}); tente novamente em {retry_after}s")
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+class FairScheduler:
+    """
+    Fila por usuário com rodízio entre usuários (roda no loop de eventos, sem locks)
+
+    Um usuário só volta para o fim do rodízio quando a pergunta dele termina,
+    então quem dispara muitas requisições em paralelo ocupa no máximo uma
+    vaga por vez e não atrasa os demais. A garantia vale por processo: com
+    vários workers, cada um tem o seu escalonador.
+    """
+
+    def __init__(self,
+                 max_concurrency: int = DEFAULT_MAX_CONCURRENCY,
+                 max_queue_per_user: int = DEFAULT_MAX_QUEUE_PER_USER,
+                 max_queued: int = DEFAULT_MAX_QUEUED):
+        self.max_concurrency = max(1, max_concurrency)
+        self.max_queue_per_user = max_queue_per_user
+        self.max_queued = max_queued
+        self._queues: Dict[str, Deque[asyncio.Future]] = {}
+        self._ready: Deque[str] = deque()  # usuários com fila e nada em execução, na ordem do rodízio
+        self._active: Set[str] = set()
+        self._queued = 0
+        self.service_seconds = 1.0
+        self.rejected = 0
+
+    @property
+    def running(self) -> int:
+        return len(self._active)
+
+    @property
+    def queued(self) -> int:
+        return self._queued
+
+    def retry_after(self, waiting: int) -> int:
+        """Estimativa de quando ``waiting`` execuções à frente terão terminado"""
+        return max(1, math.ceil(self.service_seconds * (waiting / self.max_concurrency + 1)))
+
+    async def acquire(self, user_id: str):
+        queue = self._queues.get(user_id)
+        if queue is not None and len(queue) >= self.max_queue_per_user:
+            self.rejected += 1
+            raise SchedulerFull("usuario", self.retry_after(len(queue)))
+        if self._queued >= self.max_queued:
+            self.rejected += 1
+            raise SchedulerFull("global", self.retry_after(self._queued))
+
+        if user_id not in self._active and not queue and self.running < self.max_concurrency:
+            self._active.add(user_id)
+            return
+
+        future = asyncio.get_running_loop().create_future()
+        self._queues.setdefault(user_id, deque()).append(future)
+        self._queued += 1
+        if user_id not in self._active and user_id not in self._ready:
+            self._ready.append(user_id)
+        self._dispatch()
+        try:
+            await future
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                # A vaga chegou junto com o cancelamento: devolve
+                self.release(user_id)
+            else:
+                self._forget(user_id, future)
+            raise
+
+    def _forget(self, user_id: str, future: asyncio.Future):
+        queue = self._queues.get(user_id)
+        if queue is None or future not in queue:
+            return
+        queue.remove(future)
+        self._queued -= 1
+        if not queue:
+            del self._queues[user_id]
+            if user_id in self._ready:
+                self._ready.remove(user_id)
+
+    def release(self, user_id: str, seconds: Optional[float] = None):
+        if seconds is not None:
+            self.service_seconds += SERVICE_TIME_ALPHA * (seconds - self.service_seconds)
+        self._active.discard(user_id)
+        if self._queues.get(user_id):
+            self._ready.append(user_id)
+        self._dispatch()
+
+    def _dispatch(self):
+        while self._ready and self.running < self.max_concurrency:
+            user_id = self._ready.popleft()
+            queue = self._queues[user_id]
+            future = queue.popleft()
+            self._queued -= 1
+            if not queue:
+                del self._queues[user_id]
+            if future.cancelled():
+                # Requisição cancelada antes de ser atendida: o usuário mantém o lugar no rodízio
+                if user_id in self._queues:
+                    self._ready.appendleft(user_id)
+                continue
+            self._active.add(user_id)
+            future.set_result(None)
+
+    @asynccontextmanager
+    async def slot(self, user_id: str) -> AsyncIterator[float]:
+        """
+        Espera a vez do usuário; devolve o tempo de espera em fila (segundos)
+
+        A vaga é liberada ao sair do bloco, inclusive por cancelamento: para
+        trabalho que continua depois do cancelamento (threads), use ``run``.
+        """
+        start = time.perf_counter()
+        await self.acquire(user_id)
+        started = time.perf_counter()
+        try:
+            yield started - start
+        finally:
+            self.release(user_id, time.perf_counter() - started)
+
+    async def run(self, user_id: str, start_job: Callable[[], Awaitable[Any]]) -> Tuple[float, Any]:
+        """
+        Executa ``start_job()`` na vez do usuário; devolve ``(espera_em_fila, resultado)``
+
+        O trabalho é protegido com ``asyncio.shield``: se a requisição for
+        cancelada (cliente desconectou), o ``run_in_threadpool`` continua na
+        thread e a vaga só é liberada quando ele termina, então a próxima
+        pergunta do mesmo usuário não começa antes da anterior gravar a memória.
+        """
+        start = time.perf_counter()
+        await self.acquire(user_id)
+        started = time.perf_counter()
+        try:
+            job = asyncio.ensure_future(start_job())
+        except BaseException:
+            self.release(user_id)
+            raise
+
+        def finished(task: asyncio.Future):
+            if not task.cancelled():
+                task.exception()  # marca a exceção como lida quando ninguém mais espera pela tarefa
+            self.release(user_id, time.perf_counter() - started)
+
+        job.add_done_callback(finished)
+        result = await asyncio.shield(job)
+        return started - start, result
+
+    def stats(self) -> Dict[str, float]:
+        return {
+            'running': self.running,
+            'queued': self.queued,
+            'users_waiting': len(self._ready),
+            'rejected': self.rejected,
+            'service_seconds': self.service_seconds,
+        }
@@ -0,0 +1,222 @@
+"""
+Servidor multi-worker com pré-fork
+O mestre importa o app e aquece o pipeline (modelo de embeddings, FAISS, BM25, índice de
+metadados) antes de criar os workers com fork: as estruturas ficam compartilhadas por
+copy-on-write em vez de construídas uma vez por worker, como no ``uvicorn --workers``
+
+Com ``EMBEDDINGS_SIDECAR=1`` o modelo de embeddings roda em um processo à parte
+(``embedding_sidecar``), acessado por socket Unix: nem o mestre nem os workers carregam o
+PyTorch. Quando as fontes mudam (``SOURCE_SYNC_POLL_SECONDS``), o mestre reconstrói o índice
+e substitui os workers um a um, mantendo o compartilhamento.
+
+Uso:
+    python serving.py [workers] [porta]
+    EMBEDDINGS_SIDECAR=1 python serving.py 8 8080
+"""
+
+import gc
+import logging
+import os
+import signal
+import socket
+import sys
+import time
+from typing import Dict, Optional
+
+serving_logger = logging.getLogger("serving")
+
+DEFAULT_PORT = 8000
+RESPAWN_DELAY = 1.0
+SHUTDOWN_TIMEOUT = 30.0
+
+
+def _env_flag(name: str, default: str) -> bool:
+    return os.getenv(name, default).strip().lower() not in {"0", "false"}
+
+
+def _bind(host: str, port: int) -> socket.socket:
+    """Socket de escuta criado no mestre e herdado pelos workers (o kernel distribui as conexões)"""
+    sock = socket.socket(socket.AF_INET6 if ":" in host else socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((host, port))
+    sock.listen(2048)
+    sock.set_inheritable(True)
+    return sock
+
+
+class PreforkServer:
+    """Mestre que aquece o pipeline, cria ``workers`` processos com fork e os supervisiona"""
+
+    def __init__(self, workers: int, host: str = "0.0.0.0", port: int = DEFAULT_PORT,
+                 sync_interval: float = 0.0, log_level: str = "info"):
+        self.workers = max(1, workers)
+        self.host = host
+        self.port = port
+        self.sync_interval = sync_interval
+        self.log_level = log_level
+        self.children: Dict[int, int] = {}  # pid → posição do worker
+        self._socket: Optional[socket.socket] = None
+        self._stopping = False
+
+    def prepare(self):
+        """Importa o app e roda o aquecimento no mestre (erros ficam visíveis no ``/api/ready`` dos workers)"""
+        import app
+
+        app.criar_tabelas()
+        if app.WARMUP_ENABLED:
+            app.WARMUP.run()
+            status = app.WARMUP.status()
+            serving_logger.info(
+                f"Aquecimento no mestre em {status['elapsed_seconds']:.1f}s "
+                f"({'pronto' if status['ready'] else 'com erros'})"
+            )
+        # Conexões do pool não podem ser compartilhadas entre processos
+        app.engine.dispose()
+        self._freeze()
+
+    @staticmethod
+    def _freeze():
+        # Objetos do mestre saem das gerações do GC: as coletas nos workers não tocam
+        # nesses cabeçalhos e as páginas continuam compartilhadas
+        gc.collect()
+        gc.freeze()
+
+    def _spawn(self, slot: int) -> int:
+        pid = os.fork()
+        if pid:
+            self.children[pid] = slot
+            return pid
+
+        # Worker
+        code = 0
+        try:
+            signal.signal(signal.SIGTERM, signal.SIG_DFL)
+            signal.signal(signal.SIGINT, signal.SIG_DFL)
+            self._serve_worker()
+        except BaseException as e:
+            serving_logger.error(f"Worker {slot} terminou com erro: {e}")
+            code = 1
+        finally:
+            os._exit(code)
+
+    def _serve_worker(self):
+        import uvicorn
+
+        import app
+
+        config = uvicorn.Config(app.app, log_level=self.log_level)
+        uvicorn.Server(config).run(sockets=[self._socket])
+
+    def _signal_children(self, signum: int, pids=None):
+        for pid in list(pids if pids is not None else self.children):
+            try:
+                os.kill(pid, signum)
+            except ProcessLookupError:
+                pass
+
+    def _reap(self) -> Optional[int]:
+        try:
+            pid, status = os.waitpid(-1, os.WNOHANG)
+        except ChildProcessError:
+            return None
+        if pid == 0:
+            return None
+        slot = self.children.pop(pid, None)
+        if slot is None:
+            # Worker substituído após uma atualização do índice (ou o sidecar)
+            serving_logger.info(f"Processo {pid} encerrado com status {status}")
+        elif not self._stopping:
+            serving_logger.warning(f"Worker {slot} (pid {pid}) saiu com status {status}; recriando")
+            time.sleep(RESPAWN_DELAY)
+            self._spawn(slot)
+        return pid
+
+    def _refresh(self):
+        """Sincroniza as fontes no mestre; se o índice mudou, troca os workers um a um"""
+        import main
+
+        try:
+            changed = main.refresh_sources()
+            if changed:
+                main.get_retrieval_index()
+                main._build_ensemble_retriever()
+        except Exception as e:
+            serving_logger.error(f"Erro ao atualizar as fontes: {e}")
+            return
+        if not changed:
+            return
+
+        gc.unfreeze()
+        self._freeze()
+        serving_logger.info("Índice atualizado no mestre; substituindo os workers")
+        for pid, slot in list(self.children.items()):
+            # O novo worker entra antes de o antigo sair (que termina as requisições em andamento)
+            self.children.pop(pid)
+            self._spawn(slot)
+            self._signal_children(signal.SIGTERM, [pid])
+
+    def _stop(self, signum, frame):
+        self._stopping = True
+
+    def run(self):
+        self._socket = _bind(self.host, self.port)
+        self.prepare()
+
+        signal.signal(signal.SIGTERM, self._stop)
+        signal.signal(signal.SIGINT, self._stop)
+        for slot in range(self.workers):
+            self._spawn(slot)
+        serving_logger.info(f"{self.workers} workers em http://{self.host}:{self.port} (mestre pid {os.getpid()})")
+
+        next_sync = time.monotonic() + self.sync_interval if self.sync_interval > 0 else None
+        while not self._stopping:
+            while self._reap() is not None:
+                pass
+            if next_sync is not None and time.monotonic() >= next_sync:
+                self._refresh()
+                next_sync = time.monotonic() + self.sync_interval
+            time.sleep(0.2)
+
+        serving_logger.info("Encerrando os workers")
+        self._signal_children(signal.SIGTERM)
+        deadline = time.monotonic() + SHUTDOWN_TIMEOUT
+        while self.children and time.monotonic() < deadline:
+            if self._reap() is None:
+                time.sleep(0.1)
+        self._signal_children(signal.SIGKILL)
+        self._socket.close()
+
+
+def main():
+    """Função principal"""
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(name)s %(levelname)s %(message)s")
+    workers = int(sys.argv[1]) if len(sys.argv) > 1 else int(os.getenv("WEB_CONCURRENCY", str(os.cpu_count() or 1)))
+    port = int(sys.argv[2]) if len(sys.argv) > 2 else int(os.getenv("PORT", str(DEFAULT_PORT)))
+    host = os.getenv("HOST", "0.0.0.0")
+
+    # A sincronização roda no mestre (os workers não iniciam o agendador do aquecimento)
+    sync_interval = float(os.getenv("SOURCE_SYNC_POLL_SECONDS", "0") or 0)
+    os.environ["SOURCE_SYNC_POLL_SECONDS"] = "0"
+    # Tokenizers do HuggingFace com paralelismo ativo não sobrevivem ao fork
+    os.environ.setdefault("TOKENIZERS_PARALLELISM", "false")
+
+    sidecar = None
+    if _env_flag("EMBEDDINGS_SIDECAR", "0"):
+        from embedding_sidecar import socket_path, start_sidecar
+
+        # O sidecar herda o provedor real; mestre e workers passam a falar com ele
+        sidecar = start_sidecar(socket_path())
+        os.environ["EMBEDDINGS_PROVIDER"] = "sidecar"
+
+    print(f"🚀 SERVIDOR PRÉ-FORK: {workers} workers na porta {port}"
+          f"{' (embeddings no sidecar)' if sidecar else ''}")
+    try:
+        PreforkServer(workers, host, port, sync_interval=sync_interval).run()
+    finally:
+        if sidecar is not None:
+            sidecar.terminate()
+            sidecar.wait(timeout=10)
+
+
+if __name__ == "__main__":
+    main()
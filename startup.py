@@ -0,0 +1,190 @@
+"""
+Inicialização da API em segundo plano
+Aquecimento (imports pesados, modelo de embeddings, índice, LLM) em uma thread com progresso
+por etapa para o endpoint de prontidão, e perfil de tempo de import para acompanhar regressões
+
+Uso:
+    python startup.py [modulo] [orcamento_ms]
+"""
+
+import json
+import logging
+import os
+import re
+import subprocess
+import sys
+import threading
+import time
+from dataclasses import asdict, dataclass
+from pathlib import Path
+from typing import Any, Callable, Dict, Optional, Sequence, Tuple
+
+startup_logger = logging.getLogger("startup")
+
+# Módulos que não devem ser carregados pelo ``import app`` (ficam para o aquecimento)
+HEAVY_MODULES = (
+    "langchain",
+    "langchain_community",
+    "langchain_google_genai",
+    "google.generativeai",
+    "sentence_transformers",
+    "torch",
+    "faiss",
+    "bs4",
+)
+
+IMPORT_PROFILE_PATH = "import_profile.json"
+_IMPORTTIME_LINE = re.compile(r"^import time:\s+(\d+) \|\s+(\d+) \|( *)(\S+)$")
+
+
+@dataclass
+class WarmupStep:
+    name: str
+    status: str = "pendente"  # pendente, executando, ok, erro
+    seconds: Optional[float] = None
+    error: Optional[str] = None
+
+
+class Warmup:
+    """
+    Executa etapas de aquecimento em sequência em uma thread daemon
+
+    Uma etapa com erro não interrompe as seguintes, mas deixa o serviço
+    como não pronto. ``wait`` permite que requisições que chegam durante o
+    aquecimento esperem por ele em vez de repetir o mesmo trabalho.
+    """
+
+    def __init__(self, steps: Sequence[Tuple[str, Callable[[], Any]]]):
+        self._steps = list(steps)
+        self.steps = [WarmupStep(name) for name, _ in self._steps]
+        self._done = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self.started_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+
+    def start(self) -> Optional[threading.Thread]:
+        """Inicia a thread (sem efeito se o aquecimento já rodou, ex.: no mestre do ``serving``)"""
+        if self._thread is not None or self._done.is_set():
+            return self._thread
+        self.started_at = time.monotonic()
+        self._thread = threading.Thread(target=self.run, name="warmup", daemon=True)
+        self._thread.start()
+        return self._thread
+
+    def run(self):
+        if self.started_at is None:
+            self.started_at = time.monotonic()
+        for step, (name, function) in zip(self.steps, self._steps):
+            step.status = "executando"
+            start = time.perf_counter()
+            try:
+                function()
+                step.status = "ok"
+            except Exception as e:
+                step.status = "erro"
+                step.error = str(e)
+                startup_logger.error(f"Aquecimento: etapa '{name}' falhou: {e}")
+            step.seconds = time.perf_counter() - start
+            startup_logger.info(f"Aquecimento: {name} ({step.status}) em {step.seconds:.2f}s")
+        self.finished_at = time.monotonic()
+        self._done.set()
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None and not self._done.is_set()
+
+    @property
+    def ready(self) -> bool:
+        return self._done.is_set() and all(step.status == "ok" for step in self.steps)
+
+    def wait(self, timeout: Optional[float] = None) -> bool:
+        """Espera o aquecimento terminar (retorna imediatamente se ele não foi iniciado)"""
+        if self._thread is None:
+            return True
+        return self._done.wait(timeout)
+
+    def status(self) -> Dict[str, Any]:
+        finished = sum(1 for step in self.steps if step.status in ("ok", "erro"))
+        end = self.finished_at or time.monotonic()
+        return {
+            'ready': self.ready,
+            'progress': finished / len(self.steps) if self.steps else 1.0,
+            'elapsed_seconds': (end - self.started_at) if self.started_at is not None else None,
+            'steps': [asdict(step) for step in self.steps],
+        }
+
+
+def profile_imports(module: str = "app", top: int = 15, env: Optional[Dict[str, str]] = None) -> Dict[str, Any]:
+    """
+    Tempo de ``import module`` em um interpretador novo (``python -X importtime``)
+
+    Retorna o total, os ``top`` imports diretos de ``module`` mais caros
+    (tempo cumulativo) e quais ``HEAVY_MODULES`` foram carregados.
+    """
+    env = {**os.environ, **(env or {})}
+    # o app exige DATABASE_URL ao ser importado; o perfil não abre conexão
+    env.setdefault("DATABASE_URL", "sqlite://")
+    completed = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {module}"],
+                               capture_output=True, text=True, env=env)
+    if completed.returncode != 0:
+        raise RuntimeError(f"Falha ao importar {module}: {completed.stderr.strip().splitlines()[-1:]}")
+
+    entries = []
+    for line in completed.stderr.splitlines():
+        match = _IMPORTTIME_LINE.match(line)
+        if match:
+            self_us, cumulative_us, indent, name = match.groups()
+            entries.append({'module': name, 'self_ms': int(self_us) / 1000,
+                            'cumulative_ms': int(cumulative_us) / 1000, 'depth': len(indent) // 2})
+
+    # o importtime lista os filhos (profundidade 1) antes da linha do próprio módulo
+    total, children, pending = None, [], []
+    for entry in entries:
+        if entry['depth'] == 1:
+            pending.append(entry)
+        elif entry['depth'] == 0:
+            if entry['module'] == module:
+                total, children = entry['cumulative_ms'], pending
+            pending = []
+    top_level = sorted(children, key=lambda entry: entry['cumulative_ms'], reverse=True)
+    loaded = {entry['module'] for entry in entries}
+    heavy = [name for name in HEAVY_MODULES if name in loaded]
+
+    return {
+        'module': module,
+        'total_ms': total,
+        'modules_loaded': len(entries),
+        'heavy_modules': heavy,
+        'top': [{key: entry[key] for key in ('module', 'cumulative_ms', 'self_ms')} for entry in top_level[:top]],
+    }
+
+
+def main():
+    """Função principal"""
+    module = sys.argv[1] if len(sys.argv) > 1 else "app"
+    budget_ms = float(sys.argv[2]) if len(sys.argv) > 2 else None
+
+    print(f"⏱️ PERFIL DE IMPORT: {module}")
+    print("=" * 40)
+    report = profile_imports(module)
+    print(f"Total: {report['total_ms']:.0f} ms ({report['modules_loaded']} módulos)")
+    for entry in report['top']:
+        print(f"   {entry['cumulative_ms']:8.1f} ms  {entry['module']}")
+
+    Path(IMPORT_PROFILE_PATH).write_text(json.dumps(report, ensure_ascii=False, indent=2), encoding="utf-8")
+    print(f"💾 Perfil salvo em {IMPORT_PROFILE_PATH}")
+
+    failed = False
+    if report['heavy_modules']:
+        print(f"❌ Módulos pesados carregados no import: {', '.join(report['heavy_modules'])}")
+        failed = True
+    if budget_ms is not None and (report['total_ms'] or 0) > budget_ms:
+        print(f"❌ Import acima do orçamento de {budget_ms:.0f} ms")
+        failed = True
+    if not failed:
+        print("✅ Import dentro do esperado")
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
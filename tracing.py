@@ -0,0 +1,188 @@
+"""
+Tempo por etapa do pipeline RAG
+Cada requisição acumula a duração das etapas (condensação, embedding, BM25, FAISS, LLM,
+gravação) e, ao final, alimenta histogramas Prometheus rotulados por versão do corpus e
+por acerto de cache; spans OpenTelemetry são emitidos quando habilitados
+"""
+
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+from metrics import ShardedMetrics, format_counter, format_histogram, render_lines
+
+tracing_logger = logging.getLogger("tracing")
+
+METRIC_PREFIX = "mosaic"
+
+
+def _env_flag(name: str, default: str) -> bool:
+    return os.getenv(name, default).strip().lower() not in {"0", "false"}
+
+
+TRACING_ENABLED = _env_flag("PIPELINE_METRICS", "1")
+OTEL_ENABLED = _env_flag("PIPELINE_OTEL", "0")
+
+PIPELINE_METRICS = ShardedMetrics()
+# Chave interna da métrica → (nome, rótulos), preenchido na primeira observação de cada combinação
+_LABELSETS: Dict[str, Tuple[str, Dict[str, str]]] = {}
+_LABELSETS_LOCK = threading.Lock()
+
+_tracer: Any = None
+if OTEL_ENABLED:
+    try:
+        from opentelemetry import trace as _otel_trace
+
+        # O provider/exportador é configurado pela aplicação (ex.: opentelemetry-instrument)
+        _tracer = _otel_trace.get_tracer("mosaic.rag")
+    except ImportError:
+        tracing_logger.warning("PIPELINE_OTEL ativo, mas opentelemetry-api não está instalado")
+
+
+def _metric_key(name: str, labels: Dict[str, str]) -> str:
+    key = name + "|" + "|".join(f"{label}={value}" for label, value in sorted(labels.items()))
+    if key not in _LABELSETS:
+        with _LABELSETS_LOCK:
+            _LABELSETS.setdefault(key, (name, dict(labels)))
+    return key
+
+
+def observe(name: str, seconds: float, **labels: str):
+    """Registra uma duração no histograma ``name`` com os rótulos dados"""
+    PIPELINE_METRICS.observe(_metric_key(name, labels), seconds)
+
+
+def inc(name: str, value: float = 1, **labels: str):
+    PIPELINE_METRICS.inc(_metric_key(name, labels), value)
+
+
+@dataclass
+class RequestTrace:
+    """Durações acumuladas por etapa de uma requisição"""
+    labels: Dict[str, str] = field(default_factory=dict)
+    stages: Dict[str, float] = field(default_factory=dict)
+    started: float = field(default_factory=time.perf_counter)
+
+    def add(self, stage: str, seconds: float):
+        self.stages[stage] = self.stages.get(stage, 0.0) + seconds
+
+    @property
+    def elapsed(self) -> float:
+        return time.perf_counter() - self.started
+
+
+_CURRENT_TRACE: ContextVar[Optional[RequestTrace]] = ContextVar("pipeline_trace", default=None)
+
+
+def current_trace() -> Optional[RequestTrace]:
+    return _CURRENT_TRACE.get()
+
+
+def set_trace_labels(**labels: str):
+    """Adiciona rótulos (ex.: ``corpus_version``, ``cache``) à requisição corrente"""
+    trace = _CURRENT_TRACE.get()
+    if trace is not None:
+        trace.labels.update({name: str(value) for name, value in labels.items()})
+
+
+@contextmanager
+def request_trace(operation: str, **labels: str) -> Iterator[Optional[RequestTrace]]:
+    """
+    Abre o rastreamento de uma requisição; ao sair, grava um histograma por etapa
+
+    Chamadas aninhadas reutilizam o rastreamento já aberto (o ``/api/chat``
+    abre o seu e o ``answer_question`` apenas o complementa). Com
+    ``PIPELINE_METRICS=0`` nada é medido.
+    """
+    if not TRACING_ENABLED or _CURRENT_TRACE.get() is not None:
+        yield _CURRENT_TRACE.get()
+        return
+
+    trace = RequestTrace(labels={name: str(value) for name, value in labels.items()})
+    token = _CURRENT_TRACE.set(trace)
+    span_context = _tracer.start_as_current_span(operation) if _tracer is not None else None
+    span = span_context.__enter__() if span_context is not None else None
+    status = "ok"
+    try:
+        yield trace
+    except BaseException:
+        status = "error"
+        raise
+    finally:
+        _CURRENT_TRACE.reset(token)
+        final_labels = {"operation": operation, **trace.labels}
+        for stage_name, seconds in trace.stages.items():
+            observe("rag_stage_seconds", seconds, stage=stage_name, **final_labels)
+        observe("rag_request_seconds", trace.elapsed, **final_labels)
+        inc("rag_requests_total", status=status, **final_labels)
+        if span is not None:
+            span.set_attributes(final_labels)
+            span_context.__exit__(None, None, None)
+
+
+def record_stage(stage_name: str, start: float, end: float):
+    """Soma ``end - start`` (``perf_counter``) à etapa na requisição corrente"""
+    trace = _CURRENT_TRACE.get()
+    if trace is None:
+        return
+    trace.add(stage_name, end - start)
+    if _tracer is not None:
+        now_ns, now = time.time_ns(), time.perf_counter()
+        span = _tracer.start_span(stage_name, start_time=now_ns - int((now - start) * 1e9),
+                                  attributes=trace.labels)
+        span.end(end_time=now_ns - int((now - end) * 1e9))
+
+
+@contextmanager
+def stage(stage_name: str) -> Iterator[None]:
+    """Mede um trecho como etapa da requisição corrente (sem custo fora de uma requisição)"""
+    if _CURRENT_TRACE.get() is None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_stage(stage_name, start, time.perf_counter())
+
+
+def callbacks() -> List[Any]:
+    """Callbacks para ``chain.invoke(..., config={"callbacks": ...})`` (vazio fora de uma requisição)"""
+    if _CURRENT_TRACE.get() is None:
+        return []
+    from tracing_langchain import StageCallbackHandler
+
+    return [StageCallbackHandler()]
+
+
+def traced_embeddings(embeddings: Any) -> Any:
+    """Embrulha um ``Embeddings`` para medir ``embed_query`` como etapa ``embedding``"""
+    from tracing_langchain import TracedEmbeddings
+
+    return TracedEmbeddings(embeddings)
+
+
+def render_prometheus() -> str:
+    """Histogramas e contadores do pipeline no formato de texto do Prometheus"""
+    lines: List[str] = []
+    headers = set()
+
+    for key in PIPELINE_METRICS.histogram_names():
+        name, labels = _LABELSETS[key]
+        metric = f"{METRIC_PREFIX}_{name}"
+        lines += format_histogram(metric, PIPELINE_METRICS.histogram(key), labels,
+                                  include_header=metric not in headers)
+        headers.add(metric)
+
+    for key, value in sorted(PIPELINE_METRICS.counters().items()):
+        name, labels = _LABELSETS[key]
+        metric = f"{METRIC_PREFIX}_{name}"
+        counter_lines = format_counter(metric, value, labels)
+        lines += counter_lines if metric not in headers else counter_lines[-1:]
+        headers.add(metric)
+    return render_lines(lines)
@@ -0,0 +1,121 @@
+"""
+Integração do ``tracing`` com o LangChain
+Callback que converte eventos das cadeias em etapas e embeddings que medem o embedding da
+pergunta; separado do ``tracing`` para que a API não importe o LangChain ao subir
+"""
+
+import threading
+import time
+from typing import Any, Dict, List, Optional, Tuple
+from uuid import UUID
+
+from langchain_core.callbacks import BaseCallbackHandler
+from langchain_core.embeddings import Embeddings
+
+from tracing import current_trace, record_stage, stage
+
+# Nomes de execução do LangChain → etapa
+RETRIEVER_STAGES = {
+    "BM25Retriever": "bm25",
+    "VectorStoreRetriever": "dense",
+    "EnsembleRetriever": "retrieval",
+    "FilteredHybridRetriever": "retrieval",
+}
+# Chamadas ao LLM abaixo desta cadeia geram a resposta; as demais condensam a pergunta
+ANSWER_CHAIN_NAME = "StuffDocumentsChain"
+
+
+class StageCallbackHandler(BaseCallbackHandler):
+    """
+    Converte eventos do LangChain em etapas: recuperadores pelo nome da execução e
+    chamadas ao LLM como ``condense`` ou ``llm`` conforme estejam sob a cadeia de resposta
+
+    O tempo do FAISS é o do recuperador denso descontado o embedding da pergunta
+    (medido por ``TracedEmbeddings``).
+    """
+
+    def __init__(self):
+        self._parents: Dict[UUID, Tuple[Optional[UUID], str]] = {}
+        self._started: Dict[UUID, Tuple[str, float, float]] = {}
+
+    def _under_answer_chain(self, run_id: Optional[UUID]) -> bool:
+        while run_id is not None and run_id in self._parents:
+            run_id, name = self._parents[run_id]
+            if name == ANSWER_CHAIN_NAME:
+                return True
+        return False
+
+    def _start(self, run_id: UUID, stage_name: str):
+        trace = current_trace()
+        embedding = trace.stages.get("embedding", 0.0) if trace is not None else 0.0
+        self._started[run_id] = (stage_name, time.perf_counter(), embedding)
+
+    def _end(self, run_id: UUID):
+        started = self._started.pop(run_id, None)
+        if started is None:
+            return
+        stage_name, start, embedding_before = started
+        end = time.perf_counter()
+        record_stage(stage_name, start, end)
+        if stage_name == "dense":
+            trace = current_trace()
+            embedding = (trace.stages.get("embedding", 0.0) if trace is not None else 0.0) - embedding_before
+            record_stage("faiss", start + embedding, end)
+
+    def on_chain_start(self, serialized: Dict[str, Any], inputs: Dict[str, Any], *, run_id: UUID,
+                       parent_run_id: Optional[UUID] = None, **kwargs: Any) -> None:
+        name = kwargs.get("name") or (serialized or {}).get("id", [""])[-1]
+        self._parents[run_id] = (parent_run_id, name)
+
+    def on_retriever_start(self, serialized: Dict[str, Any], query: str, *, run_id: UUID,
+                           parent_run_id: Optional[UUID] = None, **kwargs: Any) -> None:
+        # O EnsembleRetriever emite o evento sem ``name``, só com a serialização
+        name = kwargs.get("name") or (serialized or {}).get("id", [""])[-1]
+        stage_name = RETRIEVER_STAGES.get(name)
+        if stage_name:
+            self._start(run_id, stage_name)
+
+    def on_retriever_end(self, documents: Any, *, run_id: UUID, **kwargs: Any) -> None:
+        self._end(run_id)
+
+    def on_retriever_error(self, error: BaseException, *, run_id: UUID, **kwargs: Any) -> None:
+        self._end(run_id)
+
+    def on_llm_start(self, serialized: Dict[str, Any], prompts: List[str], *, run_id: UUID,
+                     parent_run_id: Optional[UUID] = None, **kwargs: Any) -> None:
+        self._start(run_id, "llm" if self._under_answer_chain(parent_run_id) else "condense")
+
+    def on_chat_model_start(self, serialized: Dict[str, Any], messages: List[List[Any]], *, run_id: UUID,
+                            parent_run_id: Optional[UUID] = None, **kwargs: Any) -> None:
+        self.on_llm_start(serialized, [], run_id=run_id, parent_run_id=parent_run_id)
+
+    def on_llm_end(self, response: Any, *, run_id: UUID, **kwargs: Any) -> None:
+        self._end(run_id)
+
+    def on_llm_error(self, error: BaseException, *, run_id: UUID, **kwargs: Any) -> None:
+        self._end(run_id)
+
+
+class TracedEmbeddings(Embeddings):
+    """
+    Embeddings que registram o tempo de ``embed_query`` como etapa ``embedding``
+
+    Guardam o último vetor de pergunta de cada thread: etapas seguintes da
+    mesma requisição (o modo extrativo) reaproveitam o embedding da busca.
+    """
+
+    def __init__(self, embeddings: Embeddings):
+        self.embeddings = embeddings
+        self._last_query = threading.local()
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return self.embeddings.embed_documents(texts)
+
+    def embed_query(self, text: str) -> List[float]:
+        last = getattr(self._last_query, "value", None)
+        if last is not None and last[0] == text:
+            return last[1]
+        with stage("embedding"):
+            vector = self.embeddings.embed_query(text)
+        self._last_query.value = (text, vector)
+        return vector